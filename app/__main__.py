@@ -1,59 +1,132 @@
 from __future__ import annotations
-import asyncio, logging, os
-from aiogram import Bot, Dispatcher
+import time
+
+# Before any other import: the ready time in the log includes them
+_STARTED = time.monotonic()
+
+import asyncio, logging, os, tempfile
 from dotenv import load_dotenv
-import sentry_sdk
-from sentry_sdk.integrations.asyncio import AsyncioIntegration
-from sentry_sdk.integrations.logging import LoggingIntegration
-from sentry_sdk.integrations.aiohttp import AioHttpIntegration
 
-from app.telegram.commander import setup_commands
-from app.telegram.routes import setup_routes
-from app.settings import get_settings
-from app.db import init_db
+from app.settings import RunMode, Settings, get_settings
 
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
-def init_sentry(dsn: str | None) -> None:
-    if not dsn:
-        return
-    sentry_sdk.init(
-        dsn=dsn,
-        traces_sample_rate=0.05,
-        enable_tracing=True,
-        integrations=[
-            LoggingIntegration(level=logging.INFO, event_level=logging.ERROR),
-            AioHttpIntegration(),
-            AsyncioIntegration(),
-        ],
-        environment=os.environ.get("ENVIRONMENT", "production"),
-        release=os.environ.get("RELEASE", "resume-bot@2"),
-        send_default_pii=True,
-    )
 
+async def _log_ready() -> None:
+    logger.info("Ready to handle updates %.2fs after start", time.monotonic() - _STARTED)
 
-async def async_main() -> None:
-    load_dotenv()
-    settings = get_settings()
+
+async def async_main(settings: Settings) -> None:
+    # Imported once main() has set PROMETHEUS_MULTIPROC_DIR: prometheus_client reads it at import
+    from app.bootstrap import (
+        add_cleanup_steps, build_bot, build_dispatcher, init_sentry, init_storage, start_background_tasks,
+        start_job_workers,
+    )
+    from app.lifecycle import InFlightUpdates, Shutdown
+    from app.metrics import start_metrics_server
+    from app.scheduler import init_scheduler
+    from app.telegram.commander import setup_commands
+    from app.telegram.sharding import attach_sharding
+    from app.utils.loop_watchdog import start_watchdog
+    from app.utils.outbound import wait_deliveries
 
     # llm_service = LLMService.build(settings)
     # result = await llm_service.full_feedback("Test resume text for LLM initialization.", "")
     # print(result)
 
     init_sentry(settings.sentry_dsn)
-    await init_db(settings.mongo_dsn, settings.db_name)
+    watchdog = start_watchdog(settings.watchdog)
+    await init_storage(settings)
+    background_tasks = start_background_tasks(settings)
+    metrics_server = None
+    if settings.metrics_port:
+        metrics_server = await start_metrics_server(settings.metrics_host, settings.metrics_port)
+
+    in_flight = InFlightUpdates()
+    shutdown = Shutdown(settings.shutdown_deadline_seconds)
+
+    async def drain_updates() -> None:
+        # start_polling emits the dispatcher shutdown as soon as polling stops: handlers still running
+        # finish before the other hooks (CommandsSync flushing), within the deadline of the steps below
+        await in_flight.wait(shutdown.begin())
 
-    bot = Bot(token=settings.telegram_token, parse_mode=None)
-    tg_messages_dispatcher = Dispatcher(settings=settings)
-    setup_routes(tg_messages_dispatcher)
+    bot = build_bot(settings)
+    tg_messages_dispatcher = build_dispatcher(settings, drain=drain_updates)
     await setup_commands(None, bot)
+    delivery_scheduler = init_scheduler(bot)
+    job_workers = start_job_workers(bot, settings)
 
-    await tg_messages_dispatcher.start_polling(bot, close_bot_session=True)
+    tg_messages_dispatcher.update.outer_middleware(in_flight)
+    shard_router = attach_sharding(tg_messages_dispatcher, settings)
+    tg_messages_dispatcher.startup.register(_log_ready)
+
+    # Added before polling: drain_updates() sets their time aside
+    if shard_router:
+        shutdown.add("shards", shard_router.stop)
+    if job_workers:
+        shutdown.add("jobs", job_workers.stop)
+    shutdown.add("deliveries", wait_deliveries)
+    shutdown.add("scheduler", delivery_scheduler.stop)
+    if metrics_server:
+        shutdown.add("metrics_server", lambda timeout: metrics_server.cleanup())
+    if watchdog:
+        shutdown.add("watchdog", lambda timeout: watchdog.stop())
+    add_cleanup_steps(shutdown, bot, background_tasks)
+
+    # Switching back from webhook mode: Telegram refuses getUpdates while a webhook is set
+    await bot.delete_webhook(drop_pending_updates=False)
+    try:
+        # Returns on SIGTERM/SIGINT once polling stopped and the dispatcher shutdown drained the updates
+        await tg_messages_dispatcher.start_polling(bot, close_bot_session=False)
+    finally:
+        await shutdown.run()
+
+
+async def register_webhook(settings: Settings) -> None:
+    """One-shot step before the uvicorn workers start, so they don't race each other on setWebhook."""
+    from app.bootstrap import build_bot, build_dispatcher
+    from app.telegram.commander import setup_commands
+
+    bot = build_bot(settings)
+    try:
+        await setup_commands(None, bot)
+        await bot.set_webhook(
+            url=settings.webhook.url.rstrip("/") + settings.webhook.path,
+            secret_token=settings.webhook.secret_token,
+            allowed_updates=build_dispatcher(settings).resolve_used_update_types(),
+            max_connections=settings.webhook.max_connections,
+        )
+    finally:
+        await bot.session.close()
+
+
+def run_webhook(settings: Settings) -> None:
+    import uvicorn
+
+    asyncio.run(register_webhook(settings))
+    uvicorn.run(
+        "app.web:create_app",
+        factory=True,
+        host=settings.webhook.host,
+        port=settings.webhook.port,
+        workers=settings.webhook.workers,
+    )
 
 
 def main() -> None:
+    load_dotenv()
+    settings = get_settings()
+    if settings.sharding.workers > 0 or (settings.run_mode == RunMode.WEBHOOK and settings.webhook.workers > 1):
+        # Every process writes its own samples to files, /metrics sums them up.
+        # Set before app.metrics is imported anywhere: the parent's own samples go to files too.
+        os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="prometheus_"))
+
     try:
-        asyncio.run(async_main())
+        if settings.run_mode == RunMode.WEBHOOK:
+            run_webhook(settings)
+        else:
+            asyncio.run(async_main(settings))
     except KeyboardInterrupt:
         pass
 
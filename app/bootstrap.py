@@ -0,0 +1,149 @@
+from __future__ import annotations
+import asyncio, logging, os
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, List, Optional
+
+from aiogram import Bot, Dispatcher
+
+from app.cv_analyzer.llm.client import close_clients
+from app.dal import AdmissionDAL, ExtractionsDAL, RollupsDAL, SectionAnalysesDAL
+from app.db import close_db, ensure_indexes as ensure_base_indexes, init_db
+from app.jobs import JobQueue, JobWorkerPool
+from app.lifecycle import Shutdown
+from app.retention import ensure_ttl_indexes, run_retention_loop
+from app.scheduler import DeliveryScheduler
+from app.settings import AdmissionBackend, IndexCreation, Settings
+from app.telegram.fsm_storage import MongoStorage
+from app.telegram.routes import setup_routes
+from app.utils.loop_watchdog import setup_handler_attribution
+from app.utils.outbound import OutboundDispatcher
+from app.utils.pdf_text import shutdown_pool as shutdown_pdf_pool
+
+logger = logging.getLogger(__name__)
+
+_index_task: Optional[asyncio.Task] = None
+
+
+def init_sentry(dsn: str | None) -> None:
+    if not dsn:
+        return
+
+    import sentry_sdk
+    from sentry_sdk.integrations.asyncio import AsyncioIntegration
+    from sentry_sdk.integrations.logging import LoggingIntegration
+    from sentry_sdk.integrations.aiohttp import AioHttpIntegration
+
+    sentry_sdk.init(
+        dsn=dsn,
+        traces_sample_rate=0.05,
+        enable_tracing=True,
+        integrations=[
+            LoggingIntegration(level=logging.INFO, event_level=logging.ERROR),
+            AioHttpIntegration(),
+            AsyncioIntegration(),
+        ],
+        environment=os.environ.get("ENVIRONMENT", "production"),
+        release=os.environ.get("RELEASE", "resume-bot@2"),
+        send_default_pii=True,
+    )
+
+
+def _fsm_storage(settings: Settings) -> MongoStorage:
+    return MongoStorage(ttl=timedelta(hours=settings.fsm_state_ttl_hours))
+
+
+async def ensure_indexes(settings: Settings) -> None:
+    await ensure_base_indexes()
+    await _fsm_storage(settings).ensure_indexes()
+    await ExtractionsDAL.ensure_indexes(timedelta(days=settings.extraction_cache_ttl_days))
+    await SectionAnalysesDAL.ensure_indexes(timedelta(days=settings.section_analysis.cache_ttl_days))
+    await RollupsDAL.ensure_indexes()
+    if settings.admission.enabled and settings.admission.backend == AdmissionBackend.MONGO:
+        await AdmissionDAL.ensure_indexes()
+    retention = settings.retention
+    await DeliveryScheduler.ensure_indexes(retention.scheduled_messages_ttl_days if retention.enabled else None)
+    await JobQueue.ensure_indexes(retention.jobs_ttl_days if retention.enabled else None)
+    if settings.retention.enabled:
+        await ensure_ttl_indexes(settings.retention)
+
+
+async def _ensure_indexes_in_background(settings: Settings) -> None:
+    try:
+        await ensure_indexes(settings)
+    except Exception:
+        logger.exception("Unable to create indexes")
+    else:
+        logger.info("Indexes are up to date")
+
+
+async def init_storage(settings: Settings) -> None:
+    global _index_task
+    await init_db(settings.mongo_dsn, settings.db_name)
+    if settings.index_creation == IndexCreation.STARTUP:
+        await ensure_indexes(settings)
+    elif settings.index_creation == IndexCreation.BACKGROUND:
+        # create_index on an existing index is a no-op on the server, but still a round trip each
+        _index_task = asyncio.create_task(_ensure_indexes_in_background(settings))
+
+
+def build_bot(settings: Settings, processes: int | None = None) -> Bot:
+    """`processes` overrides how many processes share the bot-wide limit, e.g. 1 for a tool with its own rate."""
+    session = None
+    if settings.telegram_api_url:
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_url))
+    bot = Bot(token=settings.telegram_token, parse_mode=None, session=session)
+    # Every process paces its own calls, together they must stay within the bot-wide limit
+    processes = processes or settings.sending_processes()
+    outbound = settings.outbound.model_copy(update={"global_rate": settings.outbound.global_rate / processes})
+    bot.session.middleware(OutboundDispatcher(outbound))
+    return bot
+
+
+def build_dispatcher(settings: Settings, drain: Callable[[], Awaitable[Any]] | None = None) -> Dispatcher:
+    """`drain` runs first on the dispatcher shutdown, before the hooks of the routes."""
+    dp = Dispatcher(storage=_fsm_storage(settings), settings=settings)
+    if drain is not None:
+        dp.shutdown.register(drain)
+    setup_routes(dp)
+    if settings.watchdog.debug:
+        setup_handler_attribution(dp)
+    return dp
+
+
+def start_job_workers(bot: Bot, settings: Settings) -> JobWorkerPool | None:
+    if not settings.jobs.embedded:
+        return None
+    pool = JobWorkerPool(bot, settings)
+    pool.start()
+    return pool
+
+
+def start_background_tasks(settings: Settings) -> List[asyncio.Task]:
+    tasks: List[asyncio.Task] = []
+    if settings.retention.enabled:
+        tasks.append(asyncio.create_task(run_retention_loop(settings)))
+    return tasks
+
+
+def add_cleanup_steps(shutdown: Shutdown, bot: Bot, background_tasks: List[asyncio.Task]) -> None:
+    """Last shutdown steps of every entrypoint, after draining: stop periodic work, close the pools."""
+    async def cancel_background_tasks(timeout: float) -> None:
+        tasks = [*background_tasks, *([_index_task] if _index_task else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def close_mongo(timeout: float) -> None:
+        close_db()
+
+    async def stop_pdf_workers(timeout: float) -> None:
+        shutdown_pdf_pool()
+
+    shutdown.add("background_tasks", cancel_background_tasks)
+    shutdown.add("pdf_workers", stop_pdf_workers)
+    shutdown.add("llm_clients", lambda timeout: close_clients())
+    shutdown.add("bot_session", lambda timeout: bot.session.close())
+    shutdown.add("mongo", close_mongo)
@@ -0,0 +1,164 @@
+"""
+One uploaded document as it travels through the analysis pipeline.
+
+The text is normalized once, when the document is created; tokens, section spans, the features
+of the static analysis and the similarity signature are computed on first use and cached,
+so no stage repeats that work.
+"""
+from __future__ import annotations
+import re
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, List
+
+from app.cv_analyzer.similarity import minhash, shingles
+
+SECTION_PATTERNS = [
+    r"\bопыт работы\b", r"\bопыт\b", r"\bexperience\b",
+    r"\bобразование\b", r"\beducation\b",
+    r"\bнавыки\b", r"\bskills\b",
+    r"\bпроекты\b", r"\bprojects?\b",
+    r"\bсертификаты\b", r"\bcertifications?\b",
+]
+
+# A heading is a short line starting with a section name
+_HEADING_RE = re.compile(
+    r"^[ \t\-•·*]*(?:"
+    r"(?P<experience>опыт работы|опыт|work experience|experience)|"
+    r"(?P<education>образование|education)|"
+    r"(?P<skills>ключевые навыки|навыки|skills)|"
+    r"(?P<projects>проекты|projects?)|"
+    r"(?P<certifications>сертификаты|certifications?)|"
+    r"(?P<about>о себе|about me|summary)"
+    r")\b[^\n]{0,40}$",
+    flags=re.I | re.M,
+)
+
+_SPACES_RE = re.compile(r"[\u200b\ufeff\xa0]")
+_NEWLINES_RE = re.compile(r"\r\n?|\x0c")
+_CONTROL_RE = re.compile(r"[\x00-\x08\x0b\x0e-\x1f\x7f]")
+_TOKEN_RE = re.compile(r"[A-Za-zА-Яа-яЁё0-9\-\+%$€₽]+")
+_NUMBER_RE = re.compile(r"(\b\d{4}\b|\b\d+%\b|\b\d+[\.,]\d+\b|\b\d+\b)")
+_BULLET_RE = re.compile(r"^[\s\-•·•*]+", flags=re.M)
+_CONTACTS_RE = re.compile(r"@|\+\d|https?://|linkedin\.com|github\.com|portfolio", flags=re.I)
+_STACK_RE = re.compile(r"(?i)python|sql|java|js|golang|kotlin|swift|c\+\+|c#")
+_LEADERSHIP_RE = re.compile(r"(?i)lead|руковод|менедж|team")
+_YEAR_RE = re.compile(r"\b\d{4}\b")
+_CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]")
+
+# Shorter sections are analysed together with the one before them
+SEGMENT_MIN_CHARS = 200
+
+# Rough tokenizer ratios of the OpenAI models: Cyrillic costs about twice as many tokens per character
+_CHARS_PER_TOKEN_CYRILLIC = 2.5
+_CHARS_PER_TOKEN_OTHER = 4.0
+
+
+def normalize_text(raw: str) -> str:
+    text = _NEWLINES_RE.sub("\n", raw)
+    text = _SPACES_RE.sub(" ", text)
+    return _CONTROL_RE.sub("", text)
+
+
+@dataclass(frozen=True)
+class SectionSpan:
+    name: str
+    start: int
+    end: int
+
+
+@dataclass(frozen=True)
+class ResumeFeatures:
+    word_count: int
+    sections_found: Dict[str, bool]
+    metrics_density: float
+    bullets: int
+    contacts: bool
+    has_stack: bool
+    has_leadership: bool
+    has_years: bool
+
+
+@dataclass(eq=False)
+class ResumeDocument:
+    """
+    Normalized text of an upload with its digest. Vacancies use the same type.
+    Build with `from_raw` for freshly extracted text; the constructor takes text that is already normalized.
+    """
+    digest: str
+    text: str
+    path: str = ""
+
+    @classmethod
+    def from_raw(cls, raw: str, digest: str, path: str = "") -> "ResumeDocument":
+        return cls(digest=digest, text=normalize_text(raw), path=path)
+
+    def __bool__(self) -> bool:
+        return bool(self.text.strip())
+
+    @cached_property
+    def tokens(self) -> List[str]:
+        return _TOKEN_RE.findall(self.text)
+
+    @cached_property
+    def section_spans(self) -> List[SectionSpan]:
+        headings = [(m.lastgroup, m.start()) for m in _HEADING_RE.finditer(self.text)]
+        return [
+            SectionSpan(name, start, headings[i + 1][1] if i + 1 < len(headings) else len(self.text))
+            for i, (name, start) in enumerate(headings)
+        ]
+
+    @cached_property
+    def segments(self) -> List[SectionSpan]:
+        """
+        The whole text cut at the headings: the part before the first heading is the "header",
+        repeated and short sections are joined with the previous one.
+        """
+        spans = self.section_spans
+        if not spans:
+            return [SectionSpan("document", 0, len(self.text))]
+        result: List[SectionSpan] = []
+        if self.text[:spans[0].start].strip():
+            result.append(SectionSpan("header", 0, spans[0].start))
+        for span in spans:
+            if result and (span.name == result[-1].name or span.end - span.start < SEGMENT_MIN_CHARS):
+                result[-1] = SectionSpan(result[-1].name, result[-1].start, span.end)
+            else:
+                result.append(span)
+        return result
+
+    def section_text(self, span: SectionSpan) -> str:
+        return self.text[span.start:span.end].strip()
+
+    @cached_property
+    def token_estimate(self) -> int:
+        cyrillic = len(_CYRILLIC_RE.findall(self.text))
+        other = len(self.text) - cyrillic
+        return int(cyrillic / _CHARS_PER_TOKEN_CYRILLIC + other / _CHARS_PER_TOKEN_OTHER) + 1
+
+    @cached_property
+    def features(self) -> ResumeFeatures:
+        word_count = len(self.tokens)
+        return ResumeFeatures(
+            word_count=word_count,
+            sections_found={pat: bool(re.search(pat, self.text, flags=re.I)) for pat in SECTION_PATTERNS},
+            metrics_density=len(_NUMBER_RE.findall(self.text)) / max(1, word_count),
+            bullets=len(_BULLET_RE.findall(self.text)),
+            contacts=_CONTACTS_RE.search(self.text) is not None,
+            has_stack=_STACK_RE.search(self.text) is not None,
+            has_leadership=_LEADERSHIP_RE.search(self.text) is not None,
+            has_years=_YEAR_RE.search(self.text) is not None,
+        )
+
+    @cached_property
+    def signature(self) -> List[int]:
+        """MinHash of the word shingles, see app.cv_analyzer.similarity."""
+        return minhash(shingles(self.tokens))
+
+    def excerpt(self, max_tokens: int) -> str:
+        """The beginning of the text within about max_tokens, cut at a line end."""
+        if self.token_estimate <= max_tokens:
+            return self.text
+        limit = len(self.text) * max_tokens // self.token_estimate
+        cut = self.text.rfind("\n", 0, limit)
+        return self.text[:cut if cut > 0 else limit]
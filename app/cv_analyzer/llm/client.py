@@ -1,12 +1,11 @@
 import json
 import logging
 import re
-from typing import Any
+from typing import Any, Dict, Tuple
 
-import json_repair
-from openai import BaseModel, AsyncOpenAI
+from pydantic import BaseModel
 
-from app.settings import LLMSettings
+from app.settings import LLMEndpoint
 
 logger = logging.getLogger(__name__)
 
@@ -22,42 +21,55 @@ class LLMParseResult(BaseModel):
     success: bool
 
 
-class OpenAIClient:
-    def __init__(self, settings: LLMSettings):
-        self._model = settings.general_model
-        self._small_model = settings.small_model
+def parse_json_response(content: str) -> LLMParseResult:
+    import json_repair
 
-        self._client = AsyncOpenAI(
-            api_key=settings.api_key,
-            base_url=settings.base_url,
+    try:
+        return LLMParseResult(
+            data=json_repair.loads(remove_control_characters_re(content)),
+            success=True,
+            raw=content,
         )
-
-    async def gen_json(self, system: str, user: str, use_small_model: bool = False) -> LLMParseResult:
-        content = await self._post(system, user, use_small_model=use_small_model)
-
+    except Exception:
         try:
+            logger.exception("Unable to parse LLM response as JSON")
             return LLMParseResult(
-                data=json_repair.loads(remove_control_characters_re(content)),
+                data=json.loads(content.strip().split("```json")[-1].split("```")[-2]),
                 success=True,
                 raw=content,
             )
-        except Exception:
-            try:
-                logger.exception("Unable to parse LLM response as JSON")
-                return LLMParseResult(
-                    data=json.loads(content.strip().split("```json")[-1].split("```")[-2]),
-                    success=True,
-                    raw=content,
-                )
-            except:
-                logger.exception("Unable to parse LLM response second time")
-                return LLMParseResult(
-                    data={},
-                    success=False,
-                    raw=content,
-                )
-
-    async def _post(self, system: str, user: str, use_small_model: bool) -> str:
+        except:
+            logger.exception("Unable to parse LLM response second time")
+            return LLMParseResult(
+                data={},
+                success=False,
+                raw=content,
+            )
+
+
+class OpenAIClient:
+    def __init__(self, endpoint: LLMEndpoint):
+        self._model = endpoint.general_model
+        self._small_model = endpoint.small_model
+
+        # openai is imported by the first analysis, not at bot startup
+        from openai import AsyncOpenAI
+
+        self._client = AsyncOpenAI(
+            api_key=endpoint.api_key,
+            base_url=endpoint.base_url,
+            timeout=endpoint.timeout_seconds,
+            # LLMRouter retries on another endpoint; SDK retries would hold a call on a slow one for minutes
+            max_retries=0,
+        )
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    async def gen_json(self, system: str, user: str, use_small_model: bool = False) -> LLMParseResult:
+        return parse_json_response(await self.complete(system, user, use_small_model=use_small_model))
+
+    async def complete(self, system: str, user: str, use_small_model: bool = False) -> str:
         if "api.openai.com" in str(self._client.base_url):
             response = await self._client.responses.create(
                 model=self._small_model if use_small_model else self._model,
@@ -75,3 +87,22 @@ class OpenAIClient:
                 ],
             )
             return response.choices[0].message.content
+
+
+# One client, and so one HTTP connection pool, per endpoint for the whole process
+_clients: Dict[Tuple[str, str, str, str], OpenAIClient] = {}
+
+
+def get_client(endpoint: LLMEndpoint) -> OpenAIClient:
+    key = (endpoint.base_url, endpoint.api_key, endpoint.general_model, endpoint.small_model)
+    client = _clients.get(key)
+    if client is None:
+        client = _clients[key] = OpenAIClient(endpoint)
+    return client
+
+
+async def close_clients() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.close()
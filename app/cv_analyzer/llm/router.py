@@ -0,0 +1,174 @@
+"""
+Routing of LLM calls across several OpenAI compatible endpoints.
+
+Every call goes to the healthy endpoint with the lowest expected latency: the moving average of its
+latency for that model size, scaled by the calls already in flight there and by its recent error rate.
+An endpoint failing `failures_to_open` times in a row is taken out of rotation for a cooldown, after
+which one probe call decides whether it comes back. Canary endpoints get a fixed share of calls.
+"""
+from __future__ import annotations
+import logging, random, time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from app.cv_analyzer.llm.client import LLMParseResult, get_client, parse_json_response
+from app.metrics import LLM_CALL_SECONDS, LLM_CALLS, LLM_CIRCUIT_OPEN
+from app.settings import LLMEndpoint, LLMSettings
+
+logger = logging.getLogger(__name__)
+
+# An endpoint that failed every recent call looks this many times slower
+ERROR_PENALTY = 4.0
+# Statuses that are the request's fault: another endpoint would answer the same.
+# 401, 403 and 404 mean a bad key or an unknown model of this endpoint and count against it.
+_REQUEST_ERRORS = {400, 413, 422}
+
+
+def _caller_error(e: Exception) -> bool:
+    return getattr(e, "status_code", None) in _REQUEST_ERRORS
+
+
+@dataclass
+class EndpointState:
+    endpoint: LLMEndpoint
+    name: str
+    # Seconds, per model size: small model calls are much shorter
+    latency: Dict[bool, Optional[float]] = field(default_factory=lambda: {False: None, True: None})
+    error_rate: float = 0.0
+    in_flight: int = 0
+    consecutive_failures: int = 0
+    # Times the breaker opened without a successful call in between
+    trips: int = 0
+    open_until: float = 0.0
+    probing: bool = False
+
+    def available(self, now: float) -> bool:
+        if self.trips == 0:
+            return True
+        # Half-open after the cooldown: a single probe call at a time
+        return now >= self.open_until and not self.probing
+
+    def cost(self, small: bool, default_latency: float) -> float:
+        latency = self.latency[small]
+        if latency is None:
+            latency = default_latency
+        return latency * (1 + self.in_flight) * (1 + ERROR_PENALTY * self.error_rate) / self.endpoint.weight
+
+
+class LLMRouter:
+    """Drop-in for OpenAIClient in LLMService."""
+
+    def __init__(self, settings: LLMSettings) -> None:
+        self._settings = settings
+        self._states = [
+            EndpointState(endpoint, endpoint.name or urlparse(endpoint.base_url).netloc or endpoint.base_url)
+            for endpoint in settings.all_endpoints()
+        ]
+
+    @property
+    def states(self) -> List[EndpointState]:
+        return self._states
+
+    async def gen_json(self, system: str, user: str, use_small_model: bool = False) -> LLMParseResult:
+        return parse_json_response(await self.complete(system, user, use_small_model=use_small_model))
+
+    async def complete(self, system: str, user: str, use_small_model: bool = False) -> str:
+        tried: List[EndpointState] = []
+        while True:
+            state = self._pick(use_small_model, exclude=tried)
+            tried.append(state)
+            try:
+                return await self._call(state, system, user, use_small_model)
+            except Exception as e:
+                if _caller_error(e) or len(tried) >= min(self._settings.max_attempts, len(self._states)):
+                    raise
+                logger.warning("LLM endpoint %s failed (%r), trying another one", state.name, e)
+
+    def _pick(self, small: bool, exclude: List[EndpointState]) -> EndpointState:
+        now = time.monotonic()
+        candidates = [state for state in self._states if state not in exclude]
+        healthy = [state for state in candidates if state.available(now)]
+        if not healthy:
+            # Everything is out of rotation: better a call to the endpoint closest to its probe than none
+            state = min(candidates, key=lambda s: s.open_until)
+            logger.warning("No healthy LLM endpoint, calling %s", state.name)
+            return state
+
+        canaries = [state for state in healthy if state.endpoint.canary_share > 0]
+        regular = [state for state in healthy if state.endpoint.canary_share <= 0]
+        draw = random.random()
+        for state in canaries:
+            if draw < state.endpoint.canary_share:
+                return state
+            draw -= state.endpoint.canary_share
+
+        pool = regular or canaries
+        known = [state.latency[small] for state in pool if state.latency[small] is not None]
+        # An endpoint without calls yet is assumed as fast as the best one, so it gets tried;
+        # a misconfigured one fails over and leaves the rotation after failures_to_open calls
+        default_latency = min(known, default=1.0)
+        return min(pool, key=lambda s: s.cost(small, default_latency))
+
+    async def _call(self, state: EndpointState, system: str, user: str, small: bool) -> str:
+        probe = bool(state.trips) and time.monotonic() >= state.open_until
+        if probe:
+            state.probing = True
+        state.in_flight += 1
+        started = time.monotonic()
+        try:
+            content = await get_client(state.endpoint).complete(system, user, use_small_model=small)
+        except Exception as e:
+            if _caller_error(e):
+                LLM_CALLS.labels(state.name, "rejected").inc()
+            else:
+                LLM_CALLS.labels(state.name, "error").inc()
+                self._failed(state)
+            raise
+        finally:
+            state.in_flight -= 1
+            if probe:
+                state.probing = False
+
+        elapsed = time.monotonic() - started
+        LLM_CALLS.labels(state.name, "ok").inc()
+        LLM_CALL_SECONDS.labels(state.name, "small" if small else "general").observe(elapsed)
+        self._succeeded(state, small, elapsed)
+        return content
+
+    def _succeeded(self, state: EndpointState, small: bool, elapsed: float) -> None:
+        alpha = self._settings.ewma_alpha
+        previous = state.latency[small]
+        state.latency[small] = elapsed if previous is None else alpha * elapsed + (1 - alpha) * previous
+        state.error_rate *= 1 - alpha
+        state.consecutive_failures = 0
+        if state.trips:
+            logger.info("LLM endpoint %s is back in rotation", state.name)
+            state.trips = 0
+            LLM_CIRCUIT_OPEN.labels(state.name).set(0)
+
+    def _failed(self, state: EndpointState) -> None:
+        alpha = self._settings.ewma_alpha
+        state.error_rate = alpha + (1 - alpha) * state.error_rate
+        state.consecutive_failures += 1
+        # A failed probe reopens right away, otherwise after enough failures in a row
+        if state.trips or state.consecutive_failures >= self._settings.failures_to_open:
+            state.trips += 1
+            cooldown = min(
+                self._settings.cooldown_seconds * 2 ** (state.trips - 1), self._settings.max_cooldown_seconds,
+            )
+            state.open_until = time.monotonic() + cooldown
+            logger.warning("LLM endpoint %s is out of rotation for %.0fs", state.name, cooldown)
+            LLM_CIRCUIT_OPEN.labels(state.name).set(1)
+
+
+# One router per settings, so its statistics cover all calls of the process
+_routers: Dict[str, LLMRouter] = {}
+
+
+def get_router(settings: LLMSettings) -> LLMRouter:
+    key = settings.model_dump_json()
+    router = _routers.get(key)
+    if router is None:
+        router = _routers[key] = LLMRouter(settings)
+    return router
@@ -1,22 +1,267 @@
+import asyncio
+import difflib
+import hashlib
+import json
 import logging
+from typing import Dict, List, Set
+
 import sentry_sdk
 
-from app.cv_analyzer.llm.client import OpenAIClient
+from app.cv_analyzer.document import ResumeDocument, SectionSpan
+from app.cv_analyzer.llm.client import LLMParseResult, OpenAIClient
+from app.cv_analyzer.llm.router import LLMRouter, get_router
+from app.dal import SectionAnalysesDAL
+from app.metrics import SECTION_CACHE
 from app.models import AnalysisDetail, CheckFileResult
 from app.settings import Settings, LLMSettings
 
 logger = logging.getLogger(__name__)
 
+FEEDBACK_SYSTEM_PROMPT = """
+Ты — эксперт по анализу резюме с 15-летним опытом работы HR-директором в крупных компаниях. Твоя задача — провести глубокий профессиональный анализ резюме и дать конкретные рекомендации по улучшению.
+
+КОНТЕКСТ АНАЛИЗА:
+- Анализируешь резюме для российского рынка труда 2025 года. Рынок локальный и большой, поэтому не всегда нужны знания английского и другие вещи, актуальные для международного рынка
+- Учитываешь требования ATS-систем hh.ru, Работа.ру и корпоративных систем подбора
+- Учитывай резюме с hh.ru и других сайтов аггрегаторов. Они скорее всего будут иметь специальную шапку. В такие нельзя вставить summary или изменить структуру
+- Оцениваешь резюме так, как его увидит HR-менеджер за первые 30 секунд просмотра
+
+СТРУКТУРА АНАЛИЗА:
+
+1. ОБЩАЯ ОЦЕНКА (0-100 баллов)
+Дай итоговую оценку резюме и объясни её в 2-3 предложениях.
+
+ВАЖНЫЕ ПРАВИЛА:
+- Будь конкретным: вместо "улучшите описание опыта" напиши что-то вроде "замените фразу «X» на «Y»"
+- Цитируй проблемные места из резюме в кавычках «»
+- Давай примеры улучшенных формулировок
+- Указывай метрики и цифры, которых не хватает
+- Игнорируй служебную информацию с job-сайтов
+- Фокусируйся на проблемах, которые реально влияют на отклики
+
+
+ФОРМАТ ОТВЕТА СТРОГО JSON: {\"score\": int 0..100, \"strengths\":[string], \"problems\":[string], \"actions\":[string], \"sections\":{string:int 0..10}}. Давайте конкретику и метрики. Не добавляйте ничего вне JSON.
+Как должны быть заполнены поля:
+- в поле "score" пиши итоговую оценку от 0 до 100.
+- в поле "strengths" пиши конкретные сильные стороны резюме. Порядка 3-5 пунктов, если это необходимо.
+- в поле "problems" пиши конкретные проблемы резюме. Порядка 5-10 пунктов, если это необходимо.
+- в поле "actions" пиши конкретные шаги по улучшению резюме. Порядка 5-10 пунктов, если это необходимо.
+
+Если какого-то из полей нет, не нужно писать туда никакие значения.
+"""
+
+DIFF_SYSTEM_PROMPT = FEEDBACK_SYSTEM_PROMPT + """
+ПОВТОРНЫЙ АНАЛИЗ:
+Пользователь уже получал анализ предыдущей версии этого резюме и внёс правки. Тебе дан прошлый анализ в JSON
+и изменения резюме в формате unified diff (строки с «-» удалены, с «+» добавлены).
+Обнови прошлый анализ с учётом изменений: убери исправленные проблемы, добавь новые, пересчитай оценку.
+Верни полный анализ в той же JSON-схеме.
+"""
+
+# A diff this large compared to the resume saves nothing over a full analysis
+MAX_DIFF_SHARE = 0.5
+
+SECTION_SYSTEM_PROMPT = """
+Ты — эксперт по анализу резюме с 15-летним опытом работы HR-директором в крупных компаниях.
+Тебе дан один раздел резюме для российского рынка труда. Оцени только этот раздел, не требуй от него того, что обычно
+пишут в других разделах.
+
+ВАЖНЫЕ ПРАВИЛА:
+- Будь конкретным: вместо "улучшите описание опыта" напиши что-то вроде "замените фразу «X» на «Y»"
+- Цитируй проблемные места в кавычках «»
+- Указывай метрики и цифры, которых не хватает
+- Игнорируй служебную информацию с job-сайтов
+
+ФОРМАТ ОТВЕТА СТРОГО JSON: {\"score\": int 0..10, \"strengths\":[string], \"problems\":[string], \"actions\":[string]}.
+Не больше 3 пунктов в каждом списке. Не добавляйте ничего вне JSON.
+"""
+
+MATCH_SYSTEM_PROMPT = """
+Ты — эксперт по подбору персонала с 15-летним опытом работы HR-директором в крупных компаниях.
+Тебе даны резюме кандидата и описание одной вакансии. Оцени, насколько кандидат подходит на эту вакансию,
+так, как это сделал бы рекрутер на первом просмотре для российского рынка труда.
+
+ВАЖНЫЕ ПРАВИЛА:
+- Сравнивай требования вакансии с тем, что написано в резюме, не додумывай опыт
+- Будь конкретным: называй требования вакансии и места резюме, которые им соответствуют или нет
+- В "actions" пиши, что поменять в резюме именно под эту вакансию
+
+ФОРМАТ ОТВЕТА СТРОГО JSON: {\"title\": string, \"match\": int 0..100, \"strengths\":[string], \"gaps\":[string], \"actions\":[string]}.
+В "title" — название должности из вакансии. Не больше 5 пунктов в каждом списке. Не добавляйте ничего вне JSON.
+"""
+
+# Bump when the section prompt changes: cached results of the old prompt stop matching
+SECTION_PROMPT_VERSION = "1"
+
+SECTION_TITLES = {
+    "header": "Шапка и контакты",
+    "about": "О себе",
+    "experience": "Опыт работы",
+    "education": "Образование",
+    "skills": "Навыки",
+    "projects": "Проекты",
+    "certifications": "Сертификаты",
+    "document": "Резюме",
+}
+# Share of a section in the overall score, and the order of its points in the report
+SECTION_WEIGHTS = {
+    "experience": 4.0,
+    "skills": 2.0,
+    "projects": 2.0,
+    "header": 1.0,
+    "about": 1.0,
+    "education": 1.0,
+    "certifications": 0.5,
+}
+REQUIRED_SECTIONS = ("experience", "education", "skills")
+MAX_POINTS = {"strengths": 5, "problems": 10, "actions": 10}
+
+# A vacancy is context of every section prompt: its beginning is enough
+SECTION_VACANCY_TOKENS = 800
+
+# A filter needs the beginning of a document, not all of it
+VALIDITY_EXCERPT_TOKENS = 1500
+
+
+def _reference(document: ResumeDocument) -> str:
+    # Stored prompts point at the extraction cache instead of holding another copy of the text
+    return f"<document {document.digest}>"
+
+
+def _diff(previous: ResumeDocument, cv: ResumeDocument) -> str:
+    lines = difflib.unified_diff(previous.text.splitlines(), cv.text.splitlines(), lineterm="", n=1)
+    # Skips the ---/+++ file headers
+    return "\n".join(line for line in lines if not line.startswith(("---", "+++")))
+
+
+def _diff_prompt(previous_report: str, diff: str) -> str:
+    return f"""
+Прошлый анализ:
+{previous_report}
+
+Изменения резюме:
+---
+{diff}
+---
+
+В качестве результата верни JSON С УКАЗАННОЙ СХЕМОЙ"""
+
+
+def _section_key(name: str, text: str, vacancy: ResumeDocument | None) -> str:
+    digest = hashlib.sha256()
+    for part in (SECTION_PROMPT_VERSION, name, text, vacancy.digest if vacancy else ""):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _section_prompt(name: str, text: str, vacancy: ResumeDocument | None) -> str:
+    user = f"""
+Раздел резюме «{SECTION_TITLES.get(name, name)}»:
+---
+{text}
+---
+"""
+    if vacancy:
+        user += f"""
+Резюме отправлено на вакансию:
+---
+{vacancy.excerpt(SECTION_VACANCY_TOKENS)}
+---
+"""
+    user += "\nВ качестве результата верни JSON С УКАЗАННОЙ СХЕМОЙ"
+    return user
+
+
+def _merge_sections(segments: List[SectionSpan], results: List[LLMParseResult], headings: Set[str]) -> AnalysisDetail:
+    """Without another LLM call: weighted score, points ordered by section weight, duplicates dropped."""
+    sections: Dict[str, int] = {}
+    points: Dict[str, List[str]] = {field: [] for field in MAX_POINTS}
+    weighted = total_weight = 0.0
+
+    ranked = sorted(zip(segments, results), key=lambda pair: SECTION_WEIGHTS.get(pair[0].name, 1.0), reverse=True)
+    for segment, result in ranked:
+        if not result.success:
+            continue
+        try:
+            score = max(0, min(10, int(result.data.get("score", 0))))
+        except (TypeError, ValueError):
+            score = 0
+        title = SECTION_TITLES.get(segment.name, segment.name)
+        sections[title if title not in sections else f"{title} ({segment.start})"] = score
+        weight = SECTION_WEIGHTS.get(segment.name, 1.0)
+        weighted += weight * score
+        total_weight += weight
+        for field in points:
+            values = result.data.get(field, [])
+            if isinstance(values, list):
+                points[field].extend(str(value) for value in values)
+
+    missing = [SECTION_TITLES[name] for name in REQUIRED_SECTIONS if name not in headings]
+    if missing:
+        points["problems"].insert(0, f"Не найдены разделы: {', '.join(missing)}. Выделите их заголовками.")
+
+    for field, limit in MAX_POINTS.items():
+        unique: Dict[str, str] = {}
+        for point in points[field]:
+            unique.setdefault(point.lower(), point)
+        points[field] = list(unique.values())[:limit]
+
+    return AnalysisDetail(
+        score=round(weighted / total_weight * 10) if total_weight else 0,
+        strengths=points["strengths"],
+        problems=points["problems"],
+        actions=points["actions"],
+        sections=sections,
+        ok=total_weight > 0,
+        raw=json.dumps([result.raw for result in results if not result.success], ensure_ascii=False),
+        prompt="",
+    )
+
+
+def _match_prompt(cv_text: str, vacancy_text: str) -> str:
+    # The resume goes first: prompts for all vacancies of a batch share the prefix, which providers cache
+    return f"""
+Резюме кандидата:
+---
+{cv_text}
+---
+
+Вакансия:
+---
+{vacancy_text}
+---
+
+В качестве результата верни JSON С УКАЗАННОЙ СХЕМОЙ"""
+
+
+def _feedback_prompt(cv_text: str, vacancy_text: str) -> str:
+    user = f"""
+Проанализируйте резюме ниже.
+---
+{cv_text}
+---
+"""
+    if vacancy_text:
+        user += f"""
+Описание вакансии для резюме выгдядит вот так:
+---
+{vacancy_text}
+---
+"""
+    user += "\nВ качестве результата верни JSON С УКАЗАННОЙ СХЕМОЙ"
+    return user
+
 
 class LLMService:
-    def __init__(self, client: OpenAIClient):
+    def __init__(self, client: LLMRouter | OpenAIClient):
         self._client = client
 
     @classmethod
     def build(cls, settings: LLMSettings) -> "LLMService":
-        return LLMService(OpenAIClient(settings))
+        return LLMService(get_router(settings))
 
-    async def check_resume_is_valid(self, cv_info: str) -> CheckFileResult:
+    async def check_resume_is_valid(self, cv: ResumeDocument) -> CheckFileResult:
         sys = """
 Ты — фильтр входящих сообщений.  Твоя задача - определить, похоже ли сообщение пользователя на текст резюме.  
 
@@ -32,7 +277,7 @@ class LLMService:
         user = f"""
 Проверь, является ли следующий текст резюме:
 ---
-{cv_info}
+{cv.excerpt(VALIDITY_EXCERPT_TOKENS)}
 ---
 """
         result = await self._client.gen_json(sys, user, use_small_model=True)
@@ -41,7 +286,7 @@ class LLMService:
             reason=result.data.get("reason", ""),
         )
 
-    async def check_vacancy_is_valid(self, vacancy_info: str) -> CheckFileResult:
+    async def check_vacancy_is_valid(self, vacancy: ResumeDocument) -> CheckFileResult:
         sys = """
     Ты — фильтр входящих сообщений. Твоя задача - определить, похоже ли сообщение пользователя на описание вакансии. Если нет - укажи почему.
 
@@ -57,7 +302,7 @@ class LLMService:
         user = f"""
     Проверь, является ли следующий текст описанием вакансии:
     ---
-    {vacancy_info}
+    {vacancy.excerpt(VALIDITY_EXCERPT_TOKENS)}
     ---
     """
         result = await self._client.gen_json(sys, user, use_small_model=True)
@@ -66,67 +311,107 @@ class LLMService:
             reason=result.data.get("reason", ""),
         )
 
-    async def full_feedback(self, cv_info: str, vacancy_info: str) -> AnalysisDetail:
-        sys = """
-Ты — эксперт по анализу резюме с 15-летним опытом работы HR-директором в крупных компаниях. Твоя задача — провести глубокий профессиональный анализ резюме и дать конкретные рекомендации по улучшению.
+    async def full_feedback(self, cv: ResumeDocument, vacancy: ResumeDocument | None) -> AnalysisDetail:
+        sys = FEEDBACK_SYSTEM_PROMPT
+        user = _feedback_prompt(cv.text, vacancy.text if vacancy else "")
 
-КОНТЕКСТ АНАЛИЗА:
-- Анализируешь резюме для российского рынка труда 2025 года. Рынок локальный и большой, поэтому не всегда нужны знания английского и другие вещи, актуальные для международного рынка
-- Учитываешь требования ATS-систем hh.ru, Работа.ру и корпоративных систем подбора
-- Учитывай резюме с hh.ru и других сайтов аггрегаторов. Они скорее всего будут иметь специальную шапку. В такие нельзя вставить summary или изменить структуру
-- Оцениваешь резюме так, как его увидит HR-менеджер за первые 30 секунд просмотра
+        with sentry_sdk.start_transaction(
+                name="The result of the AI inference",
+                op="ai-inference",
+        ):
+            llm_parse_result = await self._client.gen_json(sys, user)
 
-СТРУКТУРА АНАЛИЗА:
+        return AnalysisDetail(
+            score=llm_parse_result.data.get("score", 0),
+            strengths=llm_parse_result.data.get("strengths", []),
+            problems=llm_parse_result.data.get("problems", []),
+            actions=llm_parse_result.data.get("actions", []),
+            sections=llm_parse_result.data.get("sections", {}),
+            ok=llm_parse_result.success,
+            raw=llm_parse_result.raw,
+            prompt=sys + "\n" + _feedback_prompt(_reference(cv), _reference(vacancy) if vacancy else ""),
+        )
 
-1. ОБЩАЯ ОЦЕНКА (0-100 баллов)
-Дай итоговую оценку резюме и объясни её в 2-3 предложениях.
+    async def diff_feedback(self, previous: AnalysisDetail, previous_cv: ResumeDocument, cv: ResumeDocument,
+                            vacancy: ResumeDocument | None) -> AnalysisDetail | None:
+        """Updates the report of an earlier version of the resume from the changes only, None without changes."""
+        diff = _diff(previous_cv, cv)
+        if not diff:
+            return None
+        if len(diff) > len(cv.text) * MAX_DIFF_SHARE:
+            return await self.full_feedback(cv, vacancy)
 
-ВАЖНЫЕ ПРАВИЛА:
-- Будь конкретным: вместо "улучшите описание опыта" напиши что-то вроде "замените фразу «X» на «Y»"
-- Цитируй проблемные места из резюме в кавычках «»
-- Давай примеры улучшенных формулировок
-- Указывай метрики и цифры, которых не хватает
-- Игнорируй служебную информацию с job-сайтов
-- Фокусируйся на проблемах, которые реально влияют на отклики
+        previous_report = previous.model_dump_json(include={"score", "strengths", "problems", "actions", "sections"})
+        with sentry_sdk.start_transaction(
+                name="The result of the AI inference",
+                op="ai-inference",
+        ):
+            llm_parse_result = await self._client.gen_json(DIFF_SYSTEM_PROMPT, _diff_prompt(previous_report, diff))
 
+        return AnalysisDetail(
+            score=llm_parse_result.data.get("score", 0),
+            strengths=llm_parse_result.data.get("strengths", []),
+            problems=llm_parse_result.data.get("problems", []),
+            actions=llm_parse_result.data.get("actions", []),
+            sections=llm_parse_result.data.get("sections", {}),
+            ok=llm_parse_result.success,
+            raw=llm_parse_result.raw,
+            prompt=DIFF_SYSTEM_PROMPT + "\n" + _diff_prompt(previous_report, f"<diff {previous_cv.digest} {cv.digest}>"),
+        )
 
-ФОРМАТ ОТВЕТА СТРОГО JSON: {\"score\": int 0..100, \"strengths\":[string], \"problems\":[string], \"actions\":[string], \"sections\":{string:int 0..10}}. Давайте конкретику и метрики. Не добавляйте ничего вне JSON.
-Как должны быть заполнены поля:
-- в поле "score" пиши итоговую оценку от 0 до 100.
-- в поле "strengths" пиши конкретные сильные стороны резюме. Порядка 3-5 пунктов, если это необходимо.
-- в поле "problems" пиши конкретные проблемы резюме. Порядка 5-10 пунктов, если это необходимо.
-- в поле "actions" пиши конкретные шаги по улучшению резюме. Порядка 5-10 пунктов, если это необходимо.
+    async def sectioned_feedback(self, cv: ResumeDocument, vacancy: ResumeDocument | None,
+                                 concurrency: int) -> AnalysisDetail:
+        """
+        The resume cut into sections, analysed with concurrent smaller prompts and merged.
+        Sections unchanged since an earlier upload are answered from the cache.
+        """
+        segments = cv.segments
+        if len(segments) < 2:
+            return await self.full_feedback(cv, vacancy)
 
-Если какого-то из полей нет, не нужно писать туда никакие значения.
-"""
-        user = f"""
-Проанализируйте резюме ниже.
----
-{cv_info}
----
-"""
-        if vacancy_info:
-            user += f"""
-Описание вакансии для резюме выгдядит вот так:
----
-{vacancy_info}
----
-"""
-        user += "\nВ качестве результата верни JSON С УКАЗАННОЙ СХЕМОЙ"
+        texts = [cv.section_text(segment) for segment in segments]
+        keys = [_section_key(segment.name, text, vacancy) for segment, text in zip(segments, texts)]
+        cached = await SectionAnalysesDAL.get_many(keys)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def analyze(segment: SectionSpan, text: str, key: str) -> LLMParseResult:
+            if key in cached:
+                SECTION_CACHE.labels("hit").inc()
+                return LLMParseResult(data=cached[key], raw="", success=True)
+            SECTION_CACHE.labels("miss").inc()
+            async with semaphore:
+                result = await self._client.gen_json(SECTION_SYSTEM_PROMPT, _section_prompt(segment.name, text, vacancy))
+            if result.success:
+                await SectionAnalysesDAL.put(key, result.data)
+            return result
 
         with sentry_sdk.start_transaction(
                 name="The result of the AI inference",
                 op="ai-inference",
         ):
-            llm_parse_result = await self._client.gen_json(sys, user)
+            results = await asyncio.gather(*(analyze(*args) for args in zip(segments, texts, keys)))
 
+        detail = _merge_sections(segments, list(results), {span.name for span in cv.section_spans})
+        # The keys point at the cached section results
+        detail.prompt = SECTION_SYSTEM_PROMPT + "\n" + "\n".join(
+            f"<section {segment.name} {key}>" for segment, key in zip(segments, keys)
+        )
+        return detail
+
+    async def vacancy_match(self, cv: ResumeDocument, vacancy: ResumeDocument) -> AnalysisDetail:
+        """How well the resume fits one vacancy: score is the match 0..100, problems are the gaps."""
+        llm_parse_result = await self._client.gen_json(MATCH_SYSTEM_PROMPT, _match_prompt(cv.text, vacancy.text))
+        try:
+            match = max(0, min(100, int(llm_parse_result.data.get("match", 0))))
+        except (TypeError, ValueError):
+            match = 0
         return AnalysisDetail(
-            score=llm_parse_result.data.get("score", 0),
+            score=match,
             strengths=llm_parse_result.data.get("strengths", []),
-            problems=llm_parse_result.data.get("problems", []),
+            problems=llm_parse_result.data.get("gaps", []),
             actions=llm_parse_result.data.get("actions", []),
-            sections=llm_parse_result.data.get("sections", {}),
+            sections={"title": str(llm_parse_result.data.get("title", ""))},
             ok=llm_parse_result.success,
             raw=llm_parse_result.raw,
-            prompt=sys + "\n" + user,
+            prompt=MATCH_SYSTEM_PROMPT + "\n" + _match_prompt(_reference(cv), _reference(vacancy)),
         )
@@ -0,0 +1,57 @@
+"""
+MinHash signatures of documents and their LSH bands.
+
+Two documents share a band when all rows of that band are equal; with BANDS x ROWS = 16 x 4 a pair
+with Jaccard similarity 0.9 shares at least one band with probability above 0.99, a pair at 0.5 with
+about 0.65, so the band lookup finds candidates and the signature comparison decides.
+"""
+from __future__ import annotations
+import hashlib, random
+from typing import Iterable, List, Sequence
+
+SHINGLE_SIZE = 3
+BANDS = 16
+ROWS = 4
+NUM_PERM = BANDS * ROWS
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+# Fixed seed: signatures are stored and compared across processes and releases
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+
+def _hash(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "little")
+
+
+def shingles(tokens: Sequence[str]) -> set[str]:
+    words = [token.lower() for token in tokens]
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash(items: Iterable[str]) -> List[int]:
+    hashes = [_hash(item) for item in items]
+    if not hashes:
+        return [_MAX_HASH] * NUM_PERM
+    return [min((a * h + b) % _PRIME for h in hashes) & _MAX_HASH for a, b in _PERMUTATIONS]
+
+
+def lsh_bands(signature: Sequence[int]) -> List[str]:
+    """Band keys to index: band number and a short hash of its rows."""
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.blake2b(",".join(map(str, rows)).encode(), digest_size=6).hexdigest()
+        keys.append(f"{band}:{digest}")
+    return keys
+
+
+def similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of the shingle sets."""
+    if len(a) != len(b) or not a:
+        return 0.0
+    return sum(x == y for x, y in zip(a, b)) / len(a)
@@ -1,31 +1,17 @@
 from __future__ import annotations
 import re
-from typing import Dict, Any, List
+from typing import List
 
+from app.cv_analyzer.document import ResumeDocument
 from app.models import AnalysisDetail
 
-SECTION_PATTERNS = [
-    r"\bопыт работы\b", r"\bопыт\b", r"\bexperience\b",
-    r"\bобразование\b", r"\beducation\b",
-    r"\bнавыки\b", r"\bskills\b",
-    r"\bпроекты\b", r"\bprojects?\b",
-    r"\bсертификаты\b", r"\bcertifications?\b",
-]
-
-def analyze_resume_text(text: str) -> AnalysisDetail:
-    clean = re.sub(r"[\u200b\ufeff\xa0]", " ", text, flags=re.I)
-    words = re.findall(r"[A-Za-zА-Яа-яЁё0-9\-\+%$€₽]+", clean)
-    word_count = len(words)
-
-    sections_found: Dict[str, bool] = {}
-    for pat in SECTION_PATTERNS:
-        sections_found[pat] = bool(re.search(pat, clean, flags=re.I))
-
-    numbers = re.findall(r"(\b\d{4}\b|\b\d+%\b|\b\d+[\.,]\d+\b|\b\d+\b)", clean)
-    metrics_density = len(numbers) / max(1, word_count)
-
-    bullets = len(re.findall(r"^[\s\-•·•*]+", clean, flags=re.M))
-    contacts = re.search(r"@|\+\d|https?://|linkedin\.com|github\.com|portfolio", clean, flags=re.I) is not None
+def analyze_resume_text(document: ResumeDocument) -> AnalysisDetail:
+    features = document.features
+    word_count = features.word_count
+    sections_found = features.sections_found
+    metrics_density = features.metrics_density
+    bullets = features.bullets
+    contacts = features.contacts
 
     score = 50
     key_sections = ["опыт", "образование", "навыки"]
@@ -47,11 +33,11 @@ def analyze_resume_text(text: str) -> AnalysisDetail:
         suggestions.append("Используйте маркированные пункты вместо сплошных абзацев.")
     if not contacts:
         suggestions.append("Добавьте контакты и ссылки: email, LinkedIn, GitHub/портфолио.")
-    if not re.search(r"(?i)python|sql|java|js|golang|kotlin|swift|c\+\+|c#", clean):
+    if not features.has_stack:
         suggestions.append("Техстек не виден. Вынесите ключевые технологии в раздел 'Навыки'.")
-    if not re.search(r"(?i)lead|руковод|менедж|team", clean):
+    if not features.has_leadership:
         suggestions.append("Почти нет сигналов влияния/лидерства. Добавьте проекты, где вы вели людей/инициативы.")
-    if not re.search(r"\b\d{4}\b", clean):
+    if not features.has_years:
         suggestions.append("Не хватает дат по ролям. Укажите период и результаты." )
 
     findings: List[str] = []
@@ -67,6 +53,7 @@ def analyze_resume_text(text: str) -> AnalysisDetail:
         actions=suggestions,
         sections=sections_found,
         ok=True,
-        raw=text,
+        # The text itself is kept once, in the extraction cache under the digest
+        raw="",
         prompt="static analize"
     )
@@ -1,12 +1,19 @@
+import logging
 from datetime import datetime, timedelta
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 from aiogram.types import Message
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
 
 from .db import db
 from .models import User, Analysis, MessageModel, FileChecking
 
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, the last bucket is "le_inf"
+LLM_LATENCY_BUCKETS = (5, 15, 30, 60, 120, 300)
+
 
 class UserNotFound(Exception):
     pass
@@ -84,9 +91,246 @@ class AnalyticsDAL:
         res = await db().analyses.insert_one(data.model_dump())
         return res.inserted_id
 
+    @staticmethod
+    async def get(analysis_id: str) -> Optional[Analysis]:
+        doc = await db().analyses.find_one({"_id": ObjectId(analysis_id)})
+        return Analysis.model_validate(doc) if doc else None
+
+    @staticmethod
+    async def find_by_job(job_id: str) -> Optional[Analysis]:
+        doc = await db().analyses.find_one({"job_id": job_id})
+        return Analysis.model_validate(doc) if doc else None
+
+    @staticmethod
+    async def insert_for_job(data: Analysis) -> Analysis:
+        """Stores the result of a job once: a concurrent or repeated insert gets the stored one back."""
+        await db().analyses.update_one({"job_id": data.job_id}, {"$setOnInsert": data.model_dump()}, upsert=True)
+        return Analysis.model_validate(await db().analyses.find_one({"job_id": data.job_id}))
+
+    @staticmethod
+    async def mark_delivered(job_id: str) -> bool:
+        """True for the one caller that flipped the flag."""
+        res = await db().analyses.update_one({"job_id": job_id, "delivered": False}, {"$set": {"delivered": True}})
+        return bool(res.modified_count)
+
+    @staticmethod
+    async def find_by_bands(user_id: int, bands: List[str], since: datetime, limit: int = 20) -> List[dict]:
+        """Successful analyses of the user sharing an LSH band, newest first: signatures only."""
+        cursor = db().analyses.find(
+            {"user_id": user_id, "lsh_bands": {"$in": bands}, "created_at": {"$gte": since}, "details.0.ok": True},
+            {"minhash": 1, "resume_digest": 1, "vacancy_digest": 1, "created_at": 1},
+        ).sort("created_at", -1).limit(limit)
+        return await cursor.to_list(length=limit)
+
 
 class FileCheckingDAL:
     @staticmethod
     async def insert(data: FileChecking) -> ObjectId:
         res = await db().file_checking.insert_one(data.model_dump())
         return res.inserted_id
+
+
+class ExtractionsDAL:
+    """
+    Text extracted from uploads, keyed by upload digest.
+    A cache entry expires `ttl` after the upload; texts behind an analysis are retained as long as the analysis.
+    """
+    CACHE_TTL_INDEX = "created_at_cache_ttl"
+
+    @staticmethod
+    async def ensure_indexes(ttl: timedelta) -> None:
+        indexes = await db().extractions.index_information()
+        if "created_at_1" in indexes:
+            # The former TTL covered every entry, retained texts included
+            await db().extractions.drop_index("created_at_1")
+        await db().extractions.create_index(
+            "created_at", name=ExtractionsDAL.CACHE_TTL_INDEX,
+            expireAfterSeconds=int(ttl.total_seconds()), partialFilterExpression={"retained": False},
+        )
+        await db().extractions.create_index("retained_until", expireAfterSeconds=0)
+
+    @staticmethod
+    async def backfill_retained() -> int:
+        """One-off: entries cached before `retained` existed are outside the partial TTL index until they have it."""
+        res = await db().extractions.update_many({"retained": {"$exists": False}}, {"$set": {"retained": False}})
+        return res.modified_count
+
+    @staticmethod
+    async def get(digest: str) -> Optional[str]:
+        doc = await db().extractions.find_one({"_id": digest}, {"text": 1})
+        return doc["text"] if doc else None
+
+    @staticmethod
+    async def put(digest: str, text: str) -> None:
+        await db().extractions.update_one(
+            {"_id": digest},
+            {"$set": {"text": text, "created_at": datetime.now()}, "$setOnInsert": {"retained": False}},
+            upsert=True,
+        )
+
+    @staticmethod
+    async def retain(digests: List[str], until: datetime) -> None:
+        """Keeps the texts at least until `until`, whatever the cache TTL."""
+        digests = [digest for digest in digests if digest]
+        if digests:
+            await db().extractions.update_many(
+                {"_id": {"$in": digests}},
+                {"$set": {"retained": True}, "$max": {"retained_until": until}},
+            )
+
+
+class SectionAnalysesDAL:
+    """LLM results of resume sections, keyed by a hash of the section, the vacancy and the prompt version."""
+
+    @staticmethod
+    async def ensure_indexes(ttl: timedelta) -> None:
+        await db().section_analyses.create_index("created_at", expireAfterSeconds=int(ttl.total_seconds()))
+
+    @staticmethod
+    async def get_many(keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        cursor = db().section_analyses.find({"_id": {"$in": keys}}, {"data": 1})
+        return {doc["_id"]: doc["data"] async for doc in cursor}
+
+    @staticmethod
+    async def put(key: str, data: Dict[str, Any]) -> None:
+        await db().section_analyses.update_one(
+            {"_id": key},
+            {"$set": {"data": data, "created_at": datetime.now()}},
+            upsert=True,
+        )
+
+
+class AdmissionDAL:
+    """GCRA state of per-user rate limits: one document per user and operation with its theoretical arrival time."""
+
+    @staticmethod
+    async def ensure_indexes() -> None:
+        # A key whose arrival time has passed is back to a full burst, the document is no longer needed
+        await db().admission.create_index("expires_at", expireAfterSeconds=0)
+
+    @staticmethod
+    async def take(key: str, interval: float, tolerance: float, now: float) -> float:
+        """
+        Admits one request in a single atomic update. Times are epoch seconds.
+        Returns 0 when admitted, otherwise the seconds until a request would be.
+        """
+        doc = await db().admission.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"_tat": {"$max": [{"$ifNull": ["$tat", now]}, now]}}},
+                {"$set": {"_wait": {"$subtract": [{"$subtract": ["$_tat", now]}, tolerance]}}},
+                {"$set": {
+                    "tat": {"$cond": [{"$lte": ["$_wait", 0]}, {"$add": ["$_tat", interval]}, "$_tat"]},
+                    "retry_after": {"$max": ["$_wait", 0]},
+                }},
+                {"$set": {"expires_at": {"$toDate": {"$multiply": ["$tat", 1000]}}}},
+                {"$unset": ["_tat", "_wait"]},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["retry_after"]
+
+    @staticmethod
+    async def refund(key: str, interval: float) -> None:
+        """Gives back one request admitted by take(): the work it was charged for did not happen."""
+        await db().admission.update_one(
+            {"_id": key},
+            [
+                {"$set": {"tat": {"$subtract": ["$tat", interval]}}},
+                {"$set": {"expires_at": {"$toDate": {"$multiply": ["$tat", 1000]}}}},
+            ],
+        )
+
+
+class RollupsDAL:
+    """
+    Per-day and per-hour counters, maintained with $inc upserts in the write path.
+    One document per bucket: {"_id": "hour:2025-01-31T10", "granularity": "hour", "bucket": ..., "counters": {...}}
+    """
+
+    @staticmethod
+    async def ensure_indexes() -> None:
+        await db().rollups.create_index([("granularity", 1), ("bucket", 1)])
+
+    @staticmethod
+    async def inc(counters: Dict[str, float], at: Optional[datetime] = None) -> None:
+        at = at or datetime.now()
+        buckets = {
+            "day": (at.replace(hour=0, minute=0, second=0, microsecond=0), "%Y-%m-%d"),
+            "hour": (at.replace(minute=0, second=0, microsecond=0), "%Y-%m-%dT%H"),
+        }
+        inc = {f"counters.{name}": value for name, value in counters.items()}
+        ops = [
+            UpdateOne(
+                {"_id": f"{granularity}:{bucket.strftime(fmt)}"},
+                {"$inc": inc, "$setOnInsert": {"granularity": granularity, "bucket": bucket}},
+                upsert=True,
+            )
+            for granularity, (bucket, fmt) in buckets.items()
+        ]
+        try:
+            await db().rollups.bulk_write(ops, ordered=False)
+        except Exception:
+            # Analytics must never break the user flow
+            logger.exception("Unable to update rollups %s", counters)
+
+    @staticmethod
+    def latency_bucket(seconds: float) -> str:
+        for bound in LLM_LATENCY_BUCKETS:
+            if seconds <= bound:
+                return f"le_{bound}"
+        return "le_inf"
+
+    @classmethod
+    async def track_upload(cls, kind: str) -> None:
+        await cls.inc({f"uploads.{kind}": 1})
+
+    @classmethod
+    async def track_validity_rejection(cls, kind: str) -> None:
+        await cls.inc({f"validity_rejections.{kind}": 1})
+
+    @classmethod
+    async def track_analysis(cls, llm_seconds: float) -> None:
+        await cls.inc({
+            "analyses": 1,
+            f"llm_latency.{cls.latency_bucket(llm_seconds)}": 1,
+            "llm_latency.sum_seconds": llm_seconds,
+        })
+
+    @classmethod
+    async def track_payment(cls, product: str, amount: int, currency: str) -> None:
+        # amount in minor units, as Telegram reports it
+        await cls.inc({
+            f"payments.{product}.count": 1,
+            f"payments.{product}.amount_{currency.lower()}": amount,
+        })
+
+    @staticmethod
+    async def get_range(granularity: str, since: datetime, until: datetime) -> List[Dict[str, Any]]:
+        cursor = db().rollups.find(
+            {"granularity": granularity, "bucket": {"$gte": since, "$lt": until}},
+        ).sort("bucket", 1)
+        return await cursor.to_list(None)
+
+
+class CommandVisibilityDAL:
+    """Last command list applied per chat: {"_id": chat_id, "visible": bool, "updated_at": ...}"""
+
+    @staticmethod
+    async def get_many(chat_ids: List[int]) -> Dict[int, bool]:
+        cursor = db().command_visibility.find({"_id": {"$in": chat_ids}})
+        return {doc["_id"]: doc["visible"] async for doc in cursor}
+
+    @staticmethod
+    async def set_many(visibility: Dict[int, bool]) -> None:
+        if not visibility:
+            return
+        now = datetime.now()
+        await db().command_visibility.bulk_write(
+            [
+                UpdateOne({"_id": chat_id}, {"$set": {"visible": visible, "updated_at": now}}, upsert=True)
+                for chat_id, visible in visibility.items()
+            ],
+            ordered=False,
+        )
@@ -10,12 +10,26 @@ async def init_db(dsn: str, db_name: str) -> AsyncIOMotorDatabase:
     global _client, _db
     _client = AsyncIOMotorClient(dsn)
     _db = _client.get_database(db_name)
-
-    await _db.users.create_index("tg_user_id", unique=True)
-    await _db.messages.create_index([("message_id", 1), ("chat_id", 1)])
-    await _db.analyses.create_index([("user_id", 1), ("created_at", -1)])
     return _db
 
+
+async def ensure_indexes() -> None:
+    await db().users.create_index("tg_user_id", unique=True)
+    await db().messages.create_index([("message_id", 1), ("chat_id", 1)])
+    await db().analyses.create_index([("user_id", 1), ("created_at", -1)])
+    # Multikey: one entry per band, near-duplicate lookups touch only matching bands
+    await db().analyses.create_index([("user_id", 1), ("lsh_bands", 1)])
+    await db().analyses.create_index(
+        "job_id", unique=True, partialFilterExpression={"job_id": {"$type": "string"}},
+    )
+
+def close_db() -> None:
+    global _client, _db
+    if _client is not None:
+        _client.close()
+    _client = _db = None
+
+
 def db() -> AsyncIOMotorDatabase:
     assert _db is not None, "DB не инициализирована"
     return _db
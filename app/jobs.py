@@ -0,0 +1,280 @@
+from __future__ import annotations
+import asyncio, logging, os, socket
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from pymongo import ReturnDocument
+
+from app.db import db
+from app.models import Job, JobStatus
+from app.retention import ensure_ttl_index
+from app.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class JobContext:
+    bot: Bot
+    settings: Settings
+    worker_id: str
+
+    async def progress(self, job: Job, chat_id: int, text: str) -> None:
+        await JobQueue.set_progress(job, text)
+        await self.bot.send_message(chat_id, text)
+
+
+JobHandler = Callable[[Job, JobContext], Awaitable[None]]
+JOB_HANDLERS: Dict[str, Tuple[JobHandler, Optional[JobHandler]]] = {}
+
+
+def job_handler(kind: str, on_failure: Optional[JobHandler] = None) -> Callable[[JobHandler], JobHandler]:
+    """Registers the coroutine running jobs of `kind`; on_failure runs once retries are exhausted."""
+    def decorator(handler: JobHandler) -> JobHandler:
+        JOB_HANDLERS[kind] = (handler, on_failure)
+        return handler
+    return decorator
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class JobQueue:
+    _wakeup: Optional[asyncio.Event] = None
+
+    @staticmethod
+    async def ensure_indexes(finished_ttl_days: Optional[int]) -> None:
+        await db().jobs.create_index([("status", 1), ("run_after", 1), ("created_at", 1)])
+        await db().jobs.create_index([("status", 1), ("lease_until", 1)])
+        await db().jobs.create_index([("payload.user_id", 1), ("status", 1)])
+        if finished_ttl_days is not None:
+            await ensure_ttl_index("jobs", "finished_at", timedelta(days=finished_ttl_days))
+
+    @staticmethod
+    async def backfill_finished_at() -> int:
+        """One-off: jobs finished before finished_at existed."""
+        res = await db().jobs.update_many(
+            {"status": {"$in": [JobStatus.DONE, JobStatus.FAILED]}, "finished_at": {"$exists": False}},
+            [{"$set": {"finished_at": "$updated_at"}}],
+        )
+        return res.modified_count
+
+    @classmethod
+    async def enqueue(cls, kind: str, payload: Dict[str, Any], max_attempts: int) -> Any:
+        now = datetime.now()
+        res = await db().jobs.insert_one({
+            "kind": kind,
+            "payload": payload,
+            "status": JobStatus.QUEUED,
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "run_after": now,
+            "lease_until": None,
+            "created_at": now,
+            "updated_at": now,
+        })
+        if cls._wakeup is not None:
+            # Local workers pick it up without waiting for the next poll
+            cls._wakeup.set()
+        return res.inserted_id
+
+    @staticmethod
+    async def count_active(user_id: int, limit: int = 0) -> int:
+        """Jobs of the user queued or running, counted up to `limit` when it is set."""
+        query = {"payload.user_id": user_id, "status": {"$in": [JobStatus.QUEUED, JobStatus.RUNNING]}}
+        return await db().jobs.count_documents(query, **({"limit": limit} if limit else {}))
+
+    @staticmethod
+    async def claim(worker_id: str, lease: timedelta) -> Optional[Job]:
+        now = datetime.now()
+        doc = await db().jobs.find_one_and_update(
+            {
+                "$or": [
+                    {"status": JobStatus.QUEUED, "run_after": {"$lte": now}},
+                    # The worker holding it died: resume after its lease
+                    {"status": JobStatus.RUNNING, "lease_until": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": JobStatus.RUNNING,
+                    "worker_id": worker_id,
+                    "lease_until": now + lease,
+                    "heartbeat_at": now,
+                    "updated_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        return Job.model_validate(doc) if doc else None
+
+    @staticmethod
+    async def heartbeat(job: Job, worker_id: str, lease: timedelta) -> bool:
+        now = datetime.now()
+        res = await db().jobs.update_one(
+            {"_id": job.id, "worker_id": worker_id, "status": JobStatus.RUNNING},
+            {"$set": {"lease_until": now + lease, "heartbeat_at": now}},
+        )
+        return bool(res.matched_count)
+
+    @staticmethod
+    async def set_progress(job: Job, text: str) -> None:
+        await db().jobs.update_one({"_id": job.id}, {"$set": {"progress": text, "updated_at": datetime.now()}})
+
+    @staticmethod
+    async def complete(job: Job, worker_id: str) -> None:
+        now = datetime.now()
+        await db().jobs.update_one(
+            {"_id": job.id, "worker_id": worker_id},
+            {"$set": {"status": JobStatus.DONE, "lease_until": None, "updated_at": now, "finished_at": now}},
+        )
+
+    @staticmethod
+    async def release(job: Job, worker_id: str) -> bool:
+        """Hands a job interrupted by shutdown back to the queue; the interrupted attempt does not count."""
+        res = await db().jobs.update_one(
+            {"_id": job.id, "worker_id": worker_id, "status": JobStatus.RUNNING},
+            {
+                "$set": {
+                    "status": JobStatus.QUEUED,
+                    "lease_until": None,
+                    "run_after": datetime.now(),
+                    "updated_at": datetime.now(),
+                },
+                "$inc": {"attempts": -1},
+            },
+        )
+        return bool(res.modified_count)
+
+    @staticmethod
+    async def fail(job: Job, worker_id: str, error: str) -> bool:
+        """Returns True when the job will not be retried anymore."""
+        final = job.attempts >= job.max_attempts
+        now = datetime.now()
+        await db().jobs.update_one(
+            {"_id": job.id, "worker_id": worker_id},
+            {"$set": {
+                "status": JobStatus.FAILED if final else JobStatus.QUEUED,
+                "error": error,
+                "lease_until": None,
+                "run_after": now + timedelta(seconds=30 * 2 ** (job.attempts - 1)),
+                "updated_at": now,
+                **({"finished_at": now} if final else {}),
+            }},
+        )
+        return final
+
+
+class JobWorkerPool:
+    def __init__(self, bot: Bot, settings: Settings) -> None:
+        self._bot = bot
+        self._settings = settings
+        self._jobs = settings.jobs
+        self._lease = timedelta(seconds=settings.jobs.lease_seconds)
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self._interrupted: List[Tuple[Job, str]] = []
+
+    def start(self) -> None:
+        JobQueue._wakeup = asyncio.Event()
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks = [
+            asyncio.create_task(self._worker(f"{prefix}:{i}")) for i in range(self._jobs.concurrency)
+        ]
+        logger.info("Job workers started: %d", self._jobs.concurrency)
+
+    async def _worker(self, worker_id: str) -> None:
+        ctx = JobContext(bot=self._bot, settings=self._settings, worker_id=worker_id)
+        while not self._stopping:
+            try:
+                job = await JobQueue.claim(worker_id, self._lease)
+            except Exception:
+                logger.exception("Unable to claim a job")
+                job = None
+
+            if job is None:
+                if self._stopping:
+                    break
+                JobQueue._wakeup.clear()
+                try:
+                    await asyncio.wait_for(JobQueue._wakeup.wait(), timeout=self._jobs.poll_interval_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job, ctx)
+
+    async def _run(self, job: Job, ctx: JobContext) -> None:
+        if job.kind not in JOB_HANDLERS:
+            await JobQueue.fail(job.model_copy(update={"attempts": job.max_attempts}), ctx.worker_id, "unknown kind")
+            return
+
+        handler, on_failure = JOB_HANDLERS[job.kind]
+        if job.attempts > job.max_attempts:
+            # Its last worker died mid-run: the lease expired after all attempts were spent
+            await JobQueue.fail(job, ctx.worker_id, job.error or "lease expired")
+            if on_failure:
+                await on_failure(job, ctx)
+            return
+
+        task = asyncio.create_task(handler(job, ctx))
+        try:
+            await self._heartbeat_until_done(job, ctx, task)
+            await task
+        except LeaseLost:
+            logger.warning("Lease of job %s was lost, another worker owns it now", job.id)
+            return
+        except asyncio.CancelledError:
+            # The pool is stopping: stop() hands the job back to the queue
+            task.cancel()
+            self._interrupted.append((job, ctx.worker_id))
+            raise
+        except Exception as e:
+            logger.exception("Job %s (%s) failed, attempt %d", job.id, job.kind, job.attempts)
+            if await JobQueue.fail(job, ctx.worker_id, repr(e)) and on_failure:
+                await on_failure(job, ctx)
+            return
+
+        await JobQueue.complete(job, ctx.worker_id)
+
+    async def _heartbeat_until_done(self, job: Job, ctx: JobContext, task: asyncio.Task) -> None:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=self._jobs.heartbeat_seconds)
+            if done:
+                return
+            if not await JobQueue.heartbeat(job, ctx.worker_id, self._lease):
+                task.cancel()
+                raise LeaseLost()
+
+    async def stop(self, timeout: float = 0) -> int:
+        """
+        Stops claiming jobs and lets running ones finish within `timeout`.
+        The rest is cancelled and released back to the queue. Returns how many jobs were released.
+        """
+        self._stopping = True
+        if JobQueue._wakeup is not None:
+            # Idle workers leave right away instead of after the poll interval
+            JobQueue._wakeup.set()
+        if self._tasks and timeout > 0:
+            await asyncio.wait(self._tasks, timeout=timeout)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        released = 0
+        for job, worker_id in self._interrupted:
+            try:
+                if await JobQueue.release(job, worker_id):
+                    released += 1
+            except Exception:
+                # Still safe: the job is reclaimed once its lease expires
+                logger.exception("Unable to release job %s", job.id)
+        if released:
+            logger.info("Released %d unfinished jobs back to the queue", released)
+        return released
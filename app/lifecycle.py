@@ -0,0 +1,98 @@
+from __future__ import annotations
+import asyncio, logging, signal, time
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+from aiogram import BaseMiddleware
+
+from app.metrics import SHUTDOWN_DRAIN_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Set aside for every step after the current one: closing pools runs even when draining ate its time
+MIN_STEP_SECONDS = 1.0
+
+ShutdownStep = Callable[[float], Awaitable[Any]]
+
+
+class Shutdown:
+    """
+    Ordered shutdown steps sharing one deadline: draining steps first, closing pools last.
+    Each step gets the time left less MIN_STEP_SECONDS per step after it, so the whole run stays within the deadline.
+    """
+
+    def __init__(self, deadline_seconds: float) -> None:
+        self._deadline_seconds = deadline_seconds
+        self._steps: List[Tuple[str, ShutdownStep]] = []
+        self._started: float | None = None
+
+    def add(self, name: str, step: ShutdownStep) -> None:
+        self._steps.append((name, step))
+
+    def begin(self) -> float:
+        """
+        Starts the deadline ahead of run(), for draining done before it; returns the time that draining may take.
+        Steps must be added already.
+        """
+        if self._started is None:
+            self._started = time.monotonic()
+        return max(0.0, self._deadline_seconds - MIN_STEP_SECONDS * len(self._steps))
+
+    async def run(self) -> None:
+        self.begin()
+        deadline = self._started + self._deadline_seconds
+        logger.info("Shutting down, %.0fs left", deadline - time.monotonic())
+
+        for index, (name, step) in enumerate(self._steps):
+            step_started = time.monotonic()
+            reserved = MIN_STEP_SECONDS * (len(self._steps) - index - 1)
+            timeout = max(deadline - step_started - reserved, MIN_STEP_SECONDS)
+            try:
+                await asyncio.wait_for(step(timeout), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Shutdown step %s did not finish in time", name)
+            except Exception:
+                logger.exception("Shutdown step %s failed", name)
+            SHUTDOWN_DRAIN_SECONDS.labels(name).observe(time.monotonic() - step_started)
+
+        elapsed = time.monotonic() - self._started
+        SHUTDOWN_DRAIN_SECONDS.labels("total").observe(elapsed)
+        logger.info("Shut down in %.2fs", elapsed)
+
+
+class InFlightUpdates(BaseMiddleware):
+    """Outer update middleware of polling mode: remembers the tasks handling updates, so shutdown can wait for them."""
+
+    def __init__(self) -> None:
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        task = asyncio.current_task()
+        if task is None:
+            return await handler(event, data)
+        self._tasks.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            self._tasks.discard(task)
+
+    async def wait(self, timeout: float) -> int:
+        """Returns how many updates were still in flight at the timeout."""
+        current = asyncio.current_task()
+        pending = {task for task in self._tasks if task is not current}
+        if pending and timeout > 0:
+            _, pending = await asyncio.wait(pending, timeout=timeout)
+        if pending:
+            logger.warning("%d updates still in flight at shutdown", len(pending))
+        return len(pending)
+
+
+def stop_on_signals(stop: asyncio.Event) -> None:
+    """For entrypoints without a framework handling signals: SIGTERM and SIGINT start a graceful stop."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
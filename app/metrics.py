@@ -0,0 +1,143 @@
+from __future__ import annotations
+import asyncio, logging, os
+from typing import Tuple
+
+from aiohttp import web
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+)
+
+logger = logging.getLogger(__name__)
+
+# prometheus_client picks the value storage at import: entrypoints set PROMETHEUS_MULTIPROC_DIR
+# before anything imports this module, so every process of the bot writes its samples to files
+_MULTIPROCESS_AT_IMPORT = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+ANALYSIS_STAGE_SECONDS = Histogram(
+    "bot_analysis_stage_seconds", "Duration of a resume analysis stage", ["stage"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+ANALYSIS_OUTCOMES = Counter(
+    "bot_analysis_outcomes_total", "Uploads and analyses by outcome", ["outcome"],
+)
+ANALYSES_IN_FLIGHT = Gauge(
+    "bot_analyses_in_flight", "Full analyses running right now",
+    multiprocess_mode="livesum",
+)
+SECTION_CACHE = Counter(
+    "bot_section_cache_total", "Resume sections of the section mode answered from the cache (hit) or by the LLM (miss)",
+    ["result"],
+)
+LLM_CALLS = Counter(
+    "bot_llm_calls_total", "LLM calls by endpoint and result: ok, error, rejected (a request error)", ["endpoint", "result"],
+)
+LLM_CALL_SECONDS = Histogram(
+    "bot_llm_call_seconds", "Duration of successful LLM calls", ["endpoint", "model"],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 180),
+)
+LLM_CIRCUIT_OPEN = Gauge(
+    "bot_llm_circuit_open", "1 while an LLM endpoint is out of rotation after failures", ["endpoint"],
+    multiprocess_mode="max",
+)
+ADMISSION_REJECTIONS = Counter(
+    "bot_admission_rejections_total", "Updates of expensive handlers refused by per-user limits", ["operation", "plan"],
+)
+
+WEBHOOK_UPDATES = Counter(
+    "bot_webhook_updates_total", "Webhook requests by result", ["result"],
+)
+WEBHOOK_PENDING = Gauge(
+    "bot_webhook_pending_updates", "Accepted webhook updates not processed yet",
+    multiprocess_mode="livesum",
+)
+
+SHARD_QUEUE_DEPTH = Gauge(
+    "bot_shard_queue_depth", "Updates queued for a shard worker process", ["worker"],
+    multiprocess_mode="livesum",
+)
+SHARD_SLOTS = Gauge(
+    "bot_shard_slots", "Hash slots owned by a shard worker process", ["worker"],
+    multiprocess_mode="livesum",
+)
+SHARD_DROPPED_UPDATES = Counter(
+    "bot_shard_dropped_updates_total", "Updates dropped: their chat had too many queued, or their worker died",
+    ["worker"],
+)
+SHARD_WORKER_RESTARTS = Counter(
+    "bot_shard_worker_restarts_total", "Shard worker processes restarted after dying", ["worker"],
+)
+
+OUTBOUND_REQUESTS = Counter(
+    "bot_outbound_requests_total", "Rate limited Bot API calls by priority and result", ["priority", "result"],
+)
+OUTBOUND_WAIT = Histogram(
+    "bot_outbound_wait_seconds", "Time a Bot API call waited for rate limits", ["priority"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60),
+)
+OUTBOUND_RETRY_AFTER = Counter(
+    "bot_outbound_retry_after_total", "RetryAfter responses from Telegram",
+)
+
+LOOP_LAG = Histogram(
+    "bot_loop_lag_seconds", "How late the event loop runs a callback scheduled on time",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+LOOP_STALLS = Counter(
+    "bot_loop_stalls_total", "Event loop blocked longer than the watchdog threshold", ["handler"],
+)
+
+SHUTDOWN_DRAIN_SECONDS = Histogram(
+    "bot_shutdown_drain_seconds", "Duration of a graceful shutdown step, step=total for the whole shutdown", ["step"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60),
+)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    # Several uvicorn workers or shard processes write their samples to PROMETHEUS_MULTIPROC_DIR,
+    # any of them can serve the sum
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        if not _MULTIPROCESS_AT_IMPORT:
+            logger.error("PROMETHEUS_MULTIPROC_DIR was set after app.metrics was imported, samples of this process are missing")
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int | None) -> None:
+    """Drops the live gauges of a child process that exited, or they keep counting in the sums."""
+    if pid is None or "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(pid)
+
+
+async def _metrics(request: web.Request) -> web.Response:
+    body, content_type = render_metrics()
+    return web.Response(body=body, headers={"Content-Type": content_type})
+
+
+async def _healthz(request: web.Request) -> web.Response:
+    from app.db import db
+
+    try:
+        await asyncio.wait_for(db().command("ping"), timeout=2)
+    except Exception:
+        return web.Response(text="mongo unavailable", status=503)
+    return web.Response(text="ok")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """/metrics and /healthz for polling mode, where there is no FastAPI app to serve them."""
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    app.router.add_get("/healthz", _healthz)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics served on %s:%d", host, port)
+    return runner
@@ -0,0 +1,39 @@
+from __future__ import annotations
+import asyncio, logging
+from dotenv import load_dotenv
+
+from app.bootstrap import ensure_indexes
+from app.dal import ExtractionsDAL
+from app.db import init_db
+from app.jobs import JobQueue
+from app.scheduler import DeliveryScheduler
+from app.settings import Settings, get_settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def async_main(settings: Settings) -> None:
+    """One-shot deploy step: creates and updates indexes and backfills data, so bot processes start without it."""
+    await init_db(settings.mongo_dsn, settings.db_name)
+    await ensure_indexes(settings)
+    logger.info("Indexes are up to date")
+
+    backfilled = await ExtractionsDAL.backfill_retained()
+    if backfilled:
+        logger.info("Extraction cache entries marked as not retained: %d", backfilled)
+    backfilled = await DeliveryScheduler.backfill_finished_at()
+    if backfilled:
+        logger.info("Finished scheduled messages given a finished_at: %d", backfilled)
+    backfilled = await JobQueue.backfill_finished_at()
+    if backfilled:
+        logger.info("Finished jobs given a finished_at: %d", backfilled)
+
+
+def main() -> None:
+    load_dotenv()
+    asyncio.run(async_main(get_settings()))
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,13 @@ class Mode(StrEnum):
     SCORE_ONLY = "score_only"
     FULL = "full"
 
+class JobStatus(StrEnum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
 class MessageType(StrEnum):
     CALLBACK = "callback"
     DOCUMENT = "document"
@@ -45,10 +52,30 @@ class AnalysisDetail(BaseModel):
     prompt: str
 
 
+class SkippedVacancy(BaseModel):
+    number: int
+    error: str
+
+
 class Analysis(BaseModel):
     user_id: int
     filepaths: list[str]
     details: list[AnalysisDetail]
+    # Keys of the extraction cache: texts are not copied into analyses
+    resume_digest: str = ""
+    vacancy_digest: str = ""
+    # Batch analyses: details are the resume report, the static analysis, then one match per vacancy in this order
+    vacancy_digests: list[str] = []
+    # Batch analyses: the position of each compared vacancy in the batch, and the vacancies that were skipped
+    vacancy_numbers: list[int] = []
+    skipped_vacancies: list[SkippedVacancy] = []
+    # MinHash of the resume and its LSH band keys, to find near-duplicate uploads of the same user
+    minhash: list[int] = []
+    lsh_bands: list[str] = []
+    # The job that produced it: a retried job finds its result here instead of calling the LLM again
+    job_id: Optional[str] = None
+    # The report reached the user and the credit was consumed
+    delivered: bool = False
     created_at: datetime = Field(..., default_factory=datetime.now)
 
 
@@ -74,3 +101,14 @@ class MessageModel(BaseModel):
     file_name: Optional[str] = None
     created_at: datetime = Field(..., default_factory=datetime.now)
 
+
+class Job(BaseModel):
+    id: Any = Field(alias="_id")
+    kind: str
+    payload: Dict[str, Any]
+    status: JobStatus
+    attempts: int = 0
+    max_attempts: int = 3
+    worker_id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(..., default_factory=datetime.now)
@@ -0,0 +1,258 @@
+from __future__ import annotations
+import asyncio, gzip, logging, os, socket
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+import bson
+from bson import json_util
+from pydantic import BaseModel
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from app.db import db
+from app.models import JobStatus
+from app.settings import RetentionSettings, Settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_OPTIONS_CONFLICT = 85
+LOCK_NAME = "retention"
+
+
+class RetentionReport(BaseModel):
+    archived: Dict[str, int] = {}
+    documents_reclaimed_bytes: int = 0
+    archive_written_bytes: int = 0
+    files_removed: int = 0
+    uploads_reclaimed_bytes: int = 0
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        return self.documents_reclaimed_bytes + self.uploads_reclaimed_bytes
+
+
+def _ttl_days(settings: RetentionSettings) -> Dict[str, int | None]:
+    return {
+        "messages": settings.messages_ttl_days,
+        "file_checking": settings.file_checking_ttl_days,
+        "analyses": settings.analyses_ttl_days,
+    }
+
+
+# Stands for "never" where a date is required
+FOREVER = datetime(9999, 12, 31)
+
+
+def analysis_expiry(settings: RetentionSettings, created_at: datetime) -> datetime:
+    """When an analysis created at `created_at` leaves the database, archived first."""
+    if not settings.enabled or settings.analyses_ttl_days is None:
+        return FOREVER
+    return created_at + timedelta(days=settings.analyses_ttl_days + settings.ttl_grace_days)
+
+
+async def ensure_ttl_index(collection: str, field: str, ttl: timedelta) -> None:
+    expire_after = int(ttl.total_seconds())
+    try:
+        await db()[collection].create_index(field, expireAfterSeconds=expire_after)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        # TTL changed in settings: update the existing index in place
+        await db().command(
+            "collMod", collection,
+            index={"keyPattern": {field: 1}, "expireAfterSeconds": expire_after},
+        )
+
+
+async def ensure_ttl_indexes(settings: RetentionSettings) -> None:
+    """TTL indexes are a safety net: they expire documents only after the archiver had its grace period."""
+    for collection, days in _ttl_days(settings).items():
+        if days is None:
+            continue
+        await ensure_ttl_index(collection, "created_at", timedelta(days=days + settings.ttl_grace_days))
+
+
+def _append_jsonl_gz(path: str, docs: Iterable[dict]) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    before = os.path.getsize(path) if os.path.exists(path) else 0
+    # Every batch becomes a separate gzip member, readers see one continuous stream
+    with gzip.open(path, "ab") as f:
+        for doc in docs:
+            f.write(json_util.dumps(doc).encode("utf-8"))
+            f.write(b"\n")
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+    return os.path.getsize(path) - before
+
+
+async def archive_collection(collection: str, ttl_days: int, settings: RetentionSettings,
+                             report: RetentionReport) -> None:
+    cutoff = datetime.now() - timedelta(days=ttl_days)
+    path = os.path.join(settings.archive_dir, collection, f"{datetime.now():%Y%m%d}.jsonl.gz")
+    coll = db()[collection]
+
+    archived = 0
+    while True:
+        docs = await coll.find({"created_at": {"$lt": cutoff}}).sort("_id", 1).to_list(settings.batch_size)
+        if not docs:
+            break
+
+        # Delete only what is already on disk
+        report.archive_written_bytes += await asyncio.to_thread(_append_jsonl_gz, path, docs)
+        await coll.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+
+        archived += len(docs)
+        report.documents_reclaimed_bytes += sum(len(bson.encode(d)) for d in docs)
+
+    report.archived[collection] = archived
+
+
+# Where live state keeps upload paths: scenes in progress and their pending choice, jobs not finished yet
+_FSM_PATH_FIELDS = ("data.resume_info.path", "data.pending_analysis.resume.path", "data.pending_analysis.vacancy.path")
+_JOB_PATH_FIELDS = ("payload.resume.path", "payload.vacancy.path")
+
+
+def upload_min_age(settings: Settings) -> timedelta:
+    """
+    Uploads younger than this are never collected: an FSM state may still refer to them until it expires,
+    and a job enqueued from it until its last retry.
+    """
+    jobs = settings.jobs
+    retries = sum(30 * 2 ** (attempt - 1) for attempt in range(1, jobs.max_attempts))
+    job_window = timedelta(seconds=jobs.lease_seconds * jobs.max_attempts + retries)
+    return max(
+        timedelta(hours=settings.retention.upload_min_age_hours),
+        timedelta(hours=settings.fsm_state_ttl_hours) + job_window,
+    )
+
+
+def _upload_dirs(base_dir: str) -> List[str]:
+    if not os.path.isdir(base_dir):
+        return []
+    return [root for root, _, _ in os.walk(base_dir)]
+
+
+def _old_files(directory: str, deadline: float) -> List[Tuple[str, int]]:
+    """Files directly in `directory` last modified before `deadline`, with their sizes."""
+    old: List[Tuple[str, int]] = []
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return old
+    for entry in entries:
+        try:
+            if entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                if st.st_mtime <= deadline:
+                    old.append((os.path.join(directory, entry.name), st.st_size))
+        except FileNotFoundError:
+            continue
+    return old
+
+
+def _remove_files(paths: List[Tuple[str, int]]) -> List[int]:
+    removed_sizes: List[int] = []
+    for path, size in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed_sizes.append(size)
+    return removed_sizes
+
+
+async def _referenced(paths: List[str], user_id: int | None) -> Set[str]:
+    """The paths among `paths` that an analysis, a scene in progress or an unfinished job refers to."""
+    query: Dict[str, Any] = {"filepaths": {"$in": paths}}
+    if user_id is not None:
+        # Uploads are stored per user: the (user_id, created_at) index narrows the scan
+        query["user_id"] = user_id
+    referenced = set(await db().analyses.distinct("filepaths", query))
+
+    fsm_query = {"$or": [{field: {"$in": paths}} for field in _FSM_PATH_FIELDS]}
+    async for doc in db().fsm_states.find(fsm_query, {field: 1 for field in _FSM_PATH_FIELDS}):
+        referenced.update(_values(doc, _FSM_PATH_FIELDS))
+
+    job_query = {
+        "status": {"$in": [JobStatus.QUEUED, JobStatus.RUNNING]},
+        "$or": [{field: {"$in": paths}} for field in _JOB_PATH_FIELDS],
+    }
+    async for doc in db().jobs.find(job_query, {field: 1 for field in _JOB_PATH_FIELDS}):
+        referenced.update(_values(doc, _JOB_PATH_FIELDS))
+    return referenced
+
+
+def _values(doc: Dict[str, Any], fields: Iterable[str]) -> List[Any]:
+    values = []
+    for field in fields:
+        value: Any = doc
+        for part in field.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if value:
+            values.append(value)
+    return values
+
+
+async def collect_uploads(settings: Settings, report: RetentionReport) -> None:
+    """
+    Removes uploads nothing refers to, one directory and one batch at a time:
+    memory stays bounded by the batch size, whatever the number of analyses.
+    """
+    deadline = (datetime.now() - upload_min_age(settings)).timestamp()
+    batch_size = settings.retention.batch_size
+    for directory in await asyncio.to_thread(_upload_dirs, settings.data_dir):
+        old = await asyncio.to_thread(_old_files, directory, deadline)
+        name = os.path.basename(directory)
+        user_id = int(name) if name.isdigit() else None
+        for start in range(0, len(old), batch_size):
+            batch = old[start:start + batch_size]
+            referenced = await _referenced([path for path, _ in batch], user_id)
+            sizes = await asyncio.to_thread(_remove_files, [item for item in batch if item[0] not in referenced])
+            report.files_removed += len(sizes)
+            report.uploads_reclaimed_bytes += sum(sizes)
+
+
+async def _acquire_lock(ttl: timedelta) -> bool:
+    now = datetime.now()
+    try:
+        doc = await db().locks.find_one_and_update(
+            {"_id": LOCK_NAME, "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": now + ttl, "owner": socket.gethostname()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Lock exists and is still held by another process
+        return False
+    return doc is not None
+
+
+async def run_retention(settings: Settings) -> RetentionReport:
+    retention = settings.retention
+    report = RetentionReport()
+
+    for collection, days in _ttl_days(retention).items():
+        if days is not None:
+            await archive_collection(collection, days, retention, report)
+
+    # Analyses are archived first so the uploads they referenced become collectable in the same run
+    await collect_uploads(settings, report)
+    return report
+
+
+async def run_retention_loop(settings: Settings) -> None:
+    retention = settings.retention
+    while True:
+        try:
+            # The lock is never released: it marks the run for the whole interval across all processes
+            if await _acquire_lock(timedelta(seconds=retention.interval_seconds * 0.9)):
+                report = await run_retention(settings)
+                logger.info(
+                    "Retention done: archived=%s, reclaimed %d bytes (documents %d, uploads %d in %d files), "
+                    "archive written %d bytes",
+                    report.archived, report.reclaimed_bytes, report.documents_reclaimed_bytes,
+                    report.uploads_reclaimed_bytes, report.files_removed, report.archive_written_bytes,
+                )
+        except Exception:
+            logger.exception("Retention run failed")
+        await asyncio.sleep(retention.interval_seconds)
@@ -0,0 +1,244 @@
+from __future__ import annotations
+import asyncio, logging, socket, time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.types import InlineKeyboardMarkup
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from app.db import db
+from app.retention import ensure_ttl_index
+
+logger = logging.getLogger(__name__)
+
+TICK = 0.1
+WHEEL_SLOTS = 600
+# Documents due within the horizon are loaded into the wheel, the rest stays in Mongo
+LOAD_HORIZON = timedelta(minutes=5)
+LOAD_INTERVAL = 60
+# A send claimed by a process that died is retried after the lease
+CLAIM_LEASE = timedelta(minutes=2)
+MAX_ATTEMPTS = 5
+# Statuses a message never leaves, they get a finished_at for the TTL index
+FINISHED = ["sent", "cancelled", "blocked", "failed"]
+
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) insert, every tick touches only one slot."""
+
+    def __init__(self, tick: float, slots: int) -> None:
+        self._tick = tick
+        self._slots: List[Dict[Any, int]] = [defaultdict(int) for _ in range(slots)]
+        # key -> index of its slot, so a key is cancelled or moved without a scan
+        self._where: Dict[Any, int] = {}
+        self._current = int(time.monotonic() / tick)
+
+    def schedule(self, key: Any, delay: float) -> None:
+        """Schedules the key, or moves it when it is scheduled already."""
+        self.cancel(key)
+        ticks = max(1, int(delay / self._tick) + 1)
+        target = self._current + ticks
+        rounds = (ticks - 1) // len(self._slots)
+        index = target % len(self._slots)
+        self._slots[index][key] = rounds
+        self._where[key] = index
+
+    def cancel(self, key: Any) -> bool:
+        index = self._where.pop(key, None)
+        if index is None:
+            return False
+        del self._slots[index][key]
+        return True
+
+    def advance(self) -> List[Any]:
+        due: List[Any] = []
+        now = int(time.monotonic() / self._tick)
+        while self._current < now:
+            self._current += 1
+            slot = self._slots[self._current % len(self._slots)]
+            for key, rounds in list(slot.items()):
+                if rounds == 0:
+                    due.append(key)
+                    del slot[key]
+                    del self._where[key]
+                else:
+                    slot[key] = rounds - 1
+        return due
+
+
+class DeliveryScheduler:
+    """
+    Persistent "send text to chat at time T".
+    Every pending send is a document in scheduled_messages, the in-memory wheel only holds the ids due soon,
+    so pending sends survive restarts and any bot process may deliver them.
+    """
+
+    def __init__(self, bot: Bot) -> None:
+        self._bot = bot
+        self._wheel = TimerWheel(TICK, WHEEL_SLOTS)
+        self._loaded: Set[ObjectId] = set()
+        self._owner = f"{socket.gethostname()}:{id(self)}"
+        self._tasks: Set[asyncio.Task] = set()
+        self._runner: Optional[asyncio.Task] = None
+
+    @staticmethod
+    async def ensure_indexes(finished_ttl_days: Optional[int]) -> None:
+        await db().scheduled_messages.create_index([("status", 1), ("send_at", 1)])
+        if finished_ttl_days is not None:
+            await ensure_ttl_index("scheduled_messages", "finished_at", timedelta(days=finished_ttl_days))
+
+    @staticmethod
+    async def backfill_finished_at() -> int:
+        """One-off: messages finished before finished_at existed."""
+        res = await db().scheduled_messages.update_many(
+            {"status": {"$in": FINISHED}, "finished_at": {"$exists": False}},
+            [{"$set": {"finished_at": {"$ifNull": ["$sent_at", "$created_at"]}}}],
+        )
+        return res.modified_count
+
+    async def schedule(
+        self,
+        chat_id: int,
+        text: str,
+        *,
+        at: Optional[datetime] = None,
+        delay: Optional[timedelta] = None,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+        parse_mode: Optional[str] = None,
+        kind: str = "message",
+    ) -> ObjectId:
+        send_at = at or datetime.now() + (delay or timedelta())
+        res = await db().scheduled_messages.insert_one({
+            "chat_id": chat_id,
+            "text": text,
+            "reply_markup": reply_markup.model_dump(mode="json", exclude_none=True) if reply_markup else None,
+            "parse_mode": parse_mode,
+            "kind": kind,
+            "send_at": send_at,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": datetime.now(),
+        })
+        if send_at - datetime.now() <= LOAD_HORIZON:
+            self._add(res.inserted_id, send_at)
+        return res.inserted_id
+
+    async def cancel(self, chat_id: int, kind: str) -> int:
+        query = {"chat_id": chat_id, "kind": kind, "status": "pending"}
+        ids = [doc["_id"] async for doc in db().scheduled_messages.find(query, {"_id": 1})]
+        res = await db().scheduled_messages.update_many(
+            query, {"$set": {"status": "cancelled", "finished_at": datetime.now()}},
+        )
+        # Out of our wheel; other processes still fire them and find them cancelled when they claim
+        for doc_id in ids:
+            if doc_id in self._loaded:
+                self._loaded.discard(doc_id)
+                self._wheel.cancel(doc_id)
+        return res.modified_count
+
+    def _add(self, doc_id: ObjectId, send_at: datetime) -> None:
+        if doc_id in self._loaded:
+            return
+        self._loaded.add(doc_id)
+        self._wheel.schedule(doc_id, (send_at - datetime.now()).total_seconds())
+
+    async def _load_due(self) -> None:
+        now = datetime.now()
+        cursor = db().scheduled_messages.find(
+            {
+                "$or": [
+                    {"status": "pending", "send_at": {"$lte": now + LOAD_HORIZON}},
+                    {"status": "sending", "locked_until": {"$lt": now}},
+                ],
+            },
+            {"send_at": 1},
+        )
+        async for doc in cursor:
+            self._add(doc["_id"], doc["send_at"])
+
+    async def _deliver(self, doc_id: ObjectId) -> None:
+        self._loaded.discard(doc_id)
+        now = datetime.now()
+        # Claim, so another process with the same id in its wheel skips it
+        doc = await db().scheduled_messages.find_one_and_update(
+            {
+                "_id": doc_id,
+                "$or": [{"status": "pending"}, {"status": "sending", "locked_until": {"$lt": now}}],
+            },
+            {
+                "$set": {"status": "sending", "locked_until": now + CLAIM_LEASE, "owner": self._owner},
+                "$inc": {"attempts": 1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            return
+
+        try:
+            await self._bot.send_message(
+                doc["chat_id"],
+                doc["text"],
+                parse_mode=doc.get("parse_mode"),
+                reply_markup=InlineKeyboardMarkup.model_validate(doc["reply_markup"]) if doc.get("reply_markup") else None,
+            )
+        except TelegramForbiddenError:
+            await db().scheduled_messages.update_one({"_id": doc_id}, {"$set": {"status": "blocked", "finished_at": datetime.now()}})
+        except Exception:
+            logger.exception("Scheduled message %s failed", doc_id)
+            status = "failed" if doc["attempts"] >= MAX_ATTEMPTS else "pending"
+            retry_at = datetime.now() + timedelta(seconds=10 * 2 ** doc["attempts"])
+            update = {"status": status, "send_at": retry_at}
+            if status == "failed":
+                update["finished_at"] = datetime.now()
+            await db().scheduled_messages.update_one({"_id": doc_id}, {"$set": update})
+            if status == "pending":
+                self._add(doc_id, retry_at)
+        else:
+            now = datetime.now()
+            await db().scheduled_messages.update_one(
+                {"_id": doc_id}, {"$set": {"status": "sent", "sent_at": now, "finished_at": now}},
+            )
+
+    async def run(self) -> None:
+        last_load = 0.0
+        while True:
+            try:
+                if time.monotonic() - last_load >= LOAD_INTERVAL:
+                    last_load = time.monotonic()
+                    await self._load_due()
+
+                for doc_id in self._wheel.advance():
+                    task = asyncio.create_task(self._deliver(doc_id))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            except Exception:
+                logger.exception("Scheduler tick failed")
+            await asyncio.sleep(TICK)
+
+    def start(self) -> None:
+        self._runner = asyncio.create_task(self.run())
+
+    async def stop(self, timeout: float | None = None) -> None:
+        if self._runner:
+            self._runner.cancel()
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+_scheduler: Optional[DeliveryScheduler] = None
+
+
+def init_scheduler(bot: Bot) -> DeliveryScheduler:
+    global _scheduler
+    _scheduler = DeliveryScheduler(bot)
+    _scheduler.start()
+    return _scheduler
+
+
+def scheduler() -> DeliveryScheduler:
+    assert _scheduler is not None, "Планировщик не инициализирован"
+    return _scheduler
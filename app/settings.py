@@ -1,30 +1,292 @@
 from __future__ import annotations
 import os
-from pydantic import BaseModel
+from enum import StrEnum
+
+from pydantic import BaseModel, model_validator
 from pydantic_settings import SettingsConfigDict, BaseSettings
 
 
-class LLMSettings(BaseModel):
+class LLMEndpoint(BaseModel):
     base_url: str
     api_key: str
     general_model: str
     small_model: str
+    # Label in metrics and logs, the host of base_url when empty
+    name: str = ""
+    # Latencies are divided by it when endpoints are compared: 2.0 still gets calls while twice as slow
+    weight: float = 1.0
+    # Share of calls sent here whatever the latency, to try a new provider; a canary gets no other traffic
+    canary_share: float = 0.0
+    timeout_seconds: float = 180.0
+
+
+class LLMSettings(BaseModel):
+    # The first endpoint; may be left empty when `endpoints` is set
+    base_url: str | None = None
+    api_key: str | None = None
+    general_model: str | None = None
+    small_model: str | None = None
+    # More endpoints, as JSON in LLM_SETTINGS__ENDPOINTS
+    endpoints: list[LLMEndpoint] = []
+    # Weight of the last call in the moving averages of latency and errors
+    ewma_alpha: float = 0.2
+    # Consecutive failures that take an endpoint out of rotation, first for cooldown_seconds,
+    # doubled on every failed probe up to max_cooldown_seconds
+    failures_to_open: int = 3
+    cooldown_seconds: float = 30.0
+    max_cooldown_seconds: float = 600.0
+    # Endpoints tried for one call when the previous ones fail
+    max_attempts: int = 2
+
+    @model_validator(mode="after")
+    def _check_endpoints(self) -> "LLMSettings":
+        primary = (self.base_url, self.api_key, self.general_model, self.small_model)
+        if any(primary) and not all(primary):
+            raise ValueError("LLM_SETTINGS__BASE_URL, __API_KEY, __GENERAL_MODEL and __SMALL_MODEL go together")
+        if not self.all_endpoints():
+            raise ValueError("No LLM endpoint: set LLM_SETTINGS__BASE_URL or LLM_SETTINGS__ENDPOINTS")
+        return self
+
+    def all_endpoints(self) -> list[LLMEndpoint]:
+        if not self.base_url:
+            return list(self.endpoints)
+        primary = LLMEndpoint(
+            base_url=self.base_url, api_key=self.api_key,
+            general_model=self.general_model, small_model=self.small_model,
+        )
+        return [primary, *self.endpoints]
+
+
+class RetentionSettings(BaseModel):
+    enabled: bool = True
+    # None disables expiry for the collection
+    messages_ttl_days: int | None = 180
+    file_checking_ttl_days: int | None = 90
+    analyses_ttl_days: int | None = 365
+    # TTL indexes fire only after this grace so the archiver gets the documents first
+    ttl_grace_days: int = 7
+    # Scheduled messages that were sent, cancelled or gave up: removed this long after, without archiving
+    scheduled_messages_ttl_days: int | None = 30
+    # Jobs done or failed for good, likewise
+    jobs_ttl_days: int | None = 30
+    archive_dir: str = "/data/archive"
+    batch_size: int = 1000
+    interval_seconds: int = 6 * 60 * 60
+    # uploads younger than this are never collected: they may belong to an unfinished scene.
+    # Raised to the FSM state TTL plus the job retry window when that is longer, see retention.upload_min_age
+    upload_min_age_hours: int = 24
+
+
+class RunMode(StrEnum):
+    POLLING = "polling"
+    WEBHOOK = "webhook"
+
+
+class WebhookSettings(BaseModel):
+    # Public HTTPS base URL Telegram will call, e.g. https://bot.example.com
+    url: str | None = None
+    path: str = "/telegram/webhook"
+    secret_token: str | None = None
+    host: str = "0.0.0.0"
+    port: int = 8000
+    workers: int = 2
+    max_connections: int = 40
+    # Updates processed at once per worker
+    max_concurrent_updates: int = 64
+    # Above this backlog the webhook answers 503 and Telegram redelivers later
+    max_pending_updates: int = 1000
+
+
+class ShardingSettings(BaseModel):
+    # 0 processes updates inline in the receiving process.
+    # Per-chat order holds within one receiving process: polling, or webhook with a single uvicorn worker.
+    workers: int = 0
+    # Chats handled at once inside one worker process
+    concurrency_per_worker: int = 32
+    # Updates of one chat waiting for their turn in a worker, the ones above are dropped
+    max_queued_per_chat: int = 16
+    # A worker crashing more often than this within the window is retired and its chats go to the others
+    max_restarts: int = 3
+    restart_window_seconds: int = 300
+
+
+class OutboundSettings(BaseModel):
+    # Telegram allows about 30 messages per second per bot
+    global_rate: float = 30.0
+    global_burst: int = 10
+    # About one message per second in a private chat, 20 per minute in a group
+    private_chat_rate: float = 1.0
+    private_chat_burst: int = 3
+    group_chat_rate: float = 20 / 60
+    group_chat_burst: int = 3
+    max_retries: int = 3
+    max_tracked_chats: int = 50_000
+
+
+class JobsSettings(BaseModel):
+    # Run job workers inside the bot process; set to false when `python -m app.worker` runs them separately
+    embedded: bool = True
+    # Jobs handled at once by one process
+    concurrency: int = 4
+    lease_seconds: int = 120
+    heartbeat_seconds: int = 30
+    max_attempts: int = 3
+    poll_interval_seconds: float = 1.0
+    # Processes of `python -m app.worker` deployed next to the bot: they send messages too
+    standalone_workers: int = 0
+
+
+class CommandsSyncSettings(BaseModel):
+    # Hide the command menu inside scenes and show it outside of them
+    enabled: bool = True
+    # Chats whose visibility is kept in memory, the rest is read back from Mongo
+    cache_size: int = 10_000
+    # Another process may have changed the menu of a chat: after this the cached value is re-read
+    cache_ttl_seconds: int = 600
+    flush_interval_seconds: float = 1.0
+    # setMyCommands calls per second
+    rate: float = 5.0
+    max_pending: int = 10_000
+
+
+class WatchdogSettings(BaseModel):
+    enabled: bool = True
+    interval_seconds: float = 0.25
+    # The loop not coming back for this long is reported with the stack of the blocking code
+    threshold_seconds: float = 0.5
+    sentry: bool = False
+    # Label stalls with router:handler, costs a dict write per handler call
+    debug: bool = False
+
+
+class DedupSettings(BaseModel):
+    # Offer the previous report when a user uploads a resume this similar to one already analysed
+    enabled: bool = True
+    # Estimated Jaccard similarity of word shingles, 1.0 is the same text
+    threshold: float = 0.9
+    max_age_days: int = 90
+
+
+class SectionAnalysisSettings(BaseModel):
+    # Analyse resume sections with concurrent smaller prompts instead of one prompt for the whole resume
+    enabled: bool = False
+    # Section prompts of one analysis running at once
+    concurrency: int = 4
+    # Results are reused for sections that did not change between uploads
+    cache_ttl_days: int = 30
+
+
+class BatchSettings(BaseModel):
+    # Vacancies one /batch analysis accepts
+    max_vacancies: int = 10
+    # Vacancies extracted, checked and compared at once
+    concurrency: int = 4
+
+
+class OperationLimit(BaseModel):
+    # Sustained rate per user, and how many may come at once after a quiet period
+    per_hour: float
+    burst: int
+
+
+class PlanLimits(BaseModel):
+    # A document downloaded and its text extracted
+    upload: OperationLimit
+    # An LLM check that a document is a resume or a vacancy
+    validity: OperationLimit
+    # A full analysis or a /batch comparison queued
+    analysis: OperationLimit
+    # Analyses of one user queued or running at once
+    max_concurrent_analyses: int
+
+
+class AdmissionBackend(StrEnum):
+    # Per process: enough for polling, or when sharding keeps every chat in one worker
+    MEMORY = "memory"
+    # Shared by all processes, one round trip per limited update
+    MONGO = "mongo"
+
+
+class AdmissionSettings(BaseModel):
+    enabled: bool = True
+    backend: AdmissionBackend = AdmissionBackend.MONGO
+    free: PlanLimits = PlanLimits(
+        upload=OperationLimit(per_hour=20, burst=5),
+        validity=OperationLimit(per_hour=20, burst=5),
+        analysis=OperationLimit(per_hour=4, burst=2),
+        max_concurrent_analyses=1,
+    )
+    pro: PlanLimits = PlanLimits(
+        upload=OperationLimit(per_hour=60, burst=10),
+        validity=OperationLimit(per_hour=60, burst=10),
+        analysis=OperationLimit(per_hour=20, burst=5),
+        max_concurrent_analyses=2,
+    )
+    # A throttled user is told about it at most this often, further updates are dropped silently
+    notify_interval_seconds: float = 30.0
+
+
+class IndexCreation(StrEnum):
+    # Before the bot starts handling updates
+    STARTUP = "startup"
+    # Next to update handling, the bot starts right away
+    BACKGROUND = "background"
+    # Created by `python -m app.migrate` in the deploy step
+    MIGRATION = "migration"
 
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_nested_delimiter='__')
 
     telegram_token: str
+    # A local Bot API server, or the fake one of tools.replay; None is api.telegram.org
+    telegram_api_url: str | None = None
     mongo_dsn: str = "mongodb://localhost:27017/resume_bot"
     db_name: str = "resume_bot"
     data_dir: str = "/data/uploads"
     free_one_time_full: int = 1
+    index_creation: IndexCreation = IndexCreation.BACKGROUND
+    # On SIGTERM in-flight analyses and sends get this long to finish, unfinished jobs go back to the queue.
+    # Keep it below the orchestrator's grace period (stop_grace_period in docker-compose).
+    shutdown_deadline_seconds: float = 25.0
+    fsm_state_ttl_hours: int = 48
+    extraction_cache_ttl_days: int = 30
     sentry_dsn: str | None
+    # /metrics and /healthz in polling mode; webhook mode serves them next to the webhook
+    metrics_host: str = "0.0.0.0"
+    metrics_port: int | None = 8000
     user_agreement_url: str | None
     privacy_url: str | None
     # llm_settings: LLMSettings | None = None
     payments_provider_token: str | None = None
     llm_settings: LLMSettings
+    retention: RetentionSettings = RetentionSettings()
+    run_mode: RunMode = RunMode.POLLING
+    webhook: WebhookSettings = WebhookSettings()
+    sharding: ShardingSettings = ShardingSettings()
+    outbound: OutboundSettings = OutboundSettings()
+    jobs: JobsSettings = JobsSettings()
+    commands_sync: CommandsSyncSettings = CommandsSyncSettings()
+    watchdog: WatchdogSettings = WatchdogSettings()
+    dedup: DedupSettings = DedupSettings()
+    section_analysis: SectionAnalysisSettings = SectionAnalysisSettings()
+    batch: BatchSettings = BatchSettings()
+    admission: AdmissionSettings = AdmissionSettings()
+
+    @model_validator(mode="after")
+    def _check_webhook(self) -> "Settings":
+        if self.run_mode == RunMode.WEBHOOK and not (self.webhook.url and self.webhook.secret_token):
+            raise ValueError("WEBHOOK__URL and WEBHOOK__SECRET_TOKEN are required in webhook mode")
+        if self.run_mode == RunMode.WEBHOOK and self.webhook.workers > 1 and self.sharding.workers > 0:
+            # Every uvicorn worker would route the updates of a chat to its own shards: the chat order is lost
+            raise ValueError("SHARDING__WORKERS needs WEBHOOK__WORKERS=1 in webhook mode")
+        return self
+
+    def sending_processes(self) -> int:
+        """Processes calling the Bot API at the same time, each of them paces its share of the bot-wide limit."""
+        receivers = self.webhook.workers if self.run_mode == RunMode.WEBHOOK else 1
+        # Shard workers answer the updates; the receiving process still sends from its jobs and scheduler
+        return receivers * (1 + self.sharding.workers) + self.jobs.standalone_workers
 
 
 def get_settings() -> Settings:
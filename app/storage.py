@@ -10,16 +10,19 @@ def _safe_name(name: str) -> str:
     name = name.replace("..", "").replace("/", "_").replace("\\", "_")
     return name
 
-def save_upload(base_dir: str, user_id: int, filename: str, data: bytes) -> str:
+def upload_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+def save_upload(base_dir: str, user_id: int, filename: str, data: bytes) -> Tuple[str, str]:
     ensure_dir(base_dir)
     sub = os.path.join(base_dir, str(user_id))
     ensure_dir(sub)
     ext = os.path.splitext(filename)[1].lower() or ".bin"
-    digest = hashlib.sha256(data).hexdigest()[:16]
+    digest = upload_digest(data)
     stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
     fname = _safe_name(f"{stamp}_{digest}{ext}")
     path = os.path.join(sub, fname)
 
     with open(path, "wb") as f:
         f.write(data)
-    return path
+    return path, digest
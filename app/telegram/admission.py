@@ -0,0 +1,166 @@
+"""
+Per-user admission control of the expensive handlers.
+
+A handler declares what it is about to spend with a flag, e.g. `flags={"admission": (Operation.UPLOAD,)}`;
+the middleware charges a GCRA rate limit per user and operation before the handler runs, with limits
+of the user's plan, and also caps the analyses a user may have queued or running. A throttled update
+is answered at once and never reaches the download, the parser or the LLM. An update is charged for
+all of its operations or none, and a handler skipping a declared operation gives it back through the
+`refund_admission` argument.
+"""
+from __future__ import annotations
+import logging, time
+from collections import OrderedDict
+from datetime import datetime
+from enum import StrEnum
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from app.dal import AdmissionDAL, UserNotFound, UsersDAL
+from app.jobs import JobQueue
+from app.metrics import ADMISSION_REJECTIONS
+from app.models import Plans
+from app.settings import AdmissionBackend, AdmissionSettings, OperationLimit, PlanLimits
+
+logger = logging.getLogger(__name__)
+
+ADMISSION = "admission"
+MAX_TRACKED_KEYS = 100_000
+
+Refund = Callable[["Operation"], Awaitable[None]]
+
+
+class Operation(StrEnum):
+    UPLOAD = "upload"
+    VALIDITY = "validity"
+    ANALYSIS = "analysis"
+
+
+class MemoryLimiter:
+    """GCRA with the state of this process only."""
+
+    def __init__(self) -> None:
+        # key -> theoretical arrival time, least recently used first
+        self._tat: OrderedDict[str, float] = OrderedDict()
+
+    async def take(self, key: str, interval: float, tolerance: float, now: float) -> float:
+        tat = max(self._tat.pop(key, now), now)
+        wait = tat - now - tolerance
+        if wait <= 0:
+            tat += interval
+        self._tat[key] = tat
+        if len(self._tat) > MAX_TRACKED_KEYS:
+            # The oldest key has had the longest time to refill
+            self._tat.popitem(last=False)
+        return max(wait, 0.0)
+
+    async def refund(self, key: str, interval: float) -> None:
+        if key in self._tat:
+            self._tat[key] -= interval
+
+
+class MongoLimiter:
+    """GCRA shared by every process through the admission collection."""
+
+    async def take(self, key: str, interval: float, tolerance: float, now: float) -> float:
+        return await AdmissionDAL.take(key, interval, tolerance, now)
+
+    async def refund(self, key: str, interval: float) -> None:
+        await AdmissionDAL.refund(key, interval)
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """Inner middleware of messages and callback queries: flags are known once a handler is chosen."""
+
+    def __init__(self, settings: AdmissionSettings) -> None:
+        self._settings = settings
+        self._limiter = MongoLimiter() if settings.backend == AdmissionBackend.MONGO else MemoryLimiter()
+        # user_id -> when they were last told they are throttled
+        self._notified: OrderedDict[int, float] = OrderedDict()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        operations: Iterable[Operation] = get_flag(data, ADMISSION) or ()
+        user = data.get("event_from_user")
+        if not operations or user is None:
+            return await handler(event, data)
+
+        plan = await self._plan(user.id)
+        limits = self._settings.pro if plan == Plans.PRO else self._settings.free
+        rejection = await self._admit(user.id, operations, limits)
+        if rejection is None:
+            data["refund_admission"] = lambda operation: self._refund(user.id, operation, limits)
+            return await handler(event, data)
+
+        operation, retry_after = rejection
+        ADMISSION_REJECTIONS.labels(operation, plan).inc()
+        logger.info("User %s throttled on %s, plan %s", user.id, operation, plan)
+        await self._reject(event, user.id, operation, retry_after)
+        return None
+
+    async def _plan(self, user_id: int) -> Plans:
+        try:
+            user = await UsersDAL.get_user(user_id)
+        except UserNotFound:
+            return Plans.FREE
+        return Plans.PRO if user.subscription_until >= datetime.utcnow() else Plans.FREE
+
+    async def _admit(self, user_id: int, operations: Iterable[Operation],
+                     limits: PlanLimits) -> Optional[tuple[Operation, float]]:
+        """None when admitted, otherwise the operation that was refused and seconds to wait (0: unknown)."""
+        if Operation.ANALYSIS in operations:
+            # Checked before any token is taken; two updates at the same moment may both pass,
+            # the analysis rate limit bounds what that lets through
+            active = await JobQueue.count_active(user_id, limit=limits.max_concurrent_analyses)
+            if active >= limits.max_concurrent_analyses:
+                return Operation.ANALYSIS, 0.0
+
+        now = time.time()
+        charged: list[Operation] = []
+        for operation in operations:
+            limit: OperationLimit = getattr(limits, operation)
+            interval = 3600 / limit.per_hour
+            retry_after = await self._limiter.take(
+                f"{user_id}:{operation}", interval, interval * (limit.burst - 1), now,
+            )
+            if retry_after > 0:
+                # The update is refused as a whole: the operations charged before this one are given back
+                for done in charged:
+                    await self._refund(user_id, done, limits)
+                return operation, retry_after
+            charged.append(operation)
+        return None
+
+    async def _refund(self, user_id: int, operation: Operation, limits: PlanLimits) -> None:
+        limit: OperationLimit = getattr(limits, operation)
+        await self._limiter.refund(f"{user_id}:{operation}", 3600 / limit.per_hour)
+
+    async def _reject(self, event: TelegramObject, user_id: int, operation: Operation, retry_after: float) -> None:
+        if retry_after:
+            text = f"Слишком много запросов. Попробуйте снова через {max(1, round(retry_after / 60))} мин."
+        else:
+            text = "Дождитесь окончания текущего анализа — он уже в работе."
+
+        if isinstance(event, CallbackQuery):
+            # The button stops spinning either way, an answer costs no chat message
+            await event.answer(text)
+            return
+
+        now = time.monotonic()
+        notified_at = self._notified.pop(user_id, None)
+        if notified_at is not None and now - notified_at < self._settings.notify_interval_seconds:
+            # A script sending documents in a loop is not worth a reply to each of them
+            self._notified[user_id] = notified_at
+            return
+        self._notified[user_id] = now
+        if len(self._notified) > MAX_TRACKED_KEYS:
+            self._notified.popitem(last=False)
+        if isinstance(event, Message):
+            await event.answer(text)
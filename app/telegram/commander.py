@@ -6,6 +6,7 @@ async def setup_commands(chat_id: int | None, bot: Bot):
     await bot.set_my_commands(
         commands=[
             BotCommand(command="analysis", description="Анализ резюме"),
+            BotCommand(command="batch", description="Резюме против нескольких вакансий"),
             BotCommand(command="subscription", description="Покупка подписки"),
         ],
         scope=BotCommandScopeChat(chat_id=chat_id) if chat_id is not None else None,
@@ -0,0 +1,69 @@
+from __future__ import annotations
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from pymongo import ReturnDocument
+
+from app.db import db
+
+
+class MongoStorage(BaseStorage):
+    """
+    FSM storage shared by all bot processes.
+    Idle states expire through a TTL index on updated_at.
+    Keep only small references in data: documents are limited to 16MB and every read loads the whole data.
+    """
+    def __init__(self, ttl: timedelta, collection: str = "fsm_states") -> None:
+        self._ttl = ttl
+        self._collection = collection
+
+    def _coll(self):
+        return db()[self._collection]
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(
+            str(part) for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.destiny)
+        )
+
+    async def ensure_indexes(self) -> None:
+        await self._coll().create_index("updated_at", expireAfterSeconds=int(self._ttl.total_seconds()))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._coll().update_one(
+            {"_id": self._key(key)},
+            {"$set": {"state": value, "updated_at": datetime.now()}},
+            upsert=True,
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        doc = await self._coll().find_one({"_id": self._key(key)}, {"state": 1})
+        return doc.get("state") if doc else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._coll().update_one(
+            {"_id": self._key(key)},
+            {"$set": {"data": data, "updated_at": datetime.now()}},
+            upsert=True,
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        doc = await self._coll().find_one({"_id": self._key(key)}, {"data": 1})
+        return dict(doc.get("data") or {}) if doc else {}
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Field-level $set keeps concurrent updates of different keys from overwriting each other
+        doc = await self._coll().find_one_and_update(
+            {"_id": self._key(key)},
+            {"$set": {**{f"data.{k}": v for k, v in data.items()}, "updated_at": datetime.now()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return dict(doc.get("data") or {})
+
+    async def close(self) -> None:
+        # The Mongo client is owned by app.db
+        pass
@@ -1,40 +1,93 @@
-import asyncio
-import io, logging
+import asyncio, io, logging
 import re
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+from enum import StrEnum
 
 import sentry_sdk
 from aiogram import Bot, Router, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
+from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, Chat
 from pydantic import BaseModel
 
+from app.cv_analyzer.document import ResumeDocument
 from app.cv_analyzer.llm.service import LLMService
+from app.cv_analyzer.similarity import lsh_bands, similarity
 from app.cv_analyzer.static import analyze_resume_text
-from app.dal import MessagesDAL, AnalyticsDAL, UsersDAL, FileCheckingDAL
-from app.models import MessageModel, Analysis, MessageType, AnalysisDetail, FileChecking
-from app.settings import Settings
-from app.storage import save_upload
-from app.utils.long_messages import send_long_message
-from app.utils.text_parser import extract_text_auto
+from app.dal import MessagesDAL, AnalyticsDAL, UsersDAL, FileCheckingDAL, ExtractionsDAL, RollupsDAL
+from app.jobs import JobContext, JobQueue, job_handler
+from app.metrics import ANALYSES_IN_FLIGHT, ANALYSIS_OUTCOMES, ANALYSIS_STAGE_SECONDS
+from app.models import MessageModel, Analysis, MessageType, AnalysisDetail, FileChecking, Job, User
+from app.retention import analysis_expiry
+from app.settings import DedupSettings, Settings
+from app.storage import save_upload, upload_digest
+from app.telegram.admission import ADMISSION, Operation, Refund
+from app.utils.long_messages import send_long_message, send_sections
+from app.utils.outbound import deliver_later
+from app.utils.text_parser import UnreadableDocument, extract_text_auto_async
 
 logger = logging.getLogger(__name__)
 
 analysis_router = Router(name="analyis")
 
 CALLBACK_DATA = "skip_vacancy_details"
+REUSE_CACHED = "reuse_cached_report"
+REUSE_DIFF = "reuse_diff_analysis"
+REUSE_FULL = "reuse_full_analysis"
+ANALYSIS_JOB = "analysis"
+
+UNREADABLE_MESSAGES = {
+    UnreadableDocument.ENCRYPTED: "Файл защищён паролем. Снимите защиту и отправьте его ещё раз.",
+    UnreadableDocument.IMAGE_ONLY: (
+        "В файле нет текста — похоже, это скан или картинка. Пожалуйста, отправьте PDF или DOCX с текстом."
+    ),
+    UnreadableDocument.EMPTY: "Файл пустой. Пожалуйста, отправьте PDF или DOCX с текстом.",
+    UnreadableDocument.UNSUPPORTED: "Этот формат не поддерживается. Пожалуйста, отправьте PDF или DOCX с текстом.",
+    UnreadableDocument.BROKEN: (
+        "Не удалось прочитать файл — возможно, он повреждён. "
+        "Пожалуйста, убедитесь, что это PDF или DOCX с текстом, или обратитесь в поддержку."
+    ),
+}
 
 
 class AnalysisScene(StatesGroup):
     resume_waiting = State()
     vacancy_waiting = State()
+    reuse_waiting = State()
 
 
 class DocumentInfo(BaseModel):
+    """What FSM state and job payloads keep of a document: the text is loaded from the extraction cache by digest."""
     path: str
-    data: str
+    digest: str = ""
+
+    @classmethod
+    def of(cls, document: ResumeDocument) -> "DocumentInfo":
+        return cls(path=document.path, digest=document.digest)
+
+
+class AnalysisMode(StrEnum):
+    FULL = "full"
+    # Updates the previous report from the changes of the resume
+    DIFF = "diff"
+
+
+class PreviousAnalysis(BaseModel):
+    id: str
+    similarity: float
+    resume_digest: str = ""
+    vacancy_digest: str = ""
+
+
+class AnalysisJobPayload(BaseModel):
+    user_id: int
+    chat_id: int
+    resume: DocumentInfo
+    vacancy: DocumentInfo | None = None
+    mode: AnalysisMode = AnalysisMode.FULL
+    previous_id: str | None = None
 
 
 @analysis_router.message(Command("analysis"))
@@ -51,28 +104,37 @@ async def analysis(message: Message, state: FSMContext):
         )
     )
 
+    if not await can_analyse(message, user):
+        return
+
+    await state.set_state(AnalysisScene.resume_waiting)
+    await message.answer("Пожалуйста, отправьте файл своего резюме в PDF или DOCX формате для анализа.")
+
+
+async def can_analyse(message: Message, user: User) -> bool:
     if not user.accepted_rules:
         await message.answer("Пожалуйста, примите соглашение. Для этого воспользуйтесь командой /start")
-        return
+        return False
 
     # Полный отчёт
     if user.subscription_until < datetime.utcnow() and user.one_time_full_left <= 0:
         await message.answer(
             f"Оплатите подписку, чтобы пользоваться отчётами о резюме. Команда: /subscription"
         )
-        return
+        return False
+    return True
 
-    await state.set_state(AnalysisScene.resume_waiting)
-    await message.answer("Пожалуйста, отправьте файл своего резюме в PDF или DOCX формате для анализа.")
 
-
-@analysis_router.message(AnalysisScene.resume_waiting, F.document)
-async def handle_resume(message: Message, state: FSMContext, bot: Bot, settings: Settings) -> None:
-    await message.answer("Читаем файл...")
+@analysis_router.message(AnalysisScene.resume_waiting, F.document,
+                         flags={ADMISSION: (Operation.UPLOAD, Operation.VALIDITY)})
+async def handle_resume(message: Message, state: FSMContext, bot: Bot, settings: Settings,
+                        refund_admission: Refund | None = None) -> None:
+    # Progress notes don't need to hold the handler while the chat is paced
+    deliver_later(message.answer("Читаем файл..."))
 
     # download bytes
     try:
-        resume_info = await get_text_from_message(bot, message, settings.data_dir)
+        resume = await get_document_from_message(bot, message, settings.data_dir)
         await MessagesDAL.insert(
             MessageModel(
                 type=MessageType.DOCUMENT,
@@ -83,8 +145,13 @@ async def handle_resume(message: Message, state: FSMContext, bot: Bot, settings:
                 file_name=message.document.file_name,
             )
         )
+        await RollupsDAL.track_upload("resume")
 
+    except UnreadableDocument as e:
+        await reject_unreadable(message, e)
+        return
     except:
+        ANALYSIS_OUTCOMES.labels("unreadable_file").inc()
         await message.answer(
             "Не удалось извлечь текст из файла. Пожалуйста, убедитесь, что это PDF или DOCX с текстом. Или обратитесь в поддержку."
         )
@@ -101,14 +168,40 @@ async def handle_resume(message: Message, state: FSMContext, bot: Bot, settings:
 
         raise
 
-    await message.answer("Проверяем файл...")
+    # A near-duplicate of a resume analysed before has passed the check already
+    previous = await find_previous_analysis(message.from_user.id, resume, settings.dedup)
+    if previous is not None:
+        await refund(refund_admission, Operation.VALIDITY)
+    elif not await check_resume(message, resume, settings):
+        return
+
+    # save file to analysis documents
+    await state.update_data(
+        resume_info=DocumentInfo.of(resume).model_dump(),
+        previous_analysis=previous.model_dump() if previous else None,
+    )
+
+    # Add button to skip vacancy details
+    await message.answer(
+        "Файл получен.\n\n"
+        "Теперь добавьте, если хотите, название вакансии или её описание. Можно сделать текстом или документом PDF/TXT."
+        "Можете пропустить этот шаг и сразу получить анализ резюме.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="⏩ Без описания вакансии!", callback_data=CALLBACK_DATA)
+        ]]),
+    )
+    await state.set_state(AnalysisScene.vacancy_waiting)
+
+
+async def check_resume(message: Message, resume: ResumeDocument, settings: Settings) -> bool:
+    deliver_later(message.answer("Проверяем файл..."))
 
     llm_service = LLMService.build(settings.llm_settings)
     try:
-        detail = await llm_service.check_resume_is_valid(
-            resume_info.data,
-        )
+        with ANALYSIS_STAGE_SECONDS.labels("validity_llm").time():
+            detail = await llm_service.check_resume_is_valid(resume)
     except:
+        ANALYSIS_OUTCOMES.labels("llm_error").inc()
         await message.answer(
             "Произошла ошибка при проверке файла. Пожалуйста, попробуйте позже или обратитесь в поддержку."
         )
@@ -117,39 +210,53 @@ async def handle_resume(message: Message, state: FSMContext, bot: Bot, settings:
     if not detail.is_valid:
         await FileCheckingDAL.insert(FileChecking(
             user_id=message.from_user.id,
-            filepath=resume_info.path,
+            filepath=resume.path,
             result=detail,
         ))
+        await RollupsDAL.track_validity_rejection("resume")
+        ANALYSIS_OUTCOMES.labels("invalid_file").inc()
         await message.answer(
             f"Похоже, что это не резюме.\n\n"
             # f"{detail.reason}\n\n"
             "Пожалуйста, отправьте корректный файл описания вакансии текстом или в PDF/DOCX формате."
         )
-        return
-
-    # save file to analysis documents
-    await state.update_data(resume_info=resume_info)
-
-    # Add button to skip vacancy details
-    await message.answer(
-        "Файл получен.\n\n"
-        "Теперь добавьте, если хотите, название вакансии или её описание. Можно сделать текстом или документом PDF/TXT."
-        "Можете пропустить этот шаг и сразу получить анализ резюме.",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(text="⏩ Без описания вакансии!", callback_data=CALLBACK_DATA)
-        ]]),
-    )
-    await state.set_state(AnalysisScene.vacancy_waiting)
-
+        return False
+    return True
+
+
+async def resume_signature(resume: ResumeDocument) -> list[int]:
+    # Pure Python MinHash takes about half a second for a long resume: off the event loop, cached afterwards
+    return await asyncio.to_thread(getattr, resume, "signature")
+
+
+async def find_previous_analysis(user_id: int, resume: ResumeDocument, settings: DedupSettings) -> PreviousAnalysis | None:
+    """The most similar earlier analysis of the user above the threshold, found through the LSH bands."""
+    if not settings.enabled:
+        return None
+    since = datetime.now() - timedelta(days=settings.max_age_days)
+    signature = await resume_signature(resume)
+    best: PreviousAnalysis | None = None
+    for candidate in await AnalyticsDAL.find_by_bands(user_id, lsh_bands(signature), since):
+        score = similarity(signature, candidate.get("minhash", []))
+        if score >= settings.threshold and (best is None or score > best.similarity):
+            best = PreviousAnalysis(
+                id=str(candidate["_id"]),
+                similarity=score,
+                resume_digest=candidate.get("resume_digest", ""),
+                vacancy_digest=candidate.get("vacancy_digest", ""),
+            )
+    return best
 
-@analysis_router.message(AnalysisScene.vacancy_waiting, F.document)
-async def handle_vacancy(message: Message, state: FSMContext, bot: Bot, settings: Settings) -> None:
 
-    await message.answer("Читаем файл...")
+@analysis_router.message(AnalysisScene.vacancy_waiting, F.document,
+                         flags={ADMISSION: (Operation.UPLOAD, Operation.VALIDITY, Operation.ANALYSIS)})
+async def handle_vacancy(message: Message, state: FSMContext, bot: Bot, settings: Settings,
+                         refund_admission: Refund | None = None) -> None:
+    deliver_later(message.answer("Читаем файл..."))
 
     # download bytes
     try:
-        vacancy_info = await get_text_from_message(bot, message, settings.data_dir)
+        vacancy = await get_document_from_message(bot, message, settings.data_dir)
         await MessagesDAL.insert(
             MessageModel(
                 type=MessageType.DOCUMENT,
@@ -160,7 +267,13 @@ async def handle_vacancy(message: Message, state: FSMContext, bot: Bot, settings
                 file_name=message.document.file_name,
             )
         )
+        await RollupsDAL.track_upload("vacancy")
+    except UnreadableDocument as e:
+        await reject_unreadable(message, e)
+        await refund(refund_admission, Operation.ANALYSIS)
+        return
     except:
+        ANALYSIS_OUTCOMES.labels("unreadable_file").inc()
         await MessagesDAL.insert(
             MessageModel(
                 type=MessageType.DOCUMENT,
@@ -179,10 +292,10 @@ async def handle_vacancy(message: Message, state: FSMContext, bot: Bot, settings
 
     llm_service = LLMService.build(settings.llm_settings)
     try:
-        file_checking_result = await llm_service.check_resume_is_valid(
-            vacancy_info.data,
-        )
+        with ANALYSIS_STAGE_SECONDS.labels("validity_llm").time():
+            file_checking_result = await llm_service.check_resume_is_valid(vacancy)
     except:
+        ANALYSIS_OUTCOMES.labels("llm_error").inc()
         await message.answer(
             "Произошла ошибка при проверке файла. Пожалуйста, попробуйте позже или обратитесь в поддержку."
         )
@@ -191,28 +304,33 @@ async def handle_vacancy(message: Message, state: FSMContext, bot: Bot, settings
     if not file_checking_result.is_valid:
         await FileCheckingDAL.insert(FileChecking(
             user_id=message.from_user.id,
-            filepath=vacancy_info.path,
+            filepath=vacancy.path,
             result=file_checking_result,
         ))
+        await RollupsDAL.track_validity_rejection("vacancy")
+        ANALYSIS_OUTCOMES.labels("invalid_file").inc()
         await message.answer(
             f"Похоже, что это не описание вакансии.\n\n"
             # f"{file_checking_result.reason}\n\n"
             "Пожалуйста, отправьте корректный файл резюме в PDF или DOCX формате."
         )
+        await refund(refund_admission, Operation.ANALYSIS)
         return
 
-    data = await state.get_data()
-    resume_info: DocumentInfo = data.get("resume_info")
+    resume_info = await load_resume_info(state)
     if not resume_info:
         await message.answer("Произошла ошибка. Пожалуйста, начните анализ заново командой /analysis.")
         await state.clear()
+        await refund(refund_admission, Operation.ANALYSIS)
         return
 
-    await process_resume(message, resume_info, vacancy_info, settings)
+    await offer_or_enqueue(message, message.from_user.id, state, resume_info, DocumentInfo.of(vacancy), settings,
+                           refund_admission)
 
 
-@analysis_router.message(AnalysisScene.vacancy_waiting)
-async def handle_vacancy_text(message: Message, state: FSMContext, bot: Bot, settings: Settings) -> None:
+@analysis_router.message(AnalysisScene.vacancy_waiting, flags={ADMISSION: (Operation.ANALYSIS,)})
+async def handle_vacancy_text(message: Message, state: FSMContext, bot: Bot, settings: Settings,
+                              refund_admission: Refund | None = None) -> None:
     await MessagesDAL.insert(
         MessageModel(
             type=MessageType.TEXT,
@@ -223,18 +341,26 @@ async def handle_vacancy_text(message: Message, state: FSMContext, bot: Bot, set
         )
     )
 
-    data = await state.get_data()
-    resume_info: DocumentInfo = data.get("resume_info")
+    resume_info = await load_resume_info(state)
     if not resume_info:
         await message.answer("Произошла ошибка. Пожалуйста, начните анализ заново командой /analysis.")
         await state.clear()
+        await refund(refund_admission, Operation.ANALYSIS)
         return
 
-    await process_resume(message, resume_info, DocumentInfo(path="", data=message.text), settings)
+    # Text vacancies go to the extraction cache too, so the job payload holds only a digest
+    vacancy_text = message.text or ""
+    vacancy = ResumeDocument.from_raw(vacancy_text, digest=upload_digest(vacancy_text.encode()))
+    await ExtractionsDAL.put(vacancy.digest, vacancy.text)
+
+    await offer_or_enqueue(message, message.from_user.id, state, resume_info, DocumentInfo.of(vacancy), settings,
+                           refund_admission)
 
 
-@analysis_router.callback_query(AnalysisScene.vacancy_waiting, F.data == CALLBACK_DATA)
-async def handle_skip_vacancy(callback: CallbackQuery, state: FSMContext, settings: Settings) -> None:
+@analysis_router.callback_query(AnalysisScene.vacancy_waiting, F.data == CALLBACK_DATA,
+                                flags={ADMISSION: (Operation.ANALYSIS,)})
+async def handle_skip_vacancy(callback: CallbackQuery, state: FSMContext, settings: Settings,
+                              refund_admission: Refund | None = None) -> None:
     await MessagesDAL.insert(
         MessageModel(
             type=MessageType.CALLBACK,
@@ -246,54 +372,229 @@ async def handle_skip_vacancy(callback: CallbackQuery, state: FSMContext, settin
         )
     )
 
-    data = await state.get_data()
-    resume_info: DocumentInfo = data.get("resume_info")
+    resume_info = await load_resume_info(state)
     if not resume_info:
         await callback.message.answer("Произошла ошибка. Пожалуйста, начните анализ заново командой /analysis.")
         await state.clear()
+        await refund(refund_admission, Operation.ANALYSIS)
         return
 
-    await process_resume(
-        callback.message,
-        resume_info,
-        DocumentInfo(path="", data=""),
-        settings,
+    await offer_or_enqueue(callback.message, callback.from_user.id, state, resume_info, None, settings,
+                           refund_admission)
+
+
+@analysis_router.callback_query(AnalysisScene.reuse_waiting, F.data.in_({REUSE_CACHED, REUSE_DIFF, REUSE_FULL}),
+                                flags={ADMISSION: (Operation.ANALYSIS,)})
+async def handle_reuse_choice(callback: CallbackQuery, state: FSMContext, settings: Settings,
+                              refund_admission: Refund | None = None) -> None:
+    await MessagesDAL.insert(
+        MessageModel(
+            type=MessageType.CALLBACK,
+            message_id=callback.message.message_id if callback.message else -1,
+            text="",
+            chat_id=callback.message.chat.id if callback.message else -1,
+            user_id=callback.from_user.id,
+            callback_data=callback.data,
+        )
     )
+
+    data = await state.get_data()
     await state.clear()
+    if not data.get("pending_analysis"):
+        await callback.message.answer("Произошла ошибка. Пожалуйста, начните анализ заново командой /analysis.")
+        await refund(refund_admission, Operation.ANALYSIS)
+        return
+    payload = AnalysisJobPayload.model_validate(data["pending_analysis"])
+
+    if callback.data == REUSE_CACHED:
+        previous = await AnalyticsDAL.get(payload.previous_id)
+        if previous is not None:
+            ANALYSIS_OUTCOMES.labels("reused").inc()
+            await send_ok_message(previous.details[0], callback.message)
+            await refund(refund_admission, Operation.ANALYSIS)
+            return
+        # Removed by retention meanwhile
+        payload.mode = AnalysisMode.FULL
+    elif callback.data == REUSE_DIFF:
+        payload.mode = AnalysisMode.DIFF
+    else:
+        payload.mode = AnalysisMode.FULL
 
+    await enqueue_analysis(callback.message, payload, settings)
 
-async def process_resume(message: Message, cv_info: DocumentInfo, vacancy_info: DocumentInfo,
-                         settings: Settings) -> None:
-    heuristic = analyze_resume_text(cv_info.data)
-    score = heuristic.score
 
-    await message.answer("Анализируем резюме...\nЭто может занять несколько минут.")
-    try:
-        llm_service = LLMService.build(settings.llm_settings)
-        detail = await llm_service.full_feedback(
-            cv_info.data,
-            vacancy_info.data,
+async def refund(refund_admission: Refund | None, operation: Operation) -> None:
+    """Gives back an admission token of an operation the handler did not perform."""
+    if refund_admission is not None:
+        await refund_admission(operation)
+
+
+async def reject_unreadable(message: Message, error: UnreadableDocument) -> None:
+    # Expected for scans and protected files: no retry, no error report
+    ANALYSIS_OUTCOMES.labels(f"unreadable_{error.reason}").inc()
+    await MessagesDAL.insert(
+        MessageModel(
+            type=MessageType.DOCUMENT,
+            message_id=message.message_id,
+            text=f"UNREADABLE:{error.reason}",
+            chat_id=message.chat.id,
+            user_id=message.from_user.id if message.from_user else None,
+            file_name=message.document.file_name,
         )
-    except:
-        await message.answer(
-            "Произошла ошибка при анализе резюме. Пожалуйста, попробуйте позже или обратитесь в поддержку."
+    )
+    await message.answer(UNREADABLE_MESSAGES[error.reason])
+
+
+async def offer_or_enqueue(message: Message, user_id: int, state: FSMContext, cv_info: DocumentInfo,
+                           vacancy_info: DocumentInfo | None, settings: Settings,
+                           refund_admission: Refund | None = None) -> None:
+    """Enqueues the analysis, or offers the earlier report first: the analysis token is charged on the choice."""
+    payload = AnalysisJobPayload(user_id=user_id, chat_id=message.chat.id, resume=cv_info, vacancy=vacancy_info)
+    data = await state.get_data()
+    previous = PreviousAnalysis.model_validate(data["previous_analysis"]) if data.get("previous_analysis") else None
+
+    # The previous report only answers the same question: same vacancy, or none both times
+    if previous is None or previous.vacancy_digest != (vacancy_info.digest if vacancy_info else ""):
+        await state.clear()
+        await enqueue_analysis(message, payload, settings)
+        return
+
+    payload.previous_id = previous.id
+    await refund(refund_admission, Operation.ANALYSIS)
+    await state.update_data(pending_analysis=payload.model_dump())
+    await state.set_state(AnalysisScene.reuse_waiting)
+    buttons = [InlineKeyboardButton(text="📄 Показать прошлый отчёт", callback_data=REUSE_CACHED)]
+    if previous.resume_digest != cv_info.digest:
+        buttons.append(InlineKeyboardButton(text="🔍 Разобрать только изменения", callback_data=REUSE_DIFF))
+    buttons.append(InlineKeyboardButton(text="🔄 Полный анализ заново", callback_data=REUSE_FULL))
+    await message.answer(
+        f"Это резюме почти совпадает с тем, что вы уже присылали (сходство {previous.similarity:.0%}).\n\n"
+        "Можно сразу посмотреть прошлый отчёт, разобрать только изменения или сделать полный анализ заново.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[button] for button in buttons]),
+    )
+
+
+async def enqueue_analysis(message: Message, payload: AnalysisJobPayload, settings: Settings) -> None:
+    await JobQueue.enqueue(ANALYSIS_JOB, payload.model_dump(), settings.jobs.max_attempts)
+    await message.answer("Анализируем резюме...\nЭто может занять несколько минут.")
+
+
+def chat_message(bot: Bot, chat_id: int) -> Message:
+    # Jobs run outside of an update: a bare message bound to the bot answers into the chat
+    return Message(message_id=-1, date=datetime.now(), chat=Chat(id=chat_id, type="private")).as_(bot)
+
+
+async def _analysis_failed(job: Job, ctx: JobContext) -> None:
+    payload = AnalysisJobPayload.model_validate(job.payload)
+    await ctx.bot.send_message(
+        payload.chat_id,
+        "Произошла ошибка при анализе резюме. Пожалуйста, попробуйте позже или обратитесь в поддержку.",
+    )
+
+
+@job_handler(ANALYSIS_JOB, on_failure=_analysis_failed)
+async def run_analysis_job(job: Job, ctx: JobContext) -> None:
+    payload = AnalysisJobPayload.model_validate(job.payload)
+    if job.attempts > 1:
+        await ctx.progress(job, payload.chat_id, "Анализ занимает больше времени, чем обычно. Продолжаем...")
+
+    stored = await AnalyticsDAL.find_by_job(str(job.id))
+    if stored is not None:
+        # An earlier attempt got the report already: only what it did not finish is repeated
+        if not stored.delivered:
+            await deliver_analysis(chat_message(ctx.bot, payload.chat_id), stored)
+        return
+
+    cv = await load_document(payload.resume)
+    vacancy = await load_document(payload.vacancy) if payload.vacancy else None
+    previous = await load_previous(payload) if payload.mode == AnalysisMode.DIFF else None
+
+    with ANALYSES_IN_FLIGHT.track_inprogress():
+        await process_resume(
+            chat_message(ctx.bot, payload.chat_id), payload.user_id, cv, vacancy, ctx.settings, previous,
+            job_id=str(job.id),
         )
+
+
+async def load_previous(payload: AnalysisJobPayload) -> tuple[AnalysisDetail, ResumeDocument] | None:
+    """The report and text of the earlier version, None when either has expired: the job runs a full analysis."""
+    analysis = await AnalyticsDAL.get(payload.previous_id) if payload.previous_id else None
+    if analysis is None or not analysis.resume_digest:
+        return None
+    text = await ExtractionsDAL.get(analysis.resume_digest)
+    if text is None:
+        return None
+    return analysis.details[0], ResumeDocument(digest=analysis.resume_digest, text=text)
+
+
+async def process_resume(message: Message, user_id: int, cv: ResumeDocument, vacancy: ResumeDocument | None,
+                         settings: Settings, previous: tuple[AnalysisDetail, ResumeDocument] | None = None,
+                         job_id: str | None = None) -> None:
+    with ANALYSIS_STAGE_SECONDS.labels("static").time():
+        heuristic = analyze_resume_text(cv)
+    score = heuristic.score
+
+    started = time.monotonic()
+    llm_service = LLMService.build(settings.llm_settings)
+    try:
+        if previous is not None:
+            with ANALYSIS_STAGE_SECONDS.labels("diff_llm").time():
+                detail = await llm_service.diff_feedback(*previous, cv, vacancy)
+        elif settings.section_analysis.enabled:
+            with ANALYSIS_STAGE_SECONDS.labels("section_llm").time():
+                detail = await llm_service.sectioned_feedback(cv, vacancy, settings.section_analysis.concurrency)
+        else:
+            with ANALYSIS_STAGE_SECONDS.labels("full_llm").time():
+                detail = await llm_service.full_feedback(cv, vacancy)
+    except Exception:
+        ANALYSIS_OUTCOMES.labels("llm_error").inc()
         raise
 
-    await AnalyticsDAL.insert(
-        Analysis(
-            user_id=message.from_user.id,
-            filepaths=[cv_info.path, vacancy_info.path],
-            details=[detail, heuristic],
-        )
-    )
+    if detail is None:
+        # The text did not change since the earlier version: its report stands, like "show the previous report"
+        ANALYSIS_OUTCOMES.labels("reused").inc()
+        await send_ok_message(previous[0], message)
+        return
 
-    if detail.ok:
-        await send_ok_message(detail, message)
+    signature = await resume_signature(cv)
+    analysis = Analysis(
+        user_id=user_id,
+        filepaths=[cv.path, vacancy.path if vacancy else ""],
+        details=[detail, heuristic],
+        resume_digest=cv.digest,
+        vacancy_digest=vacancy.digest if vacancy else "",
+        minhash=signature,
+        lsh_bands=lsh_bands(signature),
+        job_id=job_id,
+    )
+    # Stored before anything is sent, so a retry of the job starts from here
+    if job_id:
+        analysis = await AnalyticsDAL.insert_for_job(analysis)
     else:
-        await send_raw_message(detail, message)
+        await AnalyticsDAL.insert(analysis)
+    # The analysis refers to its texts by digest: they must outlive the extraction cache
+    await ExtractionsDAL.retain(
+        [analysis.resume_digest, analysis.vacancy_digest], analysis_expiry(settings.retention, analysis.created_at),
+    )
+    await RollupsDAL.track_analysis(time.monotonic() - started)
 
-    user = await UsersDAL.get_user(message.from_user.id)
+    ANALYSIS_OUTCOMES.labels("ok" if detail.ok else "parse_failure").inc()
+    await deliver_analysis(message, analysis)
+
+
+async def deliver_analysis(message: Message, analysis: Analysis) -> None:
+    """Sends the report, then consumes the credit once per analysis."""
+    detail = analysis.details[0]
+    with ANALYSIS_STAGE_SECONDS.labels("send").time():
+        if detail.ok:
+            await send_ok_message(detail, message)
+        else:
+            await send_raw_message(detail, message)
+
+    # A crash between sending and this mark resends the report once, never charges twice
+    if analysis.job_id and not await AnalyticsDAL.mark_delivered(analysis.job_id):
+        return
+    user = await UsersDAL.get_user(analysis.user_id)
     await UsersDAL.consume_one_time_full(user.tg_user_id)
     await message.answer(
         "На этом демонстрация окончена.\n\n"
@@ -301,66 +602,92 @@ async def process_resume(message: Message, cv_info: DocumentInfo, vacancy_info:
     )
 
 
-def _escape_md_v2(text: str) -> str:
+def escape_md_v2(text: str) -> str:
     # Telegram MarkdownV2 requires escaping these characters
     return re.sub(r'([_*[\]()~`>#\+\-=|{}\.!])', r'\\\1', text)
 
 
 async def send_ok_message(detail: AnalysisDetail, message: Message) -> None:
+    # Sections share messages as long as they fit, a short report is a single message
+    await send_sections(message, report_sections(detail), parse_mode="MarkdownV2")
+
+
+def report_sections(detail: AnalysisDetail) -> list[str]:
     score_str = str(detail.score) if detail.score is not None else "—"
-    sections: list[str] = [f"*📊 Оценка резюме: {_escape_md_v2(score_str)}/100*"]
+    sections: list[str] = [f"*📊 Оценка резюме: {escape_md_v2(score_str)}/100*"]
 
     if detail.strengths:
-        strengths = "\n".join(f"• {_escape_md_v2(s)}" for s in detail.strengths)
+        strengths = "\n".join(f"• {escape_md_v2(s)}" for s in detail.strengths)
         sections.append(f"*✅ Сильные стороны*\n{strengths}")
 
-        full_text = "\n\n".join(sections)
-        await send_long_message(message, full_text, parse_mode="MarkdownV2")
-        sections = []
-
     if detail.problems:
-        problems = "\n".join(f"• {_escape_md_v2(p)}" for p in detail.problems)
+        problems = "\n".join(f"• {escape_md_v2(p)}" for p in detail.problems)
         sections.append(f"*⚠️ Проблемы*\n{problems}")
 
-        full_text = "\n\n".join(sections)
-        await send_long_message(message, full_text, parse_mode="MarkdownV2")
-        sections = []
-
     if detail.actions:
-        actions = "\n".join(f"• {_escape_md_v2(a)}" for a in detail.actions[:10])
+        actions = "\n".join(f"• {escape_md_v2(a)}" for a in detail.actions[:10])
         sections.append(f"*🛠 Что сделать*\n{actions}")
-
-        full_text = "\n\n".join(sections)
-        await send_long_message(message, full_text, parse_mode="MarkdownV2")
-        sections = []
-
-    if sections:
-        full_text = "\n\n".join(sections)
-        await send_long_message(message, full_text, parse_mode="MarkdownV2")
+    return sections
 
 
 async def send_raw_message(detail: AnalysisDetail, message: Message) -> None:
     sentry_sdk.capture_message(
-        f"LLM resume analysis parsing failed for user. {message.from_user.id=} {message.message_id=}",
+        f"LLM resume analysis parsing failed for user. {message.chat.id=}",
         level="warning",
     )
     await message.answer(
         "Не удалось корректно проанализировать резюме. Вот что вернуло LLM (возможно, формат ответа не соответствует ожидаемому):"
     )
-    await send_long_message(message, _escape_md_v2(detail.raw), parse_mode="MarkdownV2")
+    await send_long_message(message, escape_md_v2(detail.raw), parse_mode="MarkdownV2")
+
+
+async def get_document_from_message(bot: Bot, message: Message, data_dir: str) -> ResumeDocument:
+    return await fetch_document(
+        bot, message.document.file_id, message.document.file_name, message.from_user.id, data_dir,
+    )
 
 
-async def get_text_from_message(bot: Bot, message: Message, data_dir: str) -> DocumentInfo:
-    tg_file = await bot.get_file(message.document.file_id)
-    buf = io.BytesIO()
-    await bot.download_file(tg_file.file_path, buf)
+async def fetch_document(bot: Bot, file_id: str, file_name: str | None, user_id: int, data_dir: str) -> ResumeDocument:
+    with ANALYSIS_STAGE_SECONDS.labels("download").time():
+        tg_file = await bot.get_file(file_id)
+        buf = io.BytesIO()
+        await bot.download_file(tg_file.file_path, buf)
     data = buf.getvalue()
-    filename = message.document.file_name or f"resume_{message.document.file_id}"
+    filename = file_name or f"resume_{file_id}"
 
     # Save locally
-    path = save_upload(data_dir, message.from_user.id, filename, data)
+    with ANALYSIS_STAGE_SECONDS.labels("save").time():
+        path, digest = save_upload(data_dir, user_id, filename, data)
 
-    return DocumentInfo(
-        path=path,
-        data=extract_text_auto(path),
-    )
+    # The same file uploaded again is not parsed twice
+    with ANALYSIS_STAGE_SECONDS.labels("extract").time():
+        text = await ExtractionsDAL.get(digest)
+        if text is not None:
+            return ResumeDocument(digest=digest, text=text, path=path)
+
+        document = ResumeDocument.from_raw(await extract_text_auto_async(path), digest=digest, path=path)
+        if not document:
+            raise UnreadableDocument(UnreadableDocument.EMPTY)
+        # The cache keeps the normalized text
+        await ExtractionsDAL.put(digest, document.text)
+    return document
+
+
+async def load_document(info: DocumentInfo) -> ResumeDocument:
+    text = await ExtractionsDAL.get(info.digest) if info.digest else None
+    if text is not None:
+        return ResumeDocument(digest=info.digest, text=text, path=info.path)
+
+    # Cache entry expired: the upload is still on disk
+    document = ResumeDocument.from_raw(await extract_text_auto_async(info.path), digest=info.digest, path=info.path)
+    if info.digest:
+        await ExtractionsDAL.put(info.digest, document.text)
+    return document
+
+
+async def load_resume_info(state: FSMContext) -> DocumentInfo | None:
+    data = await state.get_data()
+    if not data.get("resume_info"):
+        return None
+    # Only the reference: the job loads the text
+    return DocumentInfo.model_validate(data["resume_info"])
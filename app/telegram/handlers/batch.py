@@ -0,0 +1,380 @@
+import asyncio, logging
+import time
+
+from aiogram import Bot, Router, F
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import StatesGroup, State
+from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
+from pydantic import BaseModel
+
+from app.cv_analyzer.document import ResumeDocument
+from app.cv_analyzer.llm.service import LLMService
+from app.cv_analyzer.static import analyze_resume_text
+from app.dal import MessagesDAL, AnalyticsDAL, UsersDAL, ExtractionsDAL, RollupsDAL
+from app.jobs import JobContext, JobQueue, job_handler
+from app.metrics import ANALYSES_IN_FLIGHT, ANALYSIS_OUTCOMES, ANALYSIS_STAGE_SECONDS
+from app.models import MessageModel, Analysis, MessageType, AnalysisDetail, Job, SkippedVacancy
+from app.retention import analysis_expiry
+from app.settings import Settings
+from app.storage import upload_digest
+from app.telegram.admission import ADMISSION, Operation
+from app.telegram.handlers.analysis import (
+    DocumentInfo, can_analyse, chat_message, check_resume, escape_md_v2, fetch_document,
+    get_document_from_message, load_document, reject_unreadable, report_sections,
+)
+from app.utils.long_messages import send_sections
+from app.utils.outbound import deliver_later
+from app.utils.text_parser import UnreadableDocument
+
+logger = logging.getLogger(__name__)
+
+batch_router = Router(name="batch")
+
+BATCH_JOB = "batch_analysis"
+DONE_CALLBACK_DATA = "batch_vacancies_done"
+# One FSM data key per vacancy message: concurrent updates of the chat never overwrite each other
+VACANCY_KEY_PREFIX = "batch_vacancy_"
+
+
+class BatchAnalysisScene(StatesGroup):
+    resume_waiting = State()
+    vacancies_waiting = State()
+
+
+class PendingVacancy(BaseModel):
+    message_id: int
+    # File vacancies are downloaded by the job, all of them at once
+    file_id: str = ""
+    file_name: str = ""
+    # Text vacancies are in the extraction cache already
+    digest: str = ""
+
+
+class BatchJobPayload(BaseModel):
+    user_id: int
+    chat_id: int
+    resume: DocumentInfo
+    vacancies: list[PendingVacancy]
+
+
+class VacancyResult(BaseModel):
+    number: int
+    path: str = ""
+    digest: str = ""
+    detail: AnalysisDetail | None = None
+    # Why the vacancy was skipped
+    error: str = ""
+
+
+@batch_router.message(Command("batch"))
+async def batch(message: Message, state: FSMContext, settings: Settings):
+    user = await UsersDAL.get_user(message.from_user.id)
+
+    await MessagesDAL.insert(
+        MessageModel(
+            type=MessageType.COMMAND,
+            message_id=message.message_id,
+            text=message.text,
+            chat_id=message.chat.id,
+            user_id=message.from_user.id if message.from_user else "",
+        )
+    )
+
+    if not await can_analyse(message, user):
+        return
+
+    await state.clear()
+    await state.set_state(BatchAnalysisScene.resume_waiting)
+    await message.answer(
+        "Сравним резюме сразу с несколькими вакансиями.\n\n"
+        "Пожалуйста, отправьте файл своего резюме в PDF или DOCX формате."
+    )
+
+
+@batch_router.message(BatchAnalysisScene.resume_waiting, F.document,
+                      flags={ADMISSION: (Operation.UPLOAD, Operation.VALIDITY)})
+async def handle_batch_resume(message: Message, state: FSMContext, bot: Bot, settings: Settings) -> None:
+    deliver_later(message.answer("Читаем файл..."))
+
+    try:
+        resume = await get_document_from_message(bot, message, settings.data_dir)
+    except UnreadableDocument as e:
+        await reject_unreadable(message, e)
+        return
+    except:
+        ANALYSIS_OUTCOMES.labels("unreadable_file").inc()
+        await message.answer(
+            "Не удалось извлечь текст из файла. Пожалуйста, убедитесь, что это PDF или DOCX с текстом. Или обратитесь в поддержку."
+        )
+        raise
+    await MessagesDAL.insert(
+        MessageModel(
+            type=MessageType.DOCUMENT,
+            message_id=message.message_id,
+            text="OK",
+            chat_id=message.chat.id,
+            user_id=message.from_user.id if message.from_user else None,
+            file_name=message.document.file_name,
+        )
+    )
+    await RollupsDAL.track_upload("resume")
+
+    if not await check_resume(message, resume, settings):
+        return
+
+    await state.update_data(resume_info=DocumentInfo.of(resume).model_dump())
+    await state.set_state(BatchAnalysisScene.vacancies_waiting)
+    await message.answer(
+        "Резюме получено.\n\n"
+        f"Теперь отправьте вакансии: каждую отдельным сообщением, текстом или файлом PDF/DOCX, до {settings.batch.max_vacancies} штук. "
+        "Когда закончите, нажмите «Готово».",
+        reply_markup=_done_keyboard(),
+    )
+
+
+# Commands still work inside the scene
+@batch_router.message(BatchAnalysisScene.vacancies_waiting, F.document | (F.text & ~F.text.startswith("/")),
+                      flags={ADMISSION: (Operation.UPLOAD,)})
+async def handle_batch_vacancy(message: Message, state: FSMContext, settings: Settings) -> None:
+    await MessagesDAL.insert(
+        MessageModel(
+            type=MessageType.DOCUMENT if message.document else MessageType.TEXT,
+            message_id=message.message_id,
+            text=message.text or "",
+            chat_id=message.chat.id,
+            user_id=message.from_user.id if message.from_user else None,
+            file_name=message.document.file_name if message.document else None,
+        )
+    )
+
+    added = _pending_vacancies(await state.get_data())
+    if len(added) >= settings.batch.max_vacancies:
+        await message.answer(
+            f"Можно добавить не больше {settings.batch.max_vacancies} вакансий. Нажмите «Готово», чтобы начать анализ.",
+            reply_markup=_done_keyboard(),
+        )
+        return
+
+    if message.document:
+        vacancy = PendingVacancy(
+            message_id=message.message_id, file_id=message.document.file_id, file_name=message.document.file_name or "",
+        )
+        await RollupsDAL.track_upload("vacancy")
+    else:
+        # Text vacancies go to the extraction cache, the state holds only a digest
+        document = ResumeDocument.from_raw(message.text or "", digest=upload_digest((message.text or "").encode()))
+        await ExtractionsDAL.put(document.digest, document.text)
+        vacancy = PendingVacancy(message_id=message.message_id, digest=document.digest)
+
+    await state.update_data({f"{VACANCY_KEY_PREFIX}{message.message_id}": vacancy.model_dump()})
+    await message.answer(f"Вакансия {len(added) + 1} добавлена.", reply_markup=_done_keyboard())
+
+
+@batch_router.callback_query(BatchAnalysisScene.vacancies_waiting, F.data == DONE_CALLBACK_DATA,
+                             flags={ADMISSION: (Operation.ANALYSIS,)})
+async def handle_batch_done(callback: CallbackQuery, state: FSMContext, settings: Settings) -> None:
+    await MessagesDAL.insert(
+        MessageModel(
+            type=MessageType.CALLBACK,
+            message_id=callback.message.message_id if callback.message else -1,
+            text="",
+            chat_id=callback.message.chat.id if callback.message else -1,
+            user_id=callback.from_user.id,
+            callback_data=callback.data,
+        )
+    )
+
+    data = await state.get_data()
+    vacancies = _pending_vacancies(data)
+    if not vacancies:
+        await callback.message.answer("Добавьте хотя бы одну вакансию.")
+        return
+    if not data.get("resume_info"):
+        await callback.message.answer("Произошла ошибка. Пожалуйста, начните анализ заново командой /batch.")
+        await state.clear()
+        return
+
+    payload = BatchJobPayload(
+        user_id=callback.from_user.id,
+        chat_id=callback.message.chat.id,
+        resume=DocumentInfo.model_validate(data["resume_info"]),
+        vacancies=vacancies,
+    )
+    await state.clear()
+    await JobQueue.enqueue(BATCH_JOB, payload.model_dump(), settings.jobs.max_attempts)
+    await callback.message.answer(
+        f"Сравниваем резюме с вакансиями: {len(vacancies)}.\nЭто может занять несколько минут."
+    )
+
+
+def _done_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Готово", callback_data=DONE_CALLBACK_DATA)
+    ]])
+
+
+def _pending_vacancies(data: dict) -> list[PendingVacancy]:
+    vacancies = [PendingVacancy.model_validate(v) for k, v in data.items() if k.startswith(VACANCY_KEY_PREFIX)]
+    return sorted(vacancies, key=lambda v: v.message_id)
+
+
+async def _batch_failed(job: Job, ctx: JobContext) -> None:
+    payload = BatchJobPayload.model_validate(job.payload)
+    await ctx.bot.send_message(
+        payload.chat_id,
+        "Произошла ошибка при анализе вакансий. Пожалуйста, попробуйте позже или обратитесь в поддержку.",
+    )
+
+
+@job_handler(BATCH_JOB, on_failure=_batch_failed)
+async def run_batch_job(job: Job, ctx: JobContext) -> None:
+    payload = BatchJobPayload.model_validate(job.payload)
+    if job.attempts > 1:
+        await ctx.progress(job, payload.chat_id, "Анализ занимает больше времени, чем обычно. Продолжаем...")
+
+    stored = await AnalyticsDAL.find_by_job(str(job.id))
+    if stored is not None:
+        # An earlier attempt stored the comparisons already: no LLM call, no second report or credit
+        if not stored.delivered:
+            await deliver_batch(chat_message(ctx.bot, payload.chat_id), stored)
+        return
+
+    settings = ctx.settings
+    llm_service = LLMService.build(settings.llm_settings)
+    cv = await load_document(payload.resume)
+    semaphore = asyncio.Semaphore(settings.batch.concurrency)
+
+    async def compare(number: int, pending: PendingVacancy) -> VacancyResult:
+        async with semaphore:
+            return await _compare_vacancy(ctx.bot, llm_service, cv, number, pending, payload.user_id, settings)
+
+    started = time.monotonic()
+    with ANALYSES_IN_FLIGHT.track_inprogress():
+        # The resume is analysed once, next to the comparisons
+        with ANALYSIS_STAGE_SECONDS.labels("static").time():
+            heuristic = analyze_resume_text(cv)
+        with ANALYSIS_STAGE_SECONDS.labels("batch_llm").time():
+            try:
+                report, *results = await asyncio.gather(
+                    llm_service.full_feedback(cv, None),
+                    *(compare(number, pending) for number, pending in enumerate(payload.vacancies, 1)),
+                )
+            except Exception:
+                ANALYSIS_OUTCOMES.labels("llm_error").inc()
+                raise
+
+    compared = [r for r in results if r.detail is not None]
+    message = chat_message(ctx.bot, payload.chat_id)
+    if not compared:
+        # Nothing to charge for: only the reasons are sent, the resume report stays for a batch that works
+        ANALYSIS_OUTCOMES.labels("batch_no_vacancies").inc()
+        lines = ["Не удалось сравнить резюме ни с одной вакансией:"]
+        lines.extend(f"— Вакансия {r.number}: {r.error}" for r in results)
+        lines.append("Кредит не списан. Попробуйте ещё раз командой /batch.")
+        await message.answer("\n".join(lines))
+        return
+
+    analysis = Analysis(
+        user_id=payload.user_id,
+        filepaths=[cv.path, *(r.path for r in compared)],
+        details=[report, heuristic, *(r.detail for r in compared)],
+        resume_digest=cv.digest,
+        vacancy_digests=[r.digest for r in compared],
+        vacancy_numbers=[r.number for r in compared],
+        skipped_vacancies=[SkippedVacancy(number=r.number, error=r.error) for r in results if r.detail is None],
+        job_id=str(job.id),
+    )
+    # Stored before anything is sent, so a retry of the job starts from here
+    analysis = await AnalyticsDAL.insert_for_job(analysis)
+    await ExtractionsDAL.retain(
+        [analysis.resume_digest, *analysis.vacancy_digests], analysis_expiry(settings.retention, analysis.created_at),
+    )
+    await RollupsDAL.track_analysis(time.monotonic() - started)
+    ANALYSIS_OUTCOMES.labels("batch_ok").inc()
+    await deliver_batch(message, analysis)
+
+
+async def deliver_batch(message: Message, analysis: Analysis) -> None:
+    """Sends the report of a stored batch analysis, then consumes the credit once per analysis."""
+    report = analysis.details[0]
+    results = [
+        VacancyResult(number=number, path=path, digest=digest, detail=detail)
+        for number, path, digest, detail in zip(
+            analysis.vacancy_numbers, analysis.filepaths[1:], analysis.vacancy_digests, analysis.details[2:],
+        )
+    ]
+    results.extend(VacancyResult(number=skipped.number, error=skipped.error) for skipped in analysis.skipped_vacancies)
+    results.sort(key=lambda r: r.number)
+    with ANALYSIS_STAGE_SECONDS.labels("send").time():
+        await send_sections(message, _batch_sections(report, results), parse_mode="MarkdownV2")
+
+    # A crash between sending and this mark resends the report once, never charges twice
+    if not await AnalyticsDAL.mark_delivered(analysis.job_id):
+        return
+    user = await UsersDAL.get_user(analysis.user_id)
+    await UsersDAL.consume_one_time_full(user.tg_user_id)
+
+
+async def _compare_vacancy(bot: Bot, llm_service: LLMService, cv: ResumeDocument, number: int,
+                           pending: PendingVacancy, user_id: int, settings: Settings) -> VacancyResult:
+    """Extracts, checks and compares one vacancy; a vacancy that fails is skipped, not the whole batch."""
+    result = VacancyResult(number=number)
+    try:
+        if pending.file_id:
+            vacancy = await fetch_document(bot, pending.file_id, pending.file_name, user_id, settings.data_dir)
+        else:
+            vacancy = await load_document(DocumentInfo(path="", digest=pending.digest))
+    except Exception:
+        logger.warning("Unable to read vacancy %s of user %s", number, user_id, exc_info=True)
+        result.error = "не удалось прочитать файл"
+        return result
+    result.path, result.digest = vacancy.path, vacancy.digest
+
+    try:
+        with ANALYSIS_STAGE_SECONDS.labels("validity_llm").time():
+            check = await llm_service.check_vacancy_is_valid(vacancy)
+        if not check.is_valid:
+            await RollupsDAL.track_validity_rejection("vacancy")
+            result.error = "не похоже на описание вакансии"
+            return result
+
+        result.detail = await llm_service.vacancy_match(cv, vacancy)
+    except Exception:
+        # A retry would repeat the resume report and every other comparison
+        logger.warning("Unable to compare vacancy %s of user %s", number, user_id, exc_info=True)
+        ANALYSIS_OUTCOMES.labels("llm_error").inc()
+        result.error = "не удалось сравнить, попробуйте позже"
+    return result
+
+
+def _vacancy_title(result: VacancyResult) -> str:
+    title = result.detail.sections.get("title") if result.detail else ""
+    return title or f"Вакансия {result.number}"
+
+
+def _batch_sections(report: AnalysisDetail, results: list[VacancyResult]) -> list[str]:
+    ranked = sorted((r for r in results if r.detail is not None), key=lambda r: r.detail.score, reverse=True)
+
+    summary = ["*🏆 Рейтинг вакансий*"]
+    for place, result in enumerate(ranked, 1):
+        summary.append(escape_md_v2(f"{place}. {_vacancy_title(result)} — {result.detail.score}/100"))
+    for result in results:
+        if result.error:
+            summary.append(escape_md_v2(f"— Вакансия {result.number}: {result.error}"))
+    sections = ["\n".join(summary)]
+
+    for result in ranked:
+        detail = result.detail
+        lines = [f"*🎯 {escape_md_v2(_vacancy_title(result))}: {detail.score}/100*"]
+        if detail.strengths:
+            lines.append("✅ " + escape_md_v2("; ".join(detail.strengths)))
+        if detail.problems:
+            lines.append("⚠️ " + escape_md_v2("; ".join(detail.problems)))
+        if detail.actions:
+            lines.append("🛠 " + escape_md_v2("; ".join(detail.actions)))
+        sections.append("\n".join(lines))
+
+    if report.ok:
+        sections.extend(report_sections(report))
+    return sections
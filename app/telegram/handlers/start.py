@@ -1,4 +1,4 @@
-import time
+from datetime import timedelta
 
 from aiogram import Router, F
 from aiogram.filters import CommandStart, StateFilter
@@ -8,6 +8,7 @@ from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, C
 from app import settings
 from app.dal import UsersDAL, MessagesDAL
 from app.models import MessageModel, MessageType, User
+from app.scheduler import scheduler
 from app.settings import Settings
 
 from aiogram.fsm.state import StatesGroup, State
@@ -61,7 +62,6 @@ async def start(message: Message, state: FSMContext, settings: Settings):
     await state.set_state(TermsScene.terms_accept_waiting)
 
     await message.answer(WELCOME_TEXT)
-    time.sleep(2)
 
     parts = [
         "Для начала — немного формальностей. Чтобы мы могли работать с твоим резюме, нужно твоё согласие на обработку персональных данных. Без этого никак.",
@@ -69,7 +69,13 @@ async def start(message: Message, state: FSMContext, settings: Settings):
         f"Пользовательское соглашение: {settings.user_agreement_url}",
         f"Обработка персональных данных: {settings.privacy_url}"
     ]
-    await message.answer("\n\n".join(parts), reply_markup=agreement_keyboard())
+    # Pause between the messages without holding the event loop
+    await scheduler().schedule(
+        message.chat.id,
+        "\n\n".join(parts),
+        delay=timedelta(seconds=2),
+        reply_markup=agreement_keyboard(),
+    )
 
 
 @start_router.callback_query(TermsScene.terms_accept_waiting, F.data == CALLBACK_DATA)
@@ -7,8 +7,9 @@ from aiogram.types import Message, LabeledPrice, PreCheckoutQuery, CallbackQuery
     InlineKeyboardMarkup
 from pydantic import BaseModel
 
-from app.dal import UsersDAL, MessagesDAL
+from app.dal import UsersDAL, MessagesDAL, RollupsDAL
 from app.models import MessageModel, MessageType
+from app.scheduler import scheduler
 from app.settings import Settings
 
 subscription_router = Router(name="subscription")
@@ -40,6 +41,8 @@ ONE_TIME_USAGE = Product(
 
 PRODUCTS = [SUB_1_WEEK, ONE_TIME_USAGE]
 
+SUBSCRIPTION_REMINDER = "subscription_reminder"
+
 
 @subscription_router.message(Command("subscription"))
 async def buy_subscription(message: Message, settings: Settings):
@@ -154,6 +157,12 @@ async def successful_payment(message: Message):
         await message.answer("Произошла ошибка при обработке вашего платежа. Пожалуйста, свяжитесь с поддержкой.")
         raise
 
+    await RollupsDAL.track_payment(
+        product.callback_data,
+        message.successful_payment.total_amount,
+        message.successful_payment.currency,
+    )
+
     user = await UsersDAL.get_user(message.from_user.id)
 
     if product.callback_data == SUB_1_WEEK.callback_data:
@@ -170,6 +179,15 @@ async def successful_payment(message: Message):
         # Persist subscription end date (implement this DAL method if missing)
         await UsersDAL.set_subscription_until(user.tg_user_id, new_until)
 
+        # Remind a day before the end, the previous reminder is for the old date
+        await scheduler().cancel(message.chat.id, SUBSCRIPTION_REMINDER)
+        await scheduler().schedule(
+            message.chat.id,
+            f"Подписка закончится {new_until:%d.%m.%Y}. Продлить её можно командой /subscription",
+            at=new_until - timedelta(days=1),
+            kind=SUBSCRIPTION_REMINDER,
+        )
+
         # Notify user
         total = message.successful_payment.total_amount / 100.0
         currency = message.successful_payment.currency
@@ -1,65 +1,132 @@
-from typing import Any, Awaitable, Callable, Dict
+from __future__ import annotations
+import asyncio, logging, time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
 
 from aiogram import BaseMiddleware, Bot
-from aiogram.types import Message, CallbackQuery, BotCommand, BotCommandScopeChat, Update
 from aiogram.fsm.context import FSMContext
+from aiogram.types import BotCommandScopeChat, Update
 
+from app.dal import CommandVisibilityDAL
+from app.settings import CommandsSyncSettings
 from app.telegram.commander import setup_commands
+from app.telegram.sharding import chat_id_of
+from app.utils.outbound import TokenBucket
+
+logger = logging.getLogger(__name__)
 
 
 class CommandsSyncMiddleware(BaseMiddleware):
     """
     Shows commands when user is not in any scene (FSM state is None),
     and clears commands when inside a scene.
-    Caches last applied state per chat to avoid extra API calls.
+
+    The update path only notes the chat; a background task reads the final state of every noted chat,
+    compares it with the cached visibility and calls setMyCommands at a bounded rate.
     """
-    def __init__(self) -> None:
-        self._chat_visibility: Dict[int, bool] = {}
+
+    def __init__(self, settings: CommandsSyncSettings) -> None:
+        self._settings = settings
+        # chat_id -> (visible, cached_at), least recently used first
+        self._chat_visibility: OrderedDict[int, Tuple[bool, float]] = OrderedDict()
+        # chat_id -> (bot, state) of its latest update; several updates of a chat collapse into one check
+        self._pending: OrderedDict[int, Tuple[Bot, FSMContext]] = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._bucket = TokenBucket(settings.rate, max(1, int(settings.rate)))
+        self._task: Optional[asyncio.Task] = None
 
     async def __call__(
         self,
         handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
-        event: Any,
+        event: Update,
         data: Dict[str, Any],
     ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            self._note(event, data)
+
+    def _note(self, event: Update, data: Dict[str, Any]) -> None:
+        bot: Bot | None = data.get("bot")
+        state: FSMContext | None = data.get("state")
+        chat_id = chat_id_of(event)
+        if bot is None or state is None or chat_id is None:
+            return
+
+        self._pending.pop(chat_id, None)
+        self._pending[chat_id] = (bot, state)
+        if len(self._pending) > self._settings.max_pending:
+            # The dropped chat is synced again on its next update
+            self._pending.popitem(last=False)
+        self._wakeup.set()
+
+    def _cached(self, chat_id: int) -> Optional[bool]:
+        entry = self._chat_visibility.get(chat_id)
+        if entry is None:
+            return None
+        visible, cached_at = entry
+        if time.monotonic() - cached_at > self._settings.cache_ttl_seconds:
+            del self._chat_visibility[chat_id]
+            return None
+        self._chat_visibility.move_to_end(chat_id)
+        return visible
+
+    def _remember(self, chat_id: int, visible: bool) -> None:
+        self._chat_visibility[chat_id] = (visible, time.monotonic())
+        self._chat_visibility.move_to_end(chat_id)
+        while len(self._chat_visibility) > self._settings.cache_size:
+            self._chat_visibility.popitem(last=False)
 
-        result = await handler(event, data)
-        print("HELLO", data.get("state"))
-        await self._hide_of_show_buttons(event, data)
-
-        return result
-
-    async def _hide_of_show_buttons(self, event: Any, data: dict[str, Any]) -> None:
-        bot: Bot = data.get("bot")  # provided by aiogram
-        state: FSMContext = data.get("state")  # provided by aiogram
-
-        chat_id = None
-        if isinstance(event, Message):
-            chat_id = event.chat.id
-        elif isinstance(event, Update):
-            if event.message:
-                chat_id = event.message.chat.id
-            elif event.callback_query and event.callback_query.message:
-                chat_id = event.callback_query.message.chat.id
-        elif isinstance(event, CallbackQuery) and event.message:
-            chat_id = event.message.chat.id
-
-        print(bot, state, chat_id)
-        if bot and state and chat_id is not None:
-            current_state = await state.get_state()
-            should_show = current_state is None
-            last = self._chat_visibility.get(chat_id)
-
-            print(f"Сейчас пользователь видит {last}, должен ли: {should_show} (состояние: {current_state})")
-            if last is None or last != should_show:
-                try:
-                    if should_show:
-                        await setup_commands(chat_id, bot)
-                    else:
-                        # Clear commands for this chat while inside a scene
-                        await bot.set_my_commands(commands=[], scope=BotCommandScopeChat(chat_id=chat_id))
-                except Exception:
-                    # Do not block the update on command sync errors
-                    pass
+    async def _flush(self) -> None:
+        batch, self._pending = self._pending, OrderedDict()
+
+        missing = [chat_id for chat_id in batch if self._cached(chat_id) is None]
+        if missing:
+            for chat_id, visible in (await CommandVisibilityDAL.get_many(missing)).items():
+                self._remember(chat_id, visible)
+
+        applied: Dict[int, bool] = {}
+        for chat_id, (bot, state) in batch.items():
+            should_show = await state.get_state() is None
+            if self._cached(chat_id) == should_show:
+                continue
+
+            await asyncio.sleep(self._bucket.reserve())
+            try:
+                if should_show:
+                    await setup_commands(chat_id, bot)
                 else:
-                    self._chat_visibility[chat_id] = should_show
+                    # Clear commands for this chat while inside a scene
+                    await bot.set_my_commands(commands=[], scope=BotCommandScopeChat(chat_id=chat_id))
+            except Exception:
+                logger.warning("Unable to sync commands of chat %s", chat_id, exc_info=True)
+                continue
+            self._remember(chat_id, should_show)
+            applied[chat_id] = should_show
+
+        await CommandVisibilityDAL.set_many(applied)
+
+    async def run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self._flush()
+            except Exception:
+                logger.exception("Commands sync failed")
+            # Updates arriving meanwhile are coalesced into the next batch
+            await asyncio.sleep(self._settings.flush_interval_seconds)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._pending:
+            # Whatever the last updates changed is applied before the bot goes away
+            try:
+                await self._flush()
+            except Exception:
+                logger.exception("Commands sync failed")
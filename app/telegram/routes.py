@@ -1,17 +1,31 @@
 from aiogram import Dispatcher, F, Bot
 
+from app.telegram.admission import AdmissionMiddleware
 from app.telegram.handlers.analysis import analysis_router
+from app.telegram.handlers.batch import batch_router
 from app.telegram.handlers.fallback import fallback_router
 from app.telegram.handlers.start import start_router
 from app.telegram.handlers.subscription import subscription_router
+from app.telegram.middleware import CommandsSyncMiddleware
 
 
 def setup_routes(dp: Dispatcher) -> None:
+    settings = dp["settings"]
+    if settings.commands_sync.enabled:
+        commands_sync = CommandsSyncMiddleware(settings.commands_sync)
+        dp.update.middleware(commands_sync)
+        dp.startup.register(commands_sync.start)
+        dp.shutdown.register(commands_sync.stop)
 
-    # dp.update.middleware(CommandsSyncMiddleware())
+    if settings.admission.enabled:
+        # Inner: the flags of the chosen handler are known, updates of other handlers pass untouched
+        admission = AdmissionMiddleware(settings.admission)
+        dp.message.middleware(admission)
+        dp.callback_query.middleware(admission)
 
     dp.include_router(start_router)
     dp.include_router(analysis_router)
+    dp.include_router(batch_router)
     dp.include_router(subscription_router)
 
     # Fallback must be the last router
@@ -0,0 +1,340 @@
+from __future__ import annotations
+import asyncio, logging, multiprocessing, queue, signal, time, zlib
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Set
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import Update
+
+from app.metrics import (
+    SHARD_DROPPED_UPDATES, SHARD_QUEUE_DEPTH, SHARD_SLOTS, SHARD_WORKER_RESTARTS, mark_process_dead,
+)
+from app.settings import ShardingSettings
+
+logger = logging.getLogger(__name__)
+
+# Chats are hashed onto virtual slots, slots are owned by workers.
+# Retiring a worker moves only its slots, other chats keep their worker.
+SLOTS = 1024
+SUPERVISE_INTERVAL = 1.0
+
+
+def chat_id_of(update: Update) -> Optional[int]:
+    if update.message:
+        return update.message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    if update.pre_checkout_query:
+        return update.pre_checkout_query.from_user.id
+    if update.edited_message:
+        return update.edited_message.chat.id
+    if update.my_chat_member:
+        return update.my_chat_member.chat.id
+    return None
+
+
+def slot_of(chat_id: int) -> int:
+    return zlib.crc32(str(chat_id).encode()) % SLOTS
+
+
+class ChatLanes:
+    """
+    Runs jobs concurrently across keys and strictly one by one, in submission order, within a key.
+    At most `max_keys` keys have jobs buffered, each at most `max_per_key`: a slow chat holds one key,
+    not the buffer of everyone else.
+    """
+
+    def __init__(self, concurrency: int, max_keys: int, max_per_key: int) -> None:
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._keys = asyncio.Semaphore(max_keys)
+        self._max_per_key = max_per_key
+        self._lanes: Dict[Hashable, Deque[Callable[[], Awaitable[Any]]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, key: Hashable, job: Callable[[], Awaitable[Any]]) -> bool:
+        """False when the lane of the key is full and the job was dropped."""
+        lane = self._lanes.get(key)
+        if lane is not None:
+            if len(lane) >= self._max_per_key:
+                return False
+            lane.append(job)
+            return True
+
+        await self._keys.acquire()
+        lane = self._lanes.get(key)
+        if lane is not None:
+            # Created while we waited for a free key
+            self._keys.release()
+            if len(lane) >= self._max_per_key:
+                return False
+            lane.append(job)
+            return True
+
+        self._lanes[key] = deque([job])
+        task = asyncio.create_task(self._run(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, key: Hashable) -> None:
+        lane = self._lanes[key]
+        try:
+            while lane:
+                async with self._semaphore:
+                    try:
+                        await lane[0]()
+                    except Exception:
+                        logger.exception("Job for %s failed", key)
+                lane.popleft()
+        finally:
+            del self._lanes[key]
+            self._keys.release()
+
+    def pending(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    async def join(self, timeout: float | None = None) -> None:
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+async def _worker_loop(index: int, updates: multiprocessing.Queue, finished, settings_data: Dict[str, Any]) -> None:
+    from app.bootstrap import add_cleanup_steps, build_bot, build_dispatcher, init_sentry
+    from app.db import init_db
+    from app.lifecycle import Shutdown
+    from app.scheduler import init_scheduler
+    from app.settings import Settings
+    from app.utils.loop_watchdog import start_watchdog
+    from app.utils.outbound import wait_deliveries
+
+    settings = Settings.model_validate(settings_data)
+    init_sentry(settings.sentry_dsn)
+    watchdog = start_watchdog(settings.watchdog)
+    # Indexes are created by the parent, workers only connect
+    await init_db(settings.mongo_dsn, settings.db_name)
+
+    bot = build_bot(settings)
+    dp = build_dispatcher(settings)
+    workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+    await dp.emit_startup(bot=bot, **workflow_data)
+    delivery_scheduler = init_scheduler(bot)
+
+    concurrency = settings.sharding.concurrency_per_worker
+    # Chats buffered at once are bounded, so the rest waits in the parent-visible queue
+    lanes = ChatLanes(concurrency, concurrency * 4, settings.sharding.max_queued_per_chat)
+    loop = asyncio.get_running_loop()
+    logger.info("Shard worker %d started", index)
+
+    def count_finished() -> None:
+        # Read by the parent when this process dies: what it took and did not finish is counted as lost
+        with finished.get_lock():
+            finished.value += 1
+
+    async def handle(update: Update) -> None:
+        try:
+            await dp.feed_update(bot, update)
+        finally:
+            count_finished()
+
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, updates.get)
+            if raw is None:
+                break
+
+            update = Update.model_validate_json(raw, context={"bot": bot})
+            key = chat_id_of(update)
+            if not await lanes.submit(
+                key if key is not None else ("update", update.update_id),
+                lambda update=update: handle(update),
+            ):
+                # A chat flooding faster than it is answered: its own backlog is cut, other chats keep going
+                count_finished()
+                SHARD_DROPPED_UPDATES.labels(str(index)).inc()
+                logger.warning("Chat %s has %d updates queued, update %s dropped",
+                               key, settings.sharding.max_queued_per_chat, update.update_id)
+
+    finally:
+        # The parent stops us with None after the last update, within its own deadline
+        shutdown = Shutdown(settings.shutdown_deadline_seconds)
+        shutdown.add("updates", lanes.join)
+        shutdown.add("deliveries", wait_deliveries)
+        shutdown.add("scheduler", delivery_scheduler.stop)
+        shutdown.add("dispatcher", lambda timeout: dp.emit_shutdown(bot=bot, **workflow_data))
+        if watchdog:
+            shutdown.add("watchdog", lambda timeout: watchdog.stop())
+        add_cleanup_steps(shutdown, bot, [])
+        await shutdown.run()
+
+
+def _worker_main(index: int, updates: multiprocessing.Queue, finished, settings_data: Dict[str, Any]) -> None:
+    logging.basicConfig(level=logging.INFO)
+    # Ctrl+C reaches the whole process group: the parent drains the workers instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        asyncio.run(_worker_loop(index, updates, finished, settings_data))
+    except KeyboardInterrupt:
+        pass
+
+
+class _Worker:
+    def __init__(self, index: int, ctx, settings_data: Dict[str, Any]) -> None:
+        self.index = index
+        self.queue: multiprocessing.Queue = ctx.Queue()
+        # Updates put into the queue, and updates the process finished or dropped
+        self.sent = 0
+        self.finished = ctx.Value("q", 0)
+        self.process = ctx.Process(
+            target=_worker_main, args=(index, self.queue, self.finished, settings_data),
+            name=f"shard-{index}", daemon=True,
+        )
+        self.process.start()
+        self.restarts: Deque[float] = deque()
+        self.retired = False
+
+    def put(self, raw: str) -> None:
+        self.sent += 1
+        self.queue.put_nowait(raw)
+
+    def depth(self) -> int:
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:
+            return -1
+
+    def drain(self) -> List[str]:
+        items: List[str] = []
+        while True:
+            try:
+                # Timeout instead of get_nowait: a killed reader may leave the queue lock taken
+                item = self.queue.get(timeout=0.1)
+            except (queue.Empty, OSError):
+                return items
+            if item is not None:
+                items.append(item)
+
+
+class ShardRouter:
+    """
+    Hashes chat_id onto worker processes, so one chat is always handled by one process, in order,
+    while different chats run in parallel on all cores.
+    """
+
+    def __init__(self, settings_data: Dict[str, Any], sharding: ShardingSettings) -> None:
+        self._settings_data = settings_data
+        self._sharding = sharding
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers: List[_Worker] = []
+        self._owners: List[int] = [slot % sharding.workers for slot in range(SLOTS)]
+        self._supervisor: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._workers = [_Worker(i, self._ctx, self._settings_data) for i in range(self._sharding.workers)]
+        self._supervisor = asyncio.create_task(self._supervise())
+        self._report()
+
+    def submit(self, update: Update) -> None:
+        chat_id = chat_id_of(update)
+        slot = slot_of(chat_id) if chat_id is not None else update.update_id % SLOTS
+        raw = update.model_dump_json(exclude_none=True, by_alias=True)
+        self._workers[self._owners[slot]].put(raw)
+
+    async def _supervise(self) -> None:
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            try:
+                for worker in self._workers:
+                    if not worker.retired and not worker.process.is_alive():
+                        self._handle_death(worker)
+                self._report()
+            except Exception:
+                logger.exception("Shard supervisor failed")
+
+    def _handle_death(self, worker: _Worker) -> None:
+        """
+        Updates still in the dead worker's queue go to the new owner. The ones it had taken already,
+        running or buffered in its ChatLanes, are lost with the process: they are counted as dropped.
+        """
+        logger.error("Shard worker %d died with exit code %s", worker.index, worker.process.exitcode)
+        SHARD_WORKER_RESTARTS.labels(str(worker.index)).inc()
+        mark_process_dead(worker.process.pid)
+        # Updates the dead worker never picked up go to the new owner first, keeping per-chat order
+        pending = worker.drain()
+        lost = worker.sent - worker.finished.value - len(pending)
+        if lost > 0:
+            SHARD_DROPPED_UPDATES.labels(str(worker.index)).inc(lost)
+            logger.error("Shard worker %d took %d updates with it", worker.index, lost)
+
+        now = time.monotonic()
+        while worker.restarts and worker.restarts[0] < now - self._sharding.restart_window_seconds:
+            worker.restarts.popleft()
+
+        alive = [w for w in self._workers if not w.retired and w is not worker]
+        if len(worker.restarts) >= self._sharding.max_restarts and alive:
+            worker.retired = True
+            self._rebalance(worker, alive)
+            for raw in pending:
+                self.submit(Update.model_validate_json(raw))
+            return
+
+        replacement = _Worker(worker.index, self._ctx, self._settings_data)
+        replacement.restarts = worker.restarts
+        replacement.restarts.append(now)
+        self._workers[worker.index] = replacement
+        for raw in pending:
+            replacement.put(raw)
+
+    def _rebalance(self, retired: _Worker, alive: List[_Worker]) -> None:
+        load = {w.index: self._owners.count(w.index) for w in alive}
+        for slot, owner in enumerate(self._owners):
+            if owner == retired.index:
+                target = min(load, key=load.get)
+                self._owners[slot] = target
+                load[target] += 1
+        logger.warning("Shard worker %d retired, its slots moved to %s", retired.index, sorted(load))
+
+    def _report(self) -> None:
+        for worker in self._workers:
+            SHARD_QUEUE_DEPTH.labels(str(worker.index)).set(0 if worker.retired else worker.depth())
+            SHARD_SLOTS.labels(str(worker.index)).set(self._owners.count(worker.index))
+
+    async def stop(self, timeout: float = 30) -> None:
+        if self._supervisor:
+            self._supervisor.cancel()
+        for worker in self._workers:
+            if not worker.retired:
+                worker.queue.put_nowait(None)
+
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            await asyncio.to_thread(worker.process.join, max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+            mark_process_dead(worker.process.pid)
+
+
+class ShardingMiddleware(BaseMiddleware):
+    """Outer update middleware of the receiving process: hands the update to its shard instead of handling it."""
+
+    def __init__(self, router: ShardRouter) -> None:
+        self._router = router
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        self._router.submit(event)
+        return None
+
+
+def attach_sharding(dp: Dispatcher, settings) -> Optional[ShardRouter]:
+    if settings.sharding.workers <= 0:
+        return None
+    router = ShardRouter(settings.model_dump(mode="json"), settings.sharding)
+    router.start()
+    dp.update.outer_middleware(ShardingMiddleware(router))
+    return router
@@ -1,59 +1,113 @@
+from typing import Iterable
+
 from aiogram.types import Message
 
-TELEGRAM_LIMIT = 4096  # hard limit per message
+TELEGRAM_LIMIT = 4096  # hard limit per message, in UTF-16 code units
+
+# Preferred cut points, best first; a hard cut is the last resort
+_SEPARATORS = ("\n\n", "\n", " ")
+
+
+def utf16_len(text: str) -> int:
+    # Telegram measures text in UTF-16 code units: emoji and other astral chars take two
+    return len(text) + sum(1 for ch in text if ord(ch) > 0xFFFF)
+
+
+def _fit(text: str, start: int, limit: int) -> int:
+    """End index of the longest text[start:end] that fits into `limit` UTF-16 units."""
+    units = 0
+    end = start
+    while end < len(text):
+        units += 2 if ord(text[end]) > 0xFFFF else 1
+        if units > limit:
+            break
+        end += 1
+    return end
+
+
+def _escaped_at(text: str, index: int) -> bool:
+    """Whether text[index] is escaped by an odd run of backslashes before it (MarkdownV2)."""
+    backslashes = 0
+    while index - backslashes - 1 >= 0 and text[index - backslashes - 1] == "\\":
+        backslashes += 1
+    return backslashes % 2 == 1
+
+
+def _cut(text: str, start: int, end: int) -> int:
+    for sep in _SEPARATORS:
+        pos = text.rfind(sep, start, end)
+        if pos > start and not _escaped_at(text, pos):
+            return pos
+
+    # Never leave an escaping backslash at the end of a chunk, nor an escaped space the strip would take from it
+    while end - 1 > start and (_escaped_at(text, end) or (text[end - 1] in "\n " and _escaped_at(text, end - 1))):
+        end -= 1
+    return end
 
-def _split_text(text: str, limit: int = TELEGRAM_LIMIT) -> list[str]:
-    if len(text) <= limit:
-        return [text]
 
+def split_text(text: str, limit: int = TELEGRAM_LIMIT) -> list[str]:
+    """Splits text into chunks of at most `limit` UTF-16 units, in one pass over the text."""
     parts: list[str] = []
-    buf = ""
+    start = 0
+    while start < len(text):
+        end = max(_fit(text, start, limit), start + 1)
+        if end < len(text):
+            end = _cut(text, start, end)
+
+        chunk = text[start:end].strip()
+        if chunk:
+            parts.append(chunk)
+
+        start = end
+        while start < len(text) and text[start] in "\n ":
+            start += 1
+    return parts
+
+
+def pack_sections(sections: Iterable[str], limit: int = TELEGRAM_LIMIT, sep: str = "\n\n") -> list[str]:
+    """
+    Lays sections out into as few messages as possible, keeping their order.
+    A section is only split when it does not fit into a message on its own.
+    """
+    messages: list[str] = []
+    buf: list[str] = []
+    buf_len = 0
+    sep_len = utf16_len(sep)
+
+    for section in sections:
+        size = utf16_len(section)
+        if buf and buf_len + sep_len + size <= limit:
+            buf.append(section)
+            buf_len += sep_len + size
+            continue
 
-    def flush():
-        nonlocal buf
         if buf:
-            parts.append(buf)
-            buf = ""
+            messages.append(sep.join(buf))
 
-    # Try to split by double newlines, then by single newlines, then hard cut
-    for paragraph in text.split("\n\n"):
-        paragraph = paragraph.strip()
-        if not paragraph:
+        if size <= limit:
+            buf, buf_len = [section], size
             continue
 
-        candidate = (buf + ("\n\n" if buf else "") + paragraph)
-        if len(candidate) <= limit:
-            buf = candidate
+        chunks = split_text(section, limit)
+        if not chunks:
+            # Only whitespace: nothing to send
+            buf, buf_len = [], 0
             continue
+        *full, tail = chunks
+        messages.extend(full)
+        # The tail shares its message with the following sections
+        buf, buf_len = [tail], utf16_len(tail)
 
-        # flush current and split paragraph further by lines
-        flush()
-        line_buf = ""
-        for line in paragraph.split("\n"):
-            line = line.rstrip()
-            cand_line = (line_buf + ("\n" if line_buf else "") + line)
-            if len(cand_line) <= limit:
-                line_buf = cand_line
-                continue
-
-            if line_buf:
-                parts.append(line_buf)
-                line_buf = ""
-
-            # Hard cut very long single lines
-            start = 0
-            while start < len(line):
-                end = min(start + limit, len(line))
-                parts.append(line[start:end])
-                start = end
-
-        if line_buf:
-            parts.append(line_buf)
-
-    flush()
-    return parts
+    if buf:
+        messages.append(sep.join(buf))
+    return messages
 
 
 async def send_long_message(message: Message, text: str, parse_mode: str = "HTML") -> None:
-    for chunk in _split_text(text, 3500):
+    for chunk in split_text(text):
+        await message.answer(chunk, parse_mode=parse_mode)
+
+
+async def send_sections(message: Message, sections: Iterable[str], parse_mode: str = "HTML") -> None:
+    for chunk in pack_sections(sections):
         await message.answer(chunk, parse_mode=parse_mode)
@@ -0,0 +1,141 @@
+"""
+Event loop lag watchdog.
+
+A probe task sleeps for a fixed interval and records how late it wakes up (bot_loop_lag_seconds).
+A monitor thread watches the probe: when the loop has not come back for longer than the threshold,
+the loop thread is stuck in synchronous code, and the thread logs its stack while it is still there.
+
+With debug attribution, every handler runs under a "router:handler" label, so a stall names the
+handler that caused it even when the stack ends deep inside a library.
+"""
+from __future__ import annotations
+import asyncio, logging, sys, threading, time, traceback
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import sentry_sdk
+from aiogram import BaseMiddleware, Dispatcher
+
+from app.metrics import LOOP_LAG, LOOP_STALLS
+from app.settings import WatchdogSettings
+
+logger = logging.getLogger(__name__)
+
+# Task -> label of the handler it runs. Written by the loop, read by the monitor thread.
+_attribution: Dict[asyncio.Task, str] = {}
+
+
+class LoopWatchdog:
+    def __init__(self, settings: WatchdogSettings) -> None:
+        self._settings = settings
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id = 0
+        self._heartbeat = time.monotonic()
+        self._probe: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    async def _run_probe(self) -> None:
+        interval = self._settings.interval_seconds
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            self._heartbeat = time.monotonic()
+            LOOP_LAG.observe(max(0.0, self._heartbeat - started - interval))
+
+    def _current_label(self) -> tuple[str, str]:
+        """The bounded label of the metric and the detailed one of the log."""
+        # Reading the running task of another thread's loop: a snapshot is good enough for a report.
+        # A CPython internal: without it the report still goes out, only unlabelled
+        current_tasks = getattr(asyncio.tasks, "_current_tasks", None)
+        task = current_tasks.get(self._loop) if isinstance(current_tasks, dict) else None
+        if task is None:
+            return "unknown", "unknown"
+        handler = _attribution.get(task)
+        if handler is not None:
+            return handler, handler
+        # Task names are unbounded (Task-1234, per-chat lanes...): they stay out of the metric
+        return "unattributed", task.get_name()
+
+    def _report(self, stalled_for: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "<no frame>"
+        metric_label, label = self._current_label()
+        LOOP_STALLS.labels(metric_label).inc()
+        logger.warning("Event loop blocked for %.2fs in %s\n%s", stalled_for, label, stack)
+
+        if self._settings.sentry and sentry_sdk.get_client().is_active():
+            with sentry_sdk.new_scope() as scope:
+                scope.set_tag("loop.blocked_in", label)
+                scope.set_extra("stack", stack)
+                scope.set_extra("stalled_seconds", round(stalled_for, 3))
+                sentry_sdk.capture_message(f"Event loop blocked in {label}", level="warning")
+
+    def _run_monitor(self) -> None:
+        reported_heartbeat = None
+        while not self._stop.wait(self._settings.interval_seconds / 2):
+            heartbeat = self._heartbeat
+            stalled_for = time.monotonic() - heartbeat - self._settings.interval_seconds
+            # One report per stall: the next one waits for the loop to come back first
+            if stalled_for >= self._settings.threshold_seconds and heartbeat != reported_heartbeat:
+                reported_heartbeat = heartbeat
+                try:
+                    self._report(stalled_for)
+                except Exception:
+                    logger.exception("Unable to report a loop stall")
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._probe = asyncio.create_task(self._run_probe(), name="loop-watchdog")
+        self._monitor = threading.Thread(target=self._run_monitor, name="loop-watchdog", daemon=True)
+        self._monitor.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._probe:
+            self._probe.cancel()
+            await asyncio.gather(self._probe, return_exceptions=True)
+
+
+class HandlerAttributionMiddleware(BaseMiddleware):
+    """Labels the running task with the router and handler, for stall reports."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        task = asyncio.current_task()
+        handler_object = data.get("handler")
+        router = data.get("event_router")
+        if task is None or handler_object is None:
+            return await handler(event, data)
+
+        callback = handler_object.callback
+        previous = _attribution.get(task)
+        _attribution[task] = f"{router.name if router else '?'}:{getattr(callback, '__name__', repr(callback))}"
+        try:
+            return await handler(event, data)
+        finally:
+            if previous is None:
+                _attribution.pop(task, None)
+            else:
+                _attribution[task] = previous
+
+
+def setup_handler_attribution(dp: Dispatcher) -> None:
+    # Inner middlewares of the dispatcher wrap the handlers of all included routers
+    middleware = HandlerAttributionMiddleware()
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(middleware)
+
+
+def start_watchdog(settings: WatchdogSettings) -> Optional[LoopWatchdog]:
+    if not settings.enabled:
+        return None
+    watchdog = LoopWatchdog(settings)
+    watchdog.start()
+    return watchdog
@@ -0,0 +1,203 @@
+"""
+Central pacing of outgoing Bot API calls.
+
+OutboundDispatcher is a request middleware of the bot session, so every call with a chat_id
+(message.answer, bot.send_message, answer_invoice, ...) goes through a per-chat and a global token bucket
+and is retried on RetryAfter. Interactive replies pass the global bucket ahead of bulk sends:
+
+    with bulk():
+        await bot.send_message(chat_id, text)
+
+Handlers either await the call as usual, or hand it over with deliver_later() and move on.
+"""
+from __future__ import annotations
+import asyncio, heapq, itertools, logging, time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import TYPE_CHECKING, Any, Awaitable, Iterator, List, Optional, Set, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from app.metrics import OUTBOUND_REQUESTS, OUTBOUND_RETRY_AFTER, OUTBOUND_WAIT
+from app.settings import OutboundSettings
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BULK = 10
+
+
+_priority: ContextVar[Priority] = ContextVar("outbound_priority", default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def bulk() -> Iterator[None]:
+    token = _priority.set(Priority.BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Takes a token, going into debt if needed. Returns the delay before the token may be used."""
+        self._refill()
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def pause(self, seconds: float) -> None:
+        self._refill()
+        self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+    def idle(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+
+class PriorityLimiter:
+    """Global token bucket whose waiters are served by priority, then in arrival order."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self._bucket = TokenBucket(rate, burst)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+
+    async def acquire(self, priority: Priority) -> None:
+        if not self._waiters and self._bucket.try_take():
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run())
+        await future
+
+    async def _run(self) -> None:
+        while self._waiters:
+            await asyncio.sleep(self._bucket.delay())
+            while self._waiters and self._waiters[0][2].done():
+                # Cancelled by the caller
+                heapq.heappop(self._waiters)
+            if self._waiters and self._bucket.try_take():
+                heapq.heappop(self._waiters)[2].set_result(None)
+
+    def pause(self, seconds: float) -> None:
+        self._bucket.pause(seconds)
+
+
+class OutboundDispatcher(BaseRequestMiddleware):
+    def __init__(self, settings: OutboundSettings) -> None:
+        self._settings = settings
+        self._global = PriorityLimiter(settings.global_rate, settings.global_burst)
+        self._chats: OrderedDict[Any, TokenBucket] = OrderedDict()
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+            return bucket
+
+        if isinstance(chat_id, int) and chat_id > 0:
+            bucket = TokenBucket(self._settings.private_chat_rate, self._settings.private_chat_burst)
+        else:
+            bucket = TokenBucket(self._settings.group_chat_rate, self._settings.group_chat_burst)
+        self._chats[chat_id] = bucket
+
+        if len(self._chats) > self._settings.max_tracked_chats:
+            # Evicting an idle bucket loses nothing, it would start full anyway
+            oldest, oldest_bucket = next(iter(self._chats.items()))
+            if oldest_bucket.idle():
+                del self._chats[oldest]
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: "Bot",
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        bucket = self._chat_bucket(chat_id)
+        for attempt in range(self._settings.max_retries + 1):
+            started = time.monotonic()
+            await asyncio.sleep(bucket.reserve())
+            await self._global.acquire(priority)
+            OUTBOUND_WAIT.labels(priority.name.lower()).observe(time.monotonic() - started)
+
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                OUTBOUND_RETRY_AFTER.inc()
+                if attempt == self._settings.max_retries:
+                    OUTBOUND_REQUESTS.labels(priority.name.lower(), "retry_after").inc()
+                    raise
+                logger.warning("RetryAfter %ss for chat %s", e.retry_after, chat_id)
+                # Flood control may be bot-wide: the other chats wait too instead of piling more RetryAfter
+                bucket.pause(e.retry_after)
+                self._global.pause(e.retry_after)
+                continue
+
+            OUTBOUND_REQUESTS.labels(priority.name.lower(), "ok").inc()
+            return response
+
+
+_deliveries: Set[asyncio.Task] = set()
+
+
+def _log_failure(task: asyncio.Task) -> None:
+    _deliveries.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Background delivery failed", exc_info=task.exception())
+
+
+def deliver_later(call: Awaitable[Any]) -> asyncio.Task:
+    """Fire and forget: the call is paced like any other, failures are logged."""
+    task = asyncio.ensure_future(call)
+    _deliveries.add(task)
+    task.add_done_callback(_log_failure)
+    return task
+
+
+async def wait_deliveries(timeout: float | None = None) -> int:
+    """Waits for fire-and-forget deliveries, returns how many are still pending."""
+    if _deliveries:
+        await asyncio.wait(set(_deliveries), timeout=timeout)
+    return len(_deliveries)
@@ -0,0 +1,144 @@
+"""
+Two-phase PDF text extraction.
+
+The probe parses only the page tree and lays out the first page, which is enough to reject encrypted
+and scanned (image-only) files right away. The remaining pages are laid out in worker processes, one
+task per page, and joined in page order.
+"""
+from __future__ import annotations
+import asyncio, logging, multiprocessing, os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Anything longer is not a resume, and must not occupy the pool
+MAX_PAGES = 30
+PDF_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class UnreadableDocument(Exception):
+    ENCRYPTED = "encrypted"
+    IMAGE_ONLY = "image_only"
+    EMPTY = "empty"
+    # Not a PDF, DOCX or TXT
+    UNSUPPORTED = "unsupported"
+    # The parser gave up on the file: corrupt or not what its extension says
+    BROKEN = "broken"
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+@dataclass
+class PdfProbe:
+    pages: int
+    first_page_text: str
+
+
+def _laparams():
+    from pdfminer.layout import LAParams
+
+    # Resumes are horizontal text: vertical detection only costs time.
+    # boxes_flow stays at its default so two-column layouts are read column by column.
+    return LAParams(detect_vertical=False, all_texts=False, line_margin=0.5, char_margin=2.0)
+
+
+def extract_pages(path: str, page_numbers: List[int]) -> str:
+    from pdfminer.high_level import extract_text
+
+    try:
+        return extract_text(path, page_numbers=page_numbers, laparams=_laparams()) or ""
+    except Exception:
+        logger.warning("Unable to extract pages %s of %s", page_numbers, path, exc_info=True)
+        return ""
+
+
+def _has_fonts(resources: Any, depth: int = 0) -> bool:
+    from pdfminer.pdftypes import resolve1
+
+    resources = resolve1(resources)
+    if not isinstance(resources, dict):
+        return False
+    if resolve1(resources.get("Font")):
+        return True
+    if depth >= 2:
+        return False
+    # Text may live in form XObjects with their own resources
+    for xobject in (resolve1(resources.get("XObject")) or {}).values():
+        xobject = resolve1(xobject)
+        attrs = getattr(xobject, "attrs", {})
+        is_form = getattr(resolve1(attrs.get("Subtype")), "name", None) == "Form"
+        if is_form and _has_fonts(attrs.get("Resources"), depth + 1):
+            return True
+    return False
+
+
+def probe_pdf(path: str) -> PdfProbe:
+    from pdfminer.pdfdocument import PDFDocument, PDFEncryptionError, PDFPasswordIncorrect
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfparser import PDFParser
+
+    with open(path, "rb") as f:
+        try:
+            # An empty user password is tried automatically, only really protected files fail here
+            document = PDFDocument(PDFParser(f))
+        except (PDFPasswordIncorrect, PDFEncryptionError):
+            raise UnreadableDocument(UnreadableDocument.ENCRYPTED)
+        # The page tree only: contents are not parsed
+        pages = list(PDFPage.create_pages(document))
+        has_fonts = any(_has_fonts(page.resources) for page in pages[:MAX_PAGES])
+
+    if not pages:
+        raise UnreadableDocument(UnreadableDocument.EMPTY)
+    if not has_fonts:
+        # No page can draw a single glyph: a scan
+        raise UnreadableDocument(UnreadableDocument.IMAGE_ONLY)
+    return PdfProbe(pages=len(pages), first_page_text=extract_pages(path, [0]))
+
+
+def _join(probe: PdfProbe, rest: List[str]) -> str:
+    text = "".join([probe.first_page_text, *rest])
+    if not text.strip():
+        raise UnreadableDocument(UnreadableDocument.IMAGE_ONLY)
+    return text
+
+
+def extract_pdf(path: str) -> str:
+    probe = probe_pdf(path)
+    pages = min(probe.pages, MAX_PAGES)
+    return _join(probe, [extract_pages(path, [page]) for page in range(1, pages)])
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process with the event loop, Mongo and watchdog threads is not safe
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def extract_pdf_async(path: str) -> str:
+    probe = await asyncio.to_thread(probe_pdf, path)
+    pages = min(probe.pages, MAX_PAGES)
+    if probe.pages > MAX_PAGES:
+        logger.info("%s has %d pages, only the first %d are read", path, probe.pages, MAX_PAGES)
+    if pages == 1:
+        return _join(probe, [])
+
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    rest = await asyncio.gather(*(loop.run_in_executor(pool, extract_pages, path, [page]) for page in range(1, pages)))
+    return _join(probe, list(rest))
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -1,26 +1,122 @@
-from pdfminer.high_level import extract_text as pdf_extract_text
-from docx import Document
+import asyncio
+import logging
 import os
+import zipfile
+from typing import Iterator, List
+from xml.etree import ElementTree
+
+from app.utils.pdf_text import UnreadableDocument, extract_pdf, extract_pdf_async
+
+logger = logging.getLogger(__name__)
+
+# pdfminer and python-docx are imported on first use: they take a good share of the bot's startup time
 
 def extract_text_from_pdf(path: str) -> str:
+    """Raises UnreadableDocument for encrypted, scanned and broken files."""
     try:
-        return pdf_extract_text(path) or ""
+        return extract_pdf(path)
+    except UnreadableDocument:
+        raise
     except Exception:
-        return ""
+        logger.warning("Unable to extract text of %s", path, exc_info=True)
+        raise UnreadableDocument(UnreadableDocument.BROKEN)
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Text boxes come twice: as DrawingML in mc:Choice and as VML in mc:Fallback
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
+
+def _stream_docx_lines(path: str) -> Iterator[str]:
+    """
+    Paragraphs and table rows of word/document.xml in document order, without building a DOM:
+    elements are dropped as soon as their text is taken, so memory does not grow with the document.
+    A table row is one line of its cells separated by spaces, like python-docx's cell.text.
+    """
+    paragraphs: List[List[str]] = []  # text runs of the open paragraphs, text boxes nest them
+    cells: List[List[str]] = []  # paragraphs of the open table cells
+    rows: List[List[str]] = []  # cells of the open table rows
+    skip = 0
+    body = None
+
+    with zipfile.ZipFile(path) as archive, archive.open("word/document.xml") as xml:
+        for event, elem in ElementTree.iterparse(xml, events=("start", "end")):
+            tag = elem.tag
+            if tag == _MC_FALLBACK:
+                skip += 1 if event == "start" else -1
+                continue
+            if skip:
+                if event == "end":
+                    elem.clear()
+                continue
+
+            if event == "start":
+                if tag == _W + "p":
+                    paragraphs.append([])
+                elif tag == _W + "tc":
+                    cells.append([])
+                elif tag == _W + "tr":
+                    rows.append([])
+                elif tag == _W + "body":
+                    body = elem
+                continue
+
+            if tag == _W + "t" and paragraphs:
+                paragraphs[-1].append(elem.text or "")
+            elif tag == _W + "tab" and paragraphs:
+                paragraphs[-1].append("\t")
+            elif tag in (_W + "br", _W + "cr") and paragraphs:
+                paragraphs[-1].append("\n")
+            elif tag == _W + "p":
+                text = "".join(paragraphs.pop())
+                if cells:
+                    cells[-1].append(text)
+                else:
+                    yield text
+            elif tag == _W + "tc":
+                text = "\n".join(cells.pop())
+                if rows:
+                    rows[-1].append(text)
+            elif tag == _W + "tr":
+                text = " ".join(rows.pop())
+                # A nested table is part of the text of its cell
+                if cells:
+                    cells[-1].append(text)
+                else:
+                    yield text
+
+            if tag in (_W + "p", _W + "tbl", _W + "sdt") and body is not None and not paragraphs and not cells:
+                # A top level block is done: drop it from the tree
+                body.clear()
+            elif tag != _W + "body":
+                elem.clear()
+
+
+def _extract_docx_with_python_docx(path: str) -> str:
+    from docx import Document
+
+    doc = Document(path)
+    parts = []
+    for p in doc.paragraphs:
+        parts.append(p.text)
+    # Таблицы
+    for table in doc.tables:
+        for row in table.rows:
+            parts.append(" ".join(cell.text for cell in row.cells))
+    return "\n".join(parts)
+
 
 def extract_text_from_docx(path: str) -> str:
     try:
-        doc = Document(path)
-        parts = []
-        for p in doc.paragraphs:
-            parts.append(p.text)
-        # Таблицы
-        for table in doc.tables:
-            for row in table.rows:
-                parts.append(" ".join(cell.text for cell in row.cells))
-        return "\n".join(parts)
+        return "\n".join(_stream_docx_lines(path))
     except Exception:
-        return ""
+        logger.warning("Streaming DOCX extraction failed for %s, falling back to python-docx", path, exc_info=True)
+
+    try:
+        return _extract_docx_with_python_docx(path)
+    except Exception:
+        logger.warning("Unable to extract text of %s", path, exc_info=True)
+        raise UnreadableDocument(UnreadableDocument.BROKEN)
 
 def extract_text_auto(path: str) -> str:
     ext = os.path.splitext(path)[1].lower()
@@ -31,4 +127,17 @@ def extract_text_auto(path: str) -> str:
     if ext in (".txt", ):
         with open(path, "r", encoding="utf-8", errors="ignore") as f:
             return f.read()
-    return ""
+    raise UnreadableDocument(UnreadableDocument.UNSUPPORTED)
+
+
+async def extract_text_auto_async(path: str) -> str:
+    """extract_text_auto off the event loop; PDF pages are laid out in parallel worker processes."""
+    if os.path.splitext(path)[1].lower() == ".pdf":
+        try:
+            return await extract_pdf_async(path)
+        except UnreadableDocument:
+            raise
+        except Exception:
+            logger.warning("Unable to extract text of %s", path, exc_info=True)
+            raise UnreadableDocument(UnreadableDocument.BROKEN)
+    return await asyncio.to_thread(extract_text_auto, path)
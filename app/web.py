@@ -0,0 +1,146 @@
+from __future__ import annotations
+import time
+
+# Before any other import: the ready time in the log includes them
+_STARTED = time.monotonic()
+
+import asyncio, hmac, logging
+from contextlib import asynccontextmanager
+from typing import Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from dotenv import load_dotenv
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+
+from app.bootstrap import (
+    add_cleanup_steps, build_bot, build_dispatcher, init_sentry, init_storage, start_background_tasks,
+    start_job_workers,
+)
+from app.db import db
+from app.lifecycle import Shutdown
+from app.metrics import WEBHOOK_PENDING, WEBHOOK_UPDATES, render_metrics
+from app.scheduler import init_scheduler
+from app.settings import get_settings
+from app.telegram.sharding import attach_sharding
+from app.utils.loop_watchdog import start_watchdog
+from app.utils.outbound import wait_deliveries
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class BackgroundUpdates:
+    """Processes webhook updates after the HTTP response, at most `concurrency` at a time."""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, concurrency: int, max_pending: int) -> None:
+        self._dp = dp
+        self._bot = bot
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._max_pending = max_pending
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, update: Update) -> bool:
+        if len(self._tasks) >= self._max_pending:
+            return False
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        WEBHOOK_PENDING.inc()
+        task.add_done_callback(self._done)
+        return True
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        WEBHOOK_PENDING.dec()
+
+    async def _process(self, update: Update) -> None:
+        async with self._semaphore:
+            try:
+                await self._dp.feed_update(self._bot, update)
+            except Exception:
+                logger.exception("Update %s failed", update.update_id)
+
+    async def wait(self, timeout: float) -> None:
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+def create_app() -> FastAPI:
+    load_dotenv()
+    settings = get_settings()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        init_sentry(settings.sentry_dsn)
+        watchdog = start_watchdog(settings.watchdog)
+        await init_storage(settings)
+
+        bot = build_bot(settings)
+        dp = build_dispatcher(settings)
+        shard_router = attach_sharding(dp, settings)
+        workflow_data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+        await dp.emit_startup(bot=bot, **workflow_data)
+        background_tasks = start_background_tasks(settings)
+        delivery_scheduler = init_scheduler(bot)
+        job_workers = start_job_workers(bot, settings)
+
+        app.state.bot = bot
+        app.state.updates = BackgroundUpdates(
+            dp, bot, settings.webhook.max_concurrent_updates, settings.webhook.max_pending_updates,
+        )
+        logger.info("Ready to handle updates %.2fs after start", time.monotonic() - _STARTED)
+        try:
+            yield
+        finally:
+            # uvicorn has stopped accepting requests by now
+            shutdown = Shutdown(settings.shutdown_deadline_seconds)
+            shutdown.add("updates", app.state.updates.wait)
+            if shard_router:
+                shutdown.add("shards", shard_router.stop)
+            if job_workers:
+                shutdown.add("jobs", job_workers.stop)
+            shutdown.add("deliveries", wait_deliveries)
+            shutdown.add("scheduler", delivery_scheduler.stop)
+            shutdown.add("dispatcher", lambda timeout: dp.emit_shutdown(bot=bot, **workflow_data))
+            if watchdog:
+                shutdown.add("watchdog", lambda timeout: watchdog.stop())
+            add_cleanup_steps(shutdown, bot, background_tasks)
+            await shutdown.run()
+
+    app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+
+    @app.post(settings.webhook.path)
+    async def telegram_webhook(
+        request: Request,
+        x_telegram_bot_api_secret_token: str | None = Header(default=None),
+    ) -> Response:
+        # Bytes: compare_digest refuses str with non-ASCII characters, a forged header must get 401, not 500
+        if not hmac.compare_digest(
+            (x_telegram_bot_api_secret_token or "").encode(), (settings.webhook.secret_token or "").encode(),
+        ):
+            WEBHOOK_UPDATES.labels("forbidden").inc()
+            raise HTTPException(status_code=401)
+
+        update = Update.model_validate(await request.json(), context={"bot": request.app.state.bot})
+        if not request.app.state.updates.submit(update):
+            # Telegram redelivers the update later
+            WEBHOOK_UPDATES.labels("overloaded").inc()
+            return Response(status_code=503)
+
+        WEBHOOK_UPDATES.labels("accepted").inc()
+        return Response(status_code=200)
+
+    @app.get("/healthz")
+    async def healthz() -> Response:
+        try:
+            await asyncio.wait_for(db().command("ping"), timeout=2)
+        except Exception:
+            return Response("mongo unavailable", status_code=503)
+        return Response("ok")
+
+    @app.get("/metrics")
+    async def metrics() -> Response:
+        body, content_type = render_metrics()
+        return Response(body, media_type=content_type)
+
+    return app
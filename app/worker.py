@@ -0,0 +1,50 @@
+from __future__ import annotations
+import asyncio, logging
+from dotenv import load_dotenv
+
+from app.bootstrap import add_cleanup_steps, build_bot, build_dispatcher, init_sentry, init_storage
+from app.jobs import JobWorkerPool
+from app.lifecycle import Shutdown, stop_on_signals
+from app.scheduler import init_scheduler
+from app.settings import Settings, get_settings
+from app.utils.loop_watchdog import start_watchdog
+from app.utils.outbound import wait_deliveries
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def async_main(settings: Settings) -> None:
+    """Job workers without the bot front end: scale them with JOBS__CONCURRENCY and the number of processes."""
+    init_sentry(settings.sentry_dsn)
+    watchdog = start_watchdog(settings.watchdog)
+    await init_storage(settings)
+
+    bot = build_bot(settings)
+    # Registers the job handlers declared next to the routers
+    build_dispatcher(settings)
+    delivery_scheduler = init_scheduler(bot)
+
+    pool = JobWorkerPool(bot, settings)
+    pool.start()
+    stop = asyncio.Event()
+    stop_on_signals(stop)
+    try:
+        await stop.wait()
+    finally:
+        shutdown = Shutdown(settings.shutdown_deadline_seconds)
+        shutdown.add("jobs", pool.stop)
+        shutdown.add("deliveries", wait_deliveries)
+        shutdown.add("scheduler", delivery_scheduler.stop)
+        if watchdog:
+            shutdown.add("watchdog", lambda timeout: watchdog.stop())
+        add_cleanup_steps(shutdown, bot, [])
+        await shutdown.run()
+
+
+def main() -> None:
+    load_dotenv()
+    asyncio.run(async_main(get_settings()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+for module in ("aiogram", "motor", "prometheus_client", "pydantic_settings"):
+    pytest.importorskip(module)
+
+from app.telegram.admission import MemoryLimiter
+
+INTERVAL = 10.0
+# Burst of three: two more calls fit on top of the one charged now
+TOLERANCE = 2 * INTERVAL
+
+
+def take(limiter, now, key="u"):
+    return asyncio.run(limiter.take(key, INTERVAL, TOLERANCE, now))
+
+
+def test_burst_then_steady_rate():
+    limiter = MemoryLimiter()
+    assert [take(limiter, 100.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # The fourth call comes before the first interval has passed
+    assert take(limiter, 100.0) == pytest.approx(INTERVAL)
+    assert take(limiter, 105.0) == pytest.approx(5.0)
+    assert take(limiter, 110.0) == 0.0
+    assert take(limiter, 110.0) == pytest.approx(INTERVAL)
+
+
+def test_rejected_call_is_not_charged():
+    limiter = MemoryLimiter()
+    for _ in range(3):
+        take(limiter, 0.0)
+    # However often a throttled user retries, the wait does not grow
+    assert take(limiter, 1.0) == pytest.approx(9.0)
+    assert take(limiter, 1.0) == pytest.approx(9.0)
+    assert take(limiter, 10.0) == 0.0
+
+
+def test_quiet_period_refills_up_to_the_burst_only():
+    limiter = MemoryLimiter()
+    take(limiter, 0.0)
+    assert [take(limiter, 1000.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert take(limiter, 1000.0) > 0
+
+
+def test_refund_gives_the_call_back():
+    limiter = MemoryLimiter()
+    for _ in range(3):
+        take(limiter, 0.0)
+    asyncio.run(limiter.refund("u", INTERVAL))
+    assert take(limiter, 0.0) == 0.0
+    assert take(limiter, 0.0) == pytest.approx(INTERVAL)
+
+
+def test_refund_of_an_unknown_key_is_ignored():
+    limiter = MemoryLimiter()
+    asyncio.run(limiter.refund("u", INTERVAL))
+    assert [take(limiter, 0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_keys_are_limited_separately():
+    limiter = MemoryLimiter()
+    for _ in range(3):
+        take(limiter, 0.0, key="a")
+    assert take(limiter, 0.0, key="a") > 0
+    assert take(limiter, 0.0, key="b") == 0.0
+
+
+def test_least_recently_used_key_is_forgotten_first(monkeypatch):
+    monkeypatch.setattr("app.telegram.admission.MAX_TRACKED_KEYS", 2)
+    limiter = MemoryLimiter()
+    for key in ("a", "b", "a", "c"):
+        take(limiter, 0.0, key=key)
+    assert list(limiter._tat) == ["a", "c"]
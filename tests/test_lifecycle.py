@@ -0,0 +1,90 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+for module in ("aiogram", "prometheus_client"):
+    pytest.importorskip(module)
+
+from app import lifecycle
+from app.lifecycle import MIN_STEP_SECONDS, Shutdown
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(lifecycle, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def step(clock, timeouts, spends=None):
+    """A step recording its timeout and taking `spends(timeout)` seconds of the fake clock."""
+    async def run(timeout):
+        timeouts.append(timeout)
+        clock.now += spends(timeout) if spends else 0
+    return run
+
+
+def test_each_step_leaves_time_for_the_ones_after_it(clock):
+    timeouts = []
+    shutdown = Shutdown(10)
+    for name in ("drain", "deliveries", "close"):
+        shutdown.add(name, step(clock, timeouts, lambda timeout: 2))
+    asyncio.run(shutdown.run())
+    assert timeouts == [10 - 2 * MIN_STEP_SECONDS, 10 - 2 - MIN_STEP_SECONDS, 10 - 4]
+
+
+def test_a_slow_step_does_not_starve_the_last_ones(clock):
+    timeouts = []
+    shutdown = Shutdown(10)
+    shutdown.add("drain", step(clock, timeouts, lambda timeout: timeout))
+    # Overruns its timeout: the step after it still gets the minimum
+    shutdown.add("deliveries", step(clock, timeouts, lambda timeout: timeout + 5))
+    shutdown.add("close", step(clock, timeouts))
+    asyncio.run(shutdown.run())
+    assert timeouts == [8, MIN_STEP_SECONDS, MIN_STEP_SECONDS]
+
+
+def test_begin_reserves_time_for_every_step(clock):
+    timeouts = []
+    shutdown = Shutdown(10)
+    for name in ("drain", "deliveries", "close"):
+        shutdown.add(name, step(clock, timeouts))
+    assert shutdown.begin() == 10 - 3 * MIN_STEP_SECONDS
+
+    # Draining done before run() took what begin() allowed; the deadline counts from begin()
+    clock.now += 7
+    assert shutdown.begin() == 7
+    asyncio.run(shutdown.run())
+    assert timeouts == [1, 2, 3]
+
+
+def test_begin_never_returns_a_negative_time(clock):
+    shutdown = Shutdown(2)
+    for name in ("a", "b", "c"):
+        shutdown.add(name, step(clock, []))
+    assert shutdown.begin() == 0.0
+
+
+def test_hung_and_failing_steps_do_not_stop_the_rest(monkeypatch):
+    monkeypatch.setattr(lifecycle, "MIN_STEP_SECONDS", 0.05)
+    ran = []
+
+    async def hung(timeout):
+        await asyncio.sleep(10)
+
+    async def broken(timeout):
+        raise RuntimeError("boom")
+
+    async def close(timeout):
+        ran.append("close")
+
+    shutdown = Shutdown(0.1)
+    shutdown.add("hung", hung)
+    shutdown.add("broken", broken)
+    shutdown.add("close", close)
+    started = time.monotonic()
+    asyncio.run(shutdown.run())
+    assert ran == ["close"]
+    assert time.monotonic() - started < 1
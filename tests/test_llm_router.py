@@ -0,0 +1,160 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+for module in ("aiohttp", "prometheus_client", "pydantic_settings"):
+    pytest.importorskip(module)
+
+from app.cv_analyzer.llm import router as router_module
+from app.cv_analyzer.llm.router import LLMRouter
+from app.settings import LLMEndpoint, LLMSettings
+
+
+class FakeClient:
+    def __init__(self, name):
+        self.name = name
+        self.error = None
+        self.calls = 0
+        self.during_call = None
+
+    async def complete(self, system, user, use_small_model=False):
+        self.calls += 1
+        if self.during_call:
+            self.during_call()
+        if self.error:
+            raise self.error
+        return self.name
+
+
+class RequestError(Exception):
+    status_code = 400
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    # Only the router's clock: the event loop keeps the real one
+    monkeypatch.setattr(router_module, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    clients = {}
+
+    def get_client(endpoint):
+        return clients.setdefault(endpoint.name, FakeClient(endpoint.name))
+
+    monkeypatch.setattr(router_module, "get_client", get_client)
+    return clients
+
+
+def make_router(*names, **settings):
+    endpoints = [
+        LLMEndpoint(base_url=f"http://{name}", api_key="key", general_model="big", small_model="small", name=name)
+        for name in names
+    ]
+    settings = {"failures_to_open": 3, "cooldown_seconds": 30, "max_cooldown_seconds": 100, **settings}
+    return LLMRouter(LLMSettings(endpoints=endpoints, **settings))
+
+
+def call(router):
+    return asyncio.run(router.complete("system", "user"))
+
+
+def fail(router, times):
+    for _ in range(times):
+        with pytest.raises(RuntimeError):
+            call(router)
+
+
+def test_breaker_opens_after_consecutive_failures(clock, clients):
+    router = make_router("a", max_attempts=1)
+    state = router.states[0]
+    clients["a"] = FakeClient("a")
+    clients["a"].error = RuntimeError("down")
+
+    fail(router, 2)
+    assert state.trips == 0 and state.available(clock.now)
+
+    fail(router, 1)
+    assert state.trips == 1
+    assert state.open_until == 30
+    assert not state.available(29.9)
+    assert state.available(30)
+
+
+def test_failed_probe_doubles_the_cooldown_up_to_the_cap(clock, clients):
+    router = make_router("a", max_attempts=1)
+    state = router.states[0]
+    clients["a"] = FakeClient("a")
+    clients["a"].error = RuntimeError("down")
+    fail(router, 3)
+
+    clock.now = 30
+    fail(router, 1)
+    assert state.trips == 2
+    assert state.open_until == 30 + 60
+
+    clock.now = 90
+    fail(router, 1)
+    assert state.trips == 3
+    # 120s doubled, capped at 100s
+    assert state.open_until == 90 + 100
+
+
+def test_successful_probe_closes_the_breaker(clock, clients):
+    router = make_router("a", max_attempts=1)
+    state = router.states[0]
+    client = clients["a"] = FakeClient("a")
+    client.error = RuntimeError("down")
+    fail(router, 3)
+
+    clock.now = 30
+    client.error = None
+    # Half-open: no other call gets through while the probe runs
+    client.during_call = lambda: probing.append(state.available(clock.now))
+    probing = []
+    assert call(router) == "a"
+    assert probing == [False]
+    assert state.trips == 0 and state.consecutive_failures == 0
+    assert state.available(clock.now)
+
+    # Tripping again starts from the first cooldown
+    client.during_call = None
+    client.error = RuntimeError("down")
+    fail(router, 3)
+    assert state.open_until == 30 + 30
+
+
+def test_open_endpoint_is_skipped(clock, clients):
+    router = make_router("a", "b", max_attempts=1)
+    clients["a"] = FakeClient("a")
+    clients["b"] = FakeClient("b")
+    for _ in range(3):
+        router._failed(router.states[0])
+
+    assert [call(router) for _ in range(3)] == ["b", "b", "b"]
+    assert clients["a"].calls == 0
+
+
+def test_failure_is_retried_on_another_endpoint(clock, clients):
+    router = make_router("a", "b", max_attempts=2)
+    clients["a"] = FakeClient("a")
+    clients["a"].error = RuntimeError("down")
+
+    assert call(router) == "b"
+    assert router.states[0].consecutive_failures == 1
+
+
+def test_request_errors_are_not_retried_nor_counted(clock, clients):
+    router = make_router("a", "b", max_attempts=2)
+    clients["a"] = FakeClient("a")
+    clients["a"].error = RequestError("bad request")
+
+    with pytest.raises(RequestError):
+        call(router)
+    assert "b" not in clients
+    assert router.states[0].consecutive_failures == 0
+    assert router.states[0].error_rate == 0
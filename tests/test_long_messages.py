@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip("aiogram")
+
+from app.utils.long_messages import pack_sections, split_text, utf16_len
+
+
+def test_utf16_len_counts_astral_chars_twice():
+    assert utf16_len("abc") == 3
+    assert utf16_len("привет") == 6
+    assert utf16_len("😀") == 2
+    assert utf16_len("a😀b") == 4
+
+
+def test_split_text_keeps_short_text_whole():
+    assert split_text("hello world", limit=20) == ["hello world"]
+    assert split_text("") == []
+    assert split_text("  \n\n ") == []
+
+
+def test_split_text_measures_in_utf16_units():
+    text = "😀" * 10
+    chunks = split_text(text, limit=5)
+    assert all(utf16_len(chunk) <= 5 for chunk in chunks)
+    # Two emoji per chunk: a third would take six units, a surrogate pair is never cut
+    assert chunks == ["😀😀"] * 5
+
+
+def test_split_text_prefers_paragraph_breaks():
+    text = "first paragraph\n\nsecond one here"
+    assert split_text(text, limit=20) == ["first paragraph", "second one here"]
+
+
+def test_split_text_loses_no_words():
+    words = [f"word{i}" for i in range(200)]
+    chunks = split_text(" ".join(words), limit=50)
+    assert all(utf16_len(chunk) <= 50 for chunk in chunks)
+    assert " ".join(chunks).split() == words
+
+
+def test_split_text_never_ends_a_chunk_with_an_escaping_backslash():
+    text = "a" * 9 + "\\." + "b" * 9
+    chunks = split_text(text, limit=10)
+    assert all(not chunk.endswith("\\") or chunk.endswith("\\\\") for chunk in chunks)
+    assert "".join(chunks) == text
+
+
+def test_split_text_does_not_cut_at_an_escaped_space():
+    text = "abcdefgh\\ ijklmnop"
+    chunks = split_text(text, limit=10)
+    assert all(utf16_len(chunk) <= 10 for chunk in chunks)
+    assert all(not chunk.endswith("\\") for chunk in chunks)
+    assert "".join(chunks) == text
+
+
+def test_pack_sections_uses_as_few_messages_as_possible():
+    sections = ["a" * 10, "b" * 10, "c" * 10, "d" * 10]
+    # Two sections and their separator take 22 units
+    assert pack_sections(sections, limit=22) == ["a" * 10 + "\n\n" + "b" * 10, "c" * 10 + "\n\n" + "d" * 10]
+    assert pack_sections(sections, limit=100) == ["\n\n".join(sections)]
+
+
+def test_pack_sections_keeps_order_and_splits_only_oversized_sections():
+    sections = ["short", "x " * 30, "tail"]
+    messages = pack_sections(sections, limit=20)
+    assert all(utf16_len(message) <= 20 for message in messages)
+    assert messages[0] == "short"
+    assert messages[-1].endswith("tail")
+    assert " ".join(messages).split() == " ".join(sections).split()
+
+
+def test_pack_sections_tail_of_a_split_section_shares_the_next_message():
+    messages = pack_sections(["a" * 15 + " " + "b" * 3, "c"], limit=16)
+    assert messages == ["a" * 15, "bbb\n\nc"]
+
+
+def test_pack_sections_skips_blank_oversized_sections():
+    assert pack_sections(["one", " " * 50, "two"], limit=10) == ["one", "two"]
+    assert pack_sections([" " * 50], limit=10) == []
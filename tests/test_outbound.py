@@ -0,0 +1,109 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+for module in ("aiogram", "prometheus_client", "pydantic_settings"):
+    pytest.importorskip(module)
+
+from app.utils import outbound
+from app.utils.outbound import Priority, PriorityLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(outbound, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_bucket_allows_a_burst_then_the_rate(clock):
+    bucket = TokenBucket(rate=1.0, capacity=3)
+    assert [bucket.try_take() for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay() == pytest.approx(1.0)
+
+    clock.now += 1
+    assert bucket.try_take()
+    assert not bucket.try_take()
+
+
+def test_reserve_goes_into_debt(clock):
+    bucket = TokenBucket(rate=2.0, capacity=1)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_pause_drops_the_burst_and_holds_for_retry_after(clock):
+    bucket = TokenBucket(rate=1.0, capacity=3)
+    bucket.pause(5)
+    assert not bucket.try_take()
+
+    clock.now += 4.5
+    assert not bucket.try_take()
+    clock.now += 0.5
+    # Retry-After has passed, the next token comes at the bucket's rate
+    assert bucket.delay() == pytest.approx(1.0)
+    clock.now += 1
+    assert bucket.try_take()
+
+
+def test_pause_adds_to_a_debt(clock):
+    bucket = TokenBucket(rate=1.0, capacity=1)
+    bucket.reserve()
+    bucket.reserve()
+    bucket.pause(5)
+    assert bucket.delay() == pytest.approx(7.0)
+
+
+def test_idle_once_refilled(clock):
+    bucket = TokenBucket(rate=1.0, capacity=2)
+    assert bucket.idle()
+    bucket.try_take()
+    assert not bucket.idle()
+    clock.now += 1
+    assert bucket.idle()
+
+
+def test_priority_limiter_pause_holds_every_waiter():
+    async def scenario():
+        limiter = PriorityLimiter(rate=100.0, burst=1)
+        await limiter.acquire(Priority.INTERACTIVE)
+        limiter.pause(0.2)
+        started = time.monotonic()
+        await limiter.acquire(Priority.INTERACTIVE)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.2
+
+
+def test_priority_limiter_serves_interactive_before_bulk():
+    async def scenario():
+        limiter = PriorityLimiter(rate=50.0, burst=1)
+        await limiter.acquire(Priority.INTERACTIVE)
+        served = []
+
+        async def waiter(name, priority):
+            await limiter.acquire(priority)
+            served.append(name)
+
+        bulk = [asyncio.create_task(waiter(f"bulk{i}", Priority.BULK)) for i in range(2)]
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(waiter("interactive", Priority.INTERACTIVE))
+        await asyncio.gather(*bulk, interactive)
+        return served
+
+    assert asyncio.run(scenario()) == ["interactive", "bulk0", "bulk1"]
+
+
+def test_priority_limiter_skips_cancelled_waiters():
+    async def scenario():
+        limiter = PriorityLimiter(rate=50.0, burst=1)
+        await limiter.acquire(Priority.INTERACTIVE)
+        cancelled = asyncio.create_task(limiter.acquire(Priority.INTERACTIVE))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.wait_for(limiter.acquire(Priority.BULK), timeout=1)
+
+    asyncio.run(scenario())
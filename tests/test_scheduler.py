@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+
+for module in ("aiogram", "motor", "pydantic_settings"):
+    pytest.importorskip(module)
+
+from app import scheduler
+from app.scheduler import TimerWheel
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(scheduler, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def run_until(wheel, clock, until):
+    """Advances the wheel tick by tick, returning when each key came due."""
+    fired = {}
+    while clock.now < until:
+        clock.now += 1
+        for key in wheel.advance():
+            fired[key] = clock.now
+    return fired
+
+
+def test_key_fires_after_its_delay(clock):
+    wheel = TimerWheel(tick=1.0, slots=4)
+    wheel.schedule("a", 2.0)
+    wheel.schedule("b", 0.0)
+    assert run_until(wheel, clock, 110) == {"b": 101, "a": 103}
+
+
+def test_delays_longer_than_the_wheel_wait_their_rounds(clock):
+    wheel = TimerWheel(tick=1.0, slots=4)
+    wheel.schedule("short", 1.0)
+    # Same slot as "short", two turns of the wheel later
+    wheel.schedule("long", 9.0)
+    assert run_until(wheel, clock, 120) == {"short": 102, "long": 110}
+
+
+def test_many_ticks_at_once_are_caught_up(clock):
+    wheel = TimerWheel(tick=1.0, slots=4)
+    for delay in range(10):
+        wheel.schedule(delay, float(delay))
+    clock.now += 50
+    assert sorted(wheel.advance()) == list(range(10))
+    assert wheel.advance() == []
+
+
+def test_cancelled_key_never_fires(clock):
+    wheel = TimerWheel(tick=1.0, slots=4)
+    wheel.schedule("a", 2.0)
+    wheel.schedule("b", 2.0)
+    assert wheel.cancel("a")
+    assert not wheel.cancel("a")
+    assert run_until(wheel, clock, 110) == {"b": 103}
+    assert not wheel.cancel("b")
+
+
+def test_rescheduling_moves_the_key(clock):
+    wheel = TimerWheel(tick=1.0, slots=4)
+    wheel.schedule("a", 1.0)
+    wheel.schedule("a", 6.0)
+    assert run_until(wheel, clock, 110) == {"a": 107}
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+for module in ("aiogram", "prometheus_client", "pydantic_settings"):
+    pytest.importorskip(module)
+
+from app.telegram.sharding import SLOTS, ChatLanes, slot_of
+
+
+def test_jobs_of_a_key_run_one_by_one_in_order():
+    async def scenario():
+        lanes = ChatLanes(concurrency=4, max_keys=4, max_per_key=10)
+        done = []
+        running = {"a": 0, "b": 0}
+        overlap = []
+
+        def job(key, index):
+            async def run():
+                running[key] += 1
+                overlap.append(running[key])
+                await asyncio.sleep(0.001 * (5 - index))
+                done.append((key, index))
+                running[key] -= 1
+            return run
+
+        for index in range(5):
+            for key in ("a", "b"):
+                assert await lanes.submit(key, job(key, index))
+        await lanes.join()
+        return done, overlap
+
+    done, overlap = asyncio.run(scenario())
+    assert [index for key, index in done if key == "a"] == list(range(5))
+    assert [index for key, index in done if key == "b"] == list(range(5))
+    assert max(overlap) == 1
+
+
+def test_keys_run_concurrently():
+    async def scenario():
+        lanes = ChatLanes(concurrency=2, max_keys=4, max_per_key=10)
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def blocked():
+            started.set()
+            await release.wait()
+
+        async def other():
+            release.set()
+
+        await lanes.submit("slow", blocked)
+        await started.wait()
+        await lanes.submit("fast", other)
+        await asyncio.wait_for(lanes.join(), timeout=1)
+
+    asyncio.run(scenario())
+
+
+def test_full_lane_drops_only_its_own_jobs():
+    async def scenario():
+        lanes = ChatLanes(concurrency=4, max_keys=4, max_per_key=2)
+        release = asyncio.Event()
+        ran = []
+
+        def job(name):
+            async def run():
+                await release.wait()
+                ran.append(name)
+            return run
+
+        accepted = [await lanes.submit("a", job(f"a{i}")) for i in range(3)]
+        assert accepted == [True, True, False]
+        assert await lanes.submit("b", job("b0"))
+        assert lanes.pending() == 3
+
+        release.set()
+        await lanes.join()
+        assert lanes.pending() == 0
+        # The lane has room again once it drained
+        assert await lanes.submit("a", job("a3"))
+        await lanes.join()
+        return ran
+
+    assert sorted(asyncio.run(scenario())) == ["a0", "a1", "a3", "b0"]
+
+
+def test_new_keys_wait_for_a_free_one():
+    async def scenario():
+        lanes = ChatLanes(concurrency=4, max_keys=1, max_per_key=10)
+        release = asyncio.Event()
+        ran = []
+
+        async def blocked():
+            await release.wait()
+            ran.append("a")
+
+        async def other():
+            ran.append("b")
+
+        await lanes.submit("a", blocked)
+        waiting = asyncio.create_task(lanes.submit("b", other))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        # A key with a lane already is not held up
+        assert await lanes.submit("a", other)
+
+        release.set()
+        assert await waiting
+        await lanes.join()
+        return ran
+
+    assert asyncio.run(scenario()) == ["a", "b", "b"]
+
+
+def test_failing_job_does_not_stop_its_lane():
+    async def scenario():
+        lanes = ChatLanes(concurrency=1, max_keys=1, max_per_key=10)
+        ran = []
+
+        async def broken():
+            raise RuntimeError("boom")
+
+        async def fine():
+            ran.append("fine")
+
+        await lanes.submit("a", broken)
+        await lanes.submit("a", fine)
+        await lanes.join()
+        # The key was released
+        assert await lanes.submit("b", fine)
+        await lanes.join()
+        return ran
+
+    assert asyncio.run(scenario()) == ["fine", "fine"]
+
+
+def test_slot_of_is_stable():
+    assert slot_of(12345) == slot_of(12345)
+    assert 0 <= slot_of(-100123) < SLOTS
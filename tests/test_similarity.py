@@ -0,0 +1,85 @@
+import random
+
+from app.cv_analyzer.similarity import BANDS, NUM_PERM, lsh_bands, minhash, shingles, similarity
+
+WORDS = [f"w{i}" for i in range(5000)]
+
+
+def document(seed, length=300):
+    rng = random.Random(seed)
+    return [rng.choice(WORDS) for _ in range(length)]
+
+
+def edited(tokens, changes, seed=0):
+    rng = random.Random(seed)
+    tokens = list(tokens)
+    for index in rng.sample(range(len(tokens)), changes):
+        tokens[index] = "edited"
+    return tokens
+
+
+def signature(tokens):
+    return minhash(shingles(tokens))
+
+
+def jaccard(a, b):
+    a, b = shingles(a), shingles(b)
+    return len(a & b) / len(a | b)
+
+
+def shared_bands(a, b):
+    return set(lsh_bands(a)) & set(lsh_bands(b))
+
+
+def test_shingles_are_lowercased_word_triples():
+    assert shingles(["A", "b", "C", "d"]) == {"a b c", "b c d"}
+    assert shingles(["Only", "two"]) == {"only two"}
+    assert shingles([]) == set()
+
+
+def test_signature_is_stable_and_sized():
+    tokens = document(1)
+    assert len(signature(tokens)) == NUM_PERM
+    assert signature(tokens) == signature(list(tokens))
+    # Fixed across processes: stored signatures stay comparable
+    assert signature(["a", "b", "c"]) == signature(["A", "B", "C"])
+
+
+def test_identical_documents_share_every_band():
+    tokens = document(1)
+    assert similarity(signature(tokens), signature(tokens)) == 1.0
+    assert len(shared_bands(signature(tokens), signature(tokens))) == BANDS
+
+
+def test_near_duplicates_share_a_band():
+    for seed in range(20):
+        original = document(seed)
+        copy = edited(original, 3, seed)
+        assert jaccard(original, copy) > 0.9
+        a, b = signature(original), signature(copy)
+        assert shared_bands(a, b), seed
+        assert similarity(a, b) > 0.75
+
+
+def test_unrelated_documents_share_no_band():
+    for seed in range(20):
+        a, b = signature(document(seed)), signature(document(seed + 1000))
+        assert not shared_bands(a, b)
+        assert similarity(a, b) < 0.1
+
+
+def test_band_keys_carry_their_band_number():
+    keys = lsh_bands(signature(document(1)))
+    assert [key.split(":")[0] for key in keys] == [str(band) for band in range(BANDS)]
+    # The same rows in another band are another key
+    assert len(set(lsh_bands([7] * NUM_PERM))) == BANDS
+
+
+def test_similarity_of_mismatched_signatures_is_zero():
+    assert similarity([], []) == 0.0
+    assert similarity([1, 2], [1, 2, 3]) == 0.0
+
+
+def test_empty_document_has_a_signature():
+    assert minhash([]) == minhash(set())
+    assert len(minhash([])) == NUM_PERM
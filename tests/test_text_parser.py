@@ -0,0 +1,106 @@
+import zipfile
+
+import pytest
+
+from app.utils import text_parser
+from app.utils.pdf_text import UnreadableDocument
+from app.utils.text_parser import (
+    _extract_docx_with_python_docx, _stream_docx_lines, extract_text_auto, extract_text_from_docx,
+)
+
+W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+MC = "http://schemas.openxmlformats.org/markup-compatibility/2006"
+
+
+@pytest.fixture
+def docx():
+    return pytest.importorskip("docx")
+
+
+def build(docx, path, table_last=True):
+    document = docx.Document()
+    document.add_paragraph("Иван Петров")
+    run = document.add_paragraph().add_run("Python developer")
+    run.add_break()
+    run.add_text("Moscow")
+    run.add_tab()
+    run.add_text("remote 😀")
+    document.add_paragraph("")
+    if not table_last:
+        add_table(document)
+    document.add_paragraph("Опыт работы")
+    document.add_paragraph("2020 — 2024: backend")
+    if table_last:
+        add_table(document)
+    document.save(path)
+    return path
+
+
+def add_table(document):
+    table = document.add_table(rows=2, cols=2)
+    table.cell(0, 0).text = "Skill"
+    table.cell(0, 1).text = "Level"
+    table.cell(1, 0).text = "Python"
+    cell = table.cell(1, 1)
+    cell.text = "Expert"
+    cell.add_paragraph("10 years")
+
+
+def test_streaming_matches_python_docx(docx, tmp_path):
+    path = build(docx, str(tmp_path / "resume.docx"))
+    assert "\n".join(_stream_docx_lines(path)) == _extract_docx_with_python_docx(path)
+
+
+def test_streaming_keeps_tables_in_document_order(docx, tmp_path):
+    path = build(docx, str(tmp_path / "resume.docx"), table_last=False)
+    streamed = "\n".join(_stream_docx_lines(path)).split("\n")
+    fallback = _extract_docx_with_python_docx(path).split("\n")
+    # python-docx puts every table after the paragraphs, the text is the same
+    assert sorted(streamed) == sorted(fallback)
+    assert streamed.index("Skill Level") < streamed.index("Опыт работы")
+
+
+def test_python_docx_is_the_fallback(docx, tmp_path, monkeypatch):
+    path = build(docx, str(tmp_path / "resume.docx"))
+    expected = _extract_docx_with_python_docx(path)
+
+    def broken(path):
+        raise ValueError("bad xml")
+        yield
+
+    monkeypatch.setattr(text_parser, "_stream_docx_lines", broken)
+    assert extract_text_from_docx(path) == expected
+
+
+def test_unreadable_docx(tmp_path):
+    path = tmp_path / "resume.docx"
+    path.write_bytes(b"not a zip")
+    with pytest.raises(UnreadableDocument) as e:
+        extract_text_auto(str(path))
+    assert e.value.reason == UnreadableDocument.BROKEN
+
+
+def test_unsupported_extension(tmp_path):
+    path = tmp_path / "resume.odt"
+    path.write_bytes(b"")
+    with pytest.raises(UnreadableDocument) as e:
+        extract_text_auto(str(path))
+    assert e.value.reason == UnreadableDocument.UNSUPPORTED
+
+
+def test_text_box_is_read_once(tmp_path):
+    body = (
+        '<w:p><w:r><w:t>Before</w:t></w:r></w:p>'
+        '<w:p><w:r><mc:AlternateContent>'
+        '<mc:Choice Requires="wps"><w:txbxContent><w:p><w:r><w:t>Boxed</w:t></w:r></w:p></w:txbxContent></mc:Choice>'
+        '<mc:Fallback><w:txbxContent><w:p><w:r><w:t>Boxed</w:t></w:r></w:p></w:txbxContent></mc:Fallback>'
+        '</mc:AlternateContent></w:r></w:p>'
+        '<w:p><w:r><w:t>After</w:t></w:r></w:p>'
+    )
+    path = str(tmp_path / "boxes.docx")
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr(
+            "word/document.xml",
+            f'<w:document xmlns:w="{W}" xmlns:mc="{MC}"><w:body>{body}</w:body></w:document>',
+        )
+    assert [line for line in _stream_docx_lines(path) if line] == ["Before", "Boxed", "After"]
@@ -0,0 +1,140 @@
+"""
+API calls per analysis report, old flush-per-section layout vs packed sections, and splitter timings.
+
+    python -m tools.bench_message_packing --reports 1000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from app.models import AnalysisDetail
+from app.telegram.handlers.analysis import send_ok_message, _escape_md_v2
+from app.utils.long_messages import split_text, utf16_len, TELEGRAM_LIMIT
+
+WORDS = (
+    "опыт", "команда", "Python", "FastAPI", "Kubernetes", "метрики", "p95", "RPS", "5_000", "(Kafka)",
+    "руководил", "снизил", "на", "30%", "сервис", "архитектура", "👍", "ATS", "резюме", "ускорил",
+)
+
+
+def _legacy_split_text(text: str, limit: int = TELEGRAM_LIMIT) -> list[str]:
+    # The splitter before packing: rebuilds the buffer string on every paragraph and line
+    if len(text) <= limit:
+        return [text]
+    parts: list[str] = []
+    buf = ""
+    for paragraph in text.split("\n\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        candidate = (buf + ("\n\n" if buf else "") + paragraph)
+        if len(candidate) <= limit:
+            buf = candidate
+            continue
+        if buf:
+            parts.append(buf)
+            buf = ""
+        line_buf = ""
+        for line in paragraph.split("\n"):
+            line = line.rstrip()
+            cand_line = (line_buf + ("\n" if line_buf else "") + line)
+            if len(cand_line) <= limit:
+                line_buf = cand_line
+                continue
+            if line_buf:
+                parts.append(line_buf)
+                line_buf = ""
+            for start in range(0, len(line), limit):
+                parts.append(line[start:start + limit])
+        if line_buf:
+            parts.append(line_buf)
+    if buf:
+        parts.append(buf)
+    return parts
+
+
+def _legacy_calls(detail: AnalysisDetail) -> int:
+    header = f"*📊 Оценка резюме: {detail.score}/100*"
+    blocks = [
+        ("*✅ Сильные стороны*", detail.strengths),
+        ("*⚠️ Проблемы*", detail.problems),
+        ("*🛠 Что сделать*", detail.actions[:10]),
+    ]
+    calls = 0
+    sections = [header]
+    for title, items in blocks:
+        if not items:
+            continue
+        sections.append(title + "\n" + "\n".join(f"• {_escape_md_v2(i)}" for i in items))
+        calls += len(_legacy_split_text("\n\n".join(sections), 3500))
+        sections = []
+    if sections:
+        calls += len(_legacy_split_text("\n\n".join(sections), 3500))
+    return calls
+
+
+class _CountingMessage:
+    def __init__(self) -> None:
+        self.sent: list[str] = []
+
+    async def answer(self, text: str, parse_mode: str | None = None) -> None:
+        assert utf16_len(text) <= TELEGRAM_LIMIT
+        self.sent.append(text)
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)) + "."
+
+
+def _report(rng: random.Random) -> AnalysisDetail:
+    # Typical LLM answers are 4-10 items per block, 15-60 words per item
+    def items() -> list[str]:
+        return [_sentence(rng, rng.randint(15, 60)) for _ in range(rng.randint(4, 10))]
+
+    return AnalysisDetail(
+        score=rng.randint(0, 100), strengths=items(), problems=items(), actions=items(),
+        sections={}, ok=True, raw="", prompt="",
+    )
+
+
+def _time(fn, text: str, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def main(reports: int, seed: int) -> None:
+    rng = random.Random(seed)
+    before = after = 0
+    histogram: dict[int, int] = {}
+    for _ in range(reports):
+        detail = _report(rng)
+        before += _legacy_calls(detail)
+        message = _CountingMessage()
+        await send_ok_message(detail, message)
+        after += len(message.sent)
+        histogram[len(message.sent)] = histogram.get(len(message.sent), 0) + 1
+
+    print(f"reports: {reports}")
+    print(f"API calls per report: before {before / reports:.2f}, after {after / reports:.2f}")
+    print("messages per report after:", ", ".join(f"{k}: {v}" for k, v in sorted(histogram.items())))
+
+    print("splitter, one long text:")
+    for lines in (1_000, 10_000, 50_000):
+        text = "\n".join(_sentence(rng, 30) for _ in range(lines))
+        print(
+            f"  {len(text):>9} chars: before {_time(_legacy_split_text, text) * 1000:8.1f} ms, "
+            f"after {_time(split_text, text) * 1000:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reports", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main(args.reports, args.seed))
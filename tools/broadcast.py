@@ -0,0 +1,202 @@
+"""
+Sends one message to every user of the bot.
+
+    python -m tools.broadcast --name release-2025-02 --text-file announcement.md --parse-mode MarkdownV2
+
+Progress is checkpointed in the broadcasts collection: running the same --name again resumes
+after the last user known to be done. Delivery is at least once, a user in flight when the run
+was killed may get the message twice.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from bson import ObjectId
+from dotenv import load_dotenv
+
+from app.bootstrap import build_bot
+from app.db import db, init_db
+from app.settings import Settings, get_settings
+from app.utils.outbound import bulk
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_INTERVAL = 5.0
+REPORT_INTERVAL = 2.0
+MAX_RETRY_AFTER_ATTEMPTS = 5
+
+
+class Broadcast:
+    def __init__(self, bot: Bot, doc: Dict[str, Any], concurrency: int, batch_size: int, dry_run: bool) -> None:
+        self._bot = bot
+        self._doc = doc
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._batch_size = batch_size
+        self._dry_run = dry_run
+        # Users in flight in cursor order; the watermark only moves past a done prefix
+        self._window: Deque[List[Any]] = deque()
+        self._watermark: Optional[ObjectId] = doc.get("watermark")
+        # Outcomes of users up to the watermark: a resumed run sends again whatever is past it
+        self._committed = {key: doc.get(key, 0) for key in ("sent", "blocked", "failed")}
+        # Outcomes of every user done so far, for the progress line
+        self._counters = dict(self._committed)
+        self._done = 0
+        self._total = 0
+        self._started = time.monotonic()
+
+    async def _send(self, chat_id: int) -> str:
+        if self._dry_run:
+            return "sent"
+        for _ in range(MAX_RETRY_AFTER_ATTEMPTS):
+            try:
+                # Bulk priority: replies of the bot in this process are never stuck behind the broadcast
+                with bulk():
+                    await self._bot.send_message(chat_id, self._doc["text"], parse_mode=self._doc.get("parse_mode"))
+                return "sent"
+            except TelegramRetryAfter as e:
+                # The session already retried, the whole bot is flooding: back off harder
+                await asyncio.sleep(e.retry_after * 2)
+            except TelegramForbiddenError:
+                return "blocked"
+            except TelegramBadRequest as e:
+                logger.warning("Chat %s: %s", chat_id, e.message)
+                return "failed"
+        return "failed"
+
+    async def _deliver(self, entry: List[Any]) -> None:
+        try:
+            outcome = await self._send(entry[1])
+        except Exception:
+            logger.exception("Unable to send to chat %s", entry[1])
+            outcome = "failed"
+        finally:
+            self._semaphore.release()
+        self._counters[outcome] += 1
+        self._done += 1
+        entry[2] = outcome
+        while self._window and self._window[0][2]:
+            user_id, _, done_outcome = self._window.popleft()
+            self._watermark = user_id
+            self._committed[done_outcome] += 1
+
+    async def _checkpoint(self, status: str = "running") -> None:
+        if self._dry_run:
+            # A dry run leaves no trace: the real run with the same --name starts from scratch
+            return
+        await db().broadcasts.update_one(
+            {"_id": self._doc["_id"]},
+            {"$set": {"watermark": self._watermark, "status": status, "updated_at": datetime.now(), **self._committed}},
+        )
+
+    def _report(self, final: bool = False) -> None:
+        elapsed = time.monotonic() - self._started
+        rate = self._done / elapsed if elapsed else 0.0
+        left = self._total - self._done
+        eta = f"{left / rate:.0f}s" if rate else "?"
+        line = (
+            f"{self._done}/{self._total} sent={self._counters['sent']} blocked={self._counters['blocked']} "
+            f"failed={self._counters['failed']} {rate:.1f} msg/s eta {eta}"
+        )
+        sys.stderr.write(("\n" if final else "\r") + line)
+        sys.stderr.flush()
+
+    async def _background(self) -> None:
+        last_checkpoint = time.monotonic()
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            self._report()
+            if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                last_checkpoint = time.monotonic()
+                await self._checkpoint()
+
+    async def run(self) -> None:
+        query: Dict[str, Any] = {"_id": {"$gt": self._watermark}} if self._watermark else {}
+        self._total = await db().users.count_documents(query)
+        cursor = db().users.find(query, {"tg_chat_id": 1}).sort("_id", 1).batch_size(self._batch_size)
+
+        background = asyncio.create_task(self._background())
+        tasks = set()
+        try:
+            async for user in cursor:
+                await self._semaphore.acquire()
+                entry = [user["_id"], user["tg_chat_id"], None]
+                self._window.append(entry)
+                task = asyncio.create_task(self._deliver(entry))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(set(tasks))
+        finally:
+            background.cancel()
+            self._report(final=True)
+            await self._checkpoint("done" if not self._window else "interrupted")
+
+
+async def load_broadcast(name: str, text: str | None, parse_mode: str | None, dry_run: bool) -> Dict[str, Any]:
+    doc = await db().broadcasts.find_one({"_id": name})
+    if doc is not None:
+        if doc["status"] == "done":
+            raise SystemExit(f"Broadcast {name!r} is already done")
+        if text is not None and text != doc["text"]:
+            raise SystemExit(f"Broadcast {name!r} was started with another text, pick a new --name")
+        logger.info("Resuming %r after %s", name, doc.get("watermark"))
+        return doc
+
+    if text is None:
+        raise SystemExit("--text-file is required for a new broadcast")
+    doc = {
+        "_id": name,
+        "text": text,
+        "parse_mode": parse_mode,
+        "watermark": None,
+        "status": "running",
+        "created_at": datetime.now(),
+    }
+    if not dry_run:
+        await db().broadcasts.insert_one(doc)
+    return doc
+
+
+async def main(args: argparse.Namespace) -> None:
+    load_dotenv()
+    settings: Settings = get_settings()
+    # Leave a share of the bot-wide limit to the running bot
+    settings = settings.model_copy(update={
+        "outbound": settings.outbound.model_copy(update={"global_rate": args.rate}),
+    })
+    await init_db(settings.mongo_dsn, settings.db_name)
+
+    text = None
+    if args.text_file:
+        with open(args.text_file, encoding="utf-8") as f:
+            text = f.read().strip()
+    doc = await load_broadcast(args.name, text, args.parse_mode, args.dry_run)
+
+    bot = build_bot(settings, processes=1)
+    try:
+        await Broadcast(bot, doc, args.concurrency, args.batch_size, args.dry_run).run()
+    finally:
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--name", required=True, help="Broadcast id, the same name resumes an interrupted run")
+    parser.add_argument("--text-file")
+    parser.add_argument("--parse-mode", choices=["HTML", "MarkdownV2"])
+    parser.add_argument("--rate", type=float, default=20.0, help="Messages per second")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
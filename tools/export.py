@@ -0,0 +1,295 @@
+"""
+Exports analyses, users and file_checking for analysis outside of Mongo.
+
+    python -m tools.export --out /data/export --format parquet
+    python -m tools.export --out /data/export --format jsonl --incremental --collections analyses
+
+Documents are streamed from a server-side cursor and written in batches of --batch-size
+(one Parquet row group per batch), so memory does not grow with the collection. Only the columns
+listed in EXPORTS are read: no names, prompts or raw LLM answers leave the database.
+
+analyses and file_checking are append-only: with --incremental a run exports only what was created
+since the watermark in <out>/manifest.json, and the watermark moves once the file is complete.
+users change in place, so they are always exported as a full snapshot.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from app.db import close_db, db, init_db
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+REPORT_INTERVAL = 5.0
+
+
+@dataclass(frozen=True)
+class Column:
+    name: str
+    # int, float, bool, str, datetime, or list<...> of one of them
+    type: str
+    # Dotted Mongo path, through lists of subdocuments too; the column name by default
+    path: str = ""
+
+    @property
+    def field(self) -> str:
+        return self.path or self.name
+
+
+@dataclass(frozen=True)
+class Export:
+    collection: str
+    columns: List[Column]
+    # Only documents created after the watermark are exported with --incremental
+    append_only: bool = True
+
+
+EXPORTS = {
+    "analyses": Export("analyses", [
+        Column("id", "str", "_id"),
+        Column("user_id", "int"),
+        Column("resume_digest", "str"),
+        Column("vacancy_digest", "str"),
+        Column("vacancy_digests", "list<str>"),
+        # One entry per detail: the report, the static analysis, then vacancy matches of a batch
+        Column("scores", "list<int>", "details.score"),
+        Column("ok", "list<bool>", "details.ok"),
+        Column("created_at", "datetime"),
+    ]),
+    "file_checking": Export("file_checking", [
+        Column("id", "str", "_id"),
+        Column("user_id", "int"),
+        Column("is_valid", "bool", "result.is_valid"),
+        Column("reason", "str", "result.reason"),
+        Column("created_at", "datetime"),
+    ]),
+    "users": Export("users", [
+        Column("user_id", "int", "tg_user_id"),
+        Column("accepted_rules", "bool"),
+        Column("subscription_until", "datetime"),
+        Column("one_time_full_left", "int"),
+        Column("cover_packs_left", "int"),
+        Column("hr_reviews_left", "int"),
+        Column("created_at", "datetime"),
+        Column("updated_at", "datetime"),
+    ], append_only=False),
+}
+
+
+def _get(doc: Any, path: str) -> Any:
+    for part in path.split("."):
+        if isinstance(doc, list):
+            doc = [item.get(part) if isinstance(item, dict) else None for item in doc]
+        elif isinstance(doc, dict):
+            doc = doc.get(part)
+        else:
+            return None
+    return doc
+
+
+def _convert(value: Any, type_: str) -> Any:
+    if value is None:
+        return None
+    if type_.startswith("list<"):
+        item_type = type_[5:-1]
+        return [_convert(item, item_type) for item in value] if isinstance(value, list) else None
+    if type_ == "str":
+        return str(value)
+    if type_ == "int":
+        return int(value)
+    if type_ == "float":
+        return float(value)
+    if type_ == "bool":
+        return bool(value)
+    return value
+
+
+def to_row(doc: Dict[str, Any], columns: List[Column]) -> Dict[str, Any]:
+    return {column.name: _convert(_get(doc, column.field), column.type) for column in columns}
+
+
+# Writers: one batch in, synchronous, called in a thread
+
+class JsonlWriter:
+    extension = "jsonl"
+
+    def __init__(self, path: str, columns: List[Column]) -> None:
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        for row in rows:
+            self._file.write(json.dumps(row, ensure_ascii=False, default=_json_default))
+            self._file.write("\n")
+
+    def close(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class ParquetWriter:
+    extension = "parquet"
+
+    def __init__(self, path: str, columns: List[Column]) -> None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("--format parquet needs pyarrow: pip install pyarrow")
+        self._pa = pyarrow
+        # An explicit schema: types inferred per batch could differ between row groups
+        self._schema = pyarrow.schema([(column.name, self._arrow_type(column.type)) for column in columns])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema, compression="zstd")
+
+    def _arrow_type(self, type_: str) -> Any:
+        pa = self._pa
+        if type_.startswith("list<"):
+            return pa.list_(self._arrow_type(type_[5:-1]))
+        return {
+            "int": pa.int64(), "float": pa.float64(), "bool": pa.bool_(),
+            "str": pa.string(), "datetime": pa.timestamp("ms"),
+        }[type_]
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        # Each batch is one row group
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+WRITERS: Dict[str, Callable[[str, List[Column]], Any]] = {"jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+
+# Manifest with the watermarks and the files written so far
+
+def load_manifest(out: str) -> Dict[str, Any]:
+    path = os.path.join(out, MANIFEST)
+    if not os.path.exists(path):
+        return {"collections": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(out: str, manifest: Dict[str, Any]) -> None:
+    path = os.path.join(out, MANIFEST)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+async def export_collection(export: Export, out: str, fmt: str, since: Optional[datetime], until: datetime,
+                            batch_size: int) -> Dict[str, Any]:
+    """Writes documents created in [since, until) to a new file, returns its manifest entry."""
+    query: Dict[str, Any] = {}
+    if export.append_only:
+        query["created_at"] = {**({"$gte": since} if since else {}), "$lt": until}
+    projection = {column.field: 1 for column in export.columns}
+    if "_id" not in projection:
+        projection["_id"] = 0
+
+    writer_cls = WRITERS[fmt]
+    directory = os.path.join(out, export.collection)
+    os.makedirs(directory, exist_ok=True)
+    name = f"{since:%Y%m%dT%H%M%S}_" if since else ""
+    path = os.path.join(directory, f"{name}{until:%Y%m%dT%H%M%S}.{writer_cls.extension}")
+    # Readers never see a half-written file
+    partial = f"{path}.part"
+    writer = await asyncio.to_thread(writer_cls, partial, export.columns)
+
+    rows: List[Dict[str, Any]] = []
+    count = 0
+    reported = time.monotonic()
+    try:
+        # No sort: the window is fixed, so the natural order is complete and needs no index
+        cursor = db()[export.collection].find(query, projection, batch_size=batch_size)
+        async for doc in cursor:
+            rows.append(to_row(doc, export.columns))
+            if len(rows) >= batch_size:
+                await asyncio.to_thread(writer.write, rows)
+                count += len(rows)
+                rows = []
+                if time.monotonic() - reported > REPORT_INTERVAL:
+                    reported = time.monotonic()
+                    print(f"{export.collection}: {count} exported", file=sys.stderr)
+        if rows:
+            await asyncio.to_thread(writer.write, rows)
+            count += len(rows)
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        await asyncio.to_thread(writer.close)
+        os.remove(partial)
+        raise
+    os.replace(partial, path)
+
+    return {
+        "path": os.path.relpath(path, out),
+        "rows": count,
+        "since": since.isoformat() if since else None,
+        "until": until.isoformat(),
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    load_dotenv()
+    settings = get_settings()
+    await init_db(settings.mongo_dsn, settings.db_name)
+    os.makedirs(args.out, exist_ok=True)
+    manifest = load_manifest(args.out)
+
+    # Documents get created_at before their insert lands: leave in-flight ones to the next run
+    until = datetime.now() - timedelta(seconds=args.lag)
+    try:
+        for name in args.collections:
+            export = EXPORTS[name]
+            state = manifest["collections"].setdefault(name, {"watermark": None, "files": []})
+            since = None
+            if args.incremental and export.append_only and state["watermark"]:
+                since = datetime.fromisoformat(state["watermark"])
+            started = time.monotonic()
+            entry = await export_collection(export, args.out, args.format, since, until, args.batch_size)
+            entry["format"] = args.format
+            state["files"].append(entry)
+            if export.append_only:
+                state["watermark"] = entry["until"]
+            save_manifest(args.out, manifest)
+            print(f"{name}: {entry['rows']} rows in {time.monotonic() - started:.1f}s -> {entry['path']}", file=sys.stderr)
+    finally:
+        close_db()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", required=True, help="Directory for the files and manifest.json")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl")
+    parser.add_argument("--collections", type=lambda v: v.split(","), default=list(EXPORTS),
+                        help=f"Comma separated, of {', '.join(EXPORTS)}")
+    parser.add_argument("--incremental", action="store_true", help="Only documents created since the last run")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Documents per cursor batch and row group")
+    parser.add_argument("--lag", type=float, default=60.0, help="Seconds before now the export window ends")
+    args = parser.parse_args()
+    unknown = set(args.collections) - set(EXPORTS)
+    if unknown:
+        parser.error(f"unknown collections: {', '.join(sorted(unknown))}")
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,541 @@
+"""
+Load test from recorded traffic: the messages collection replayed as updates into the Dispatcher.
+
+    python -m tools.replay --target-db resume_bot_replay --reset --since 2025-02-01 --limit 2000 --speed 60 --ramp 1,2,4,8
+
+Telegram and the LLM are stand-ins in a separate process, so they do not eat the CPU being measured:
+a fake Bot API server answering every method and serving sample documents, and an OpenAI compatible
+endpoint returning canned reports after --llm-latency-ms. Each ramp level replays the stream N times
+at once with shifted user and chat ids, so copies never share a chat, and reports handler latency,
+errors, event loop lag, CPU, memory and the duration of the analysis jobs it caused.
+
+Everything is written to --target-db, which must differ from the bot database. Recorded user
+documents are copied there with shifted ids; --grant gives them a subscription so analyses run.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.models import JobStatus, MessageType, User
+from app.settings import IndexCreation, LLMSettings, Settings, get_settings
+
+logger = logging.getLogger(__name__)
+
+# Added to user and chat ids of a copy; real Telegram ids stay far below it
+ID_SHIFT = 10 ** 12
+MAX_COPIES = 1000
+REPLAY_TOKEN = "123456789:REPLAY-REPLAY-REPLAY-REPLAY-REPLAY-RE"
+REPLAYED_TYPES = [MessageType.COMMAND, MessageType.TEXT, MessageType.CALLBACK, MessageType.DOCUMENT]
+LAG_PROBE_INTERVAL = 0.05
+
+CANNED_VALIDITY = {"is_valid": True, "reason": ""}
+CANNED_REPORT = {
+    "score": 72,
+    "match": 64,
+    "title": "Replay vacancy",
+    "strengths": ["Опыт работы описан с метриками", "Виден техстек"],
+    "problems": ["Нет summary в начале резюме", "Даты в разных форматах"],
+    "gaps": ["Нет опыта с Kubernetes"],
+    "actions": ["Добавьте 2–3 строки summary", "Приведите даты к формату ММ.ГГГГ"],
+    "sections": {"experience": 7, "skills": 6},
+}
+
+
+# Stand-ins, run in their own process
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve_stand_ins(telegram_port: int, llm_port: int, files: Dict[str, str],
+                     api_latency: float, llm_latency: float) -> None:
+    from aiohttp import web
+
+    stats: Counter = Counter()
+    message_ids = iter(range(1, 1 << 62))
+
+    def ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    async def bot_method(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        stats[f"telegram.{method}"] += 1
+        if api_latency:
+            await asyncio.sleep(api_latency * random.uniform(0.5, 1.5))
+        form = await request.post()
+
+        if method == "getMe":
+            return ok({"id": 123456789, "is_bot": True, "first_name": "Replay", "username": "replay_bot"})
+        if method == "getFile":
+            file_id = str(form.get("file_id", ""))
+            return ok({"file_id": file_id, "file_unique_id": file_id, "file_path": file_id,
+                       "file_size": os.path.getsize(files[file_id]) if file_id in files else 0})
+        if method.startswith("send") or method.startswith("edit"):
+            chat_id = int(form.get("chat_id") or 0)
+            return ok({"message_id": next(message_ids), "date": int(time.time()),
+                       "chat": {"id": chat_id, "type": "private"}, "text": str(form.get("text", ""))})
+        return ok(True)
+
+    async def download(request: web.Request) -> web.Response:
+        stats["telegram.download"] += 1
+        path = files.get(request.match_info["path"])
+        if path is None:
+            raise web.HTTPNotFound()
+        with open(path, "rb") as f:
+            return web.Response(body=f.read())
+
+    async def completions(request: web.Request) -> web.Response:
+        body = await request.json()
+        system = next((m["content"] for m in body.get("messages", []) if m.get("role") == "system"), "")
+        validity = "фильтр" in system
+        stats["llm.validity" if validity else "llm.analysis"] += 1
+        stats["llm.prompt_chars"] += sum(len(m.get("content", "")) for m in body.get("messages", []))
+        if llm_latency:
+            # Validity checks run on the small model: a fraction of the time
+            scale = 0.2 if validity else 1.0
+            await asyncio.sleep(llm_latency * scale * random.lognormvariate(0, 0.3))
+        content = json.dumps(CANNED_VALIDITY if validity else CANNED_REPORT, ensure_ascii=False)
+        return web.json_response({
+            "id": f"replay-{next(message_ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "replay"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(dict(stats))
+
+    async def serve() -> None:
+        telegram = web.Application(client_max_size=64 * 2 ** 20)
+        telegram.router.add_post("/bot{token}/{method}", bot_method)
+        telegram.router.add_get("/file/bot{token}/{path:.+}", download)
+        telegram.router.add_get("/stats", get_stats)
+        llm = web.Application(client_max_size=64 * 2 ** 20)
+        llm.router.add_post("/v1/chat/completions", completions)
+        llm.router.add_get("/stats", get_stats)
+        for app, port in ((telegram, telegram_port), (llm, llm_port)):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+class StandIns:
+    def __init__(self, files: Dict[str, str], api_latency: float, llm_latency: float) -> None:
+        self.telegram_url = f"http://127.0.0.1:{_free_port()}"
+        self.llm_url = f"http://127.0.0.1:{_free_port()}"
+        ports = (int(self.telegram_url.rsplit(":", 1)[1]), int(self.llm_url.rsplit(":", 1)[1]))
+        self._process = multiprocessing.get_context("spawn").Process(
+            target=_serve_stand_ins, args=(*ports, files, api_latency, llm_latency), daemon=True,
+        )
+
+    async def start(self) -> None:
+        self._process.start()
+        for _ in range(100):
+            try:
+                await self.stats()
+                return
+            except OSError:
+                await asyncio.sleep(0.1)
+        raise SystemExit("Stand-in servers did not start")
+
+    async def stats(self) -> Dict[str, int]:
+        import aiohttp
+
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{self.telegram_url}/stats") as response:
+                return await response.json()
+
+    def stop(self) -> None:
+        self._process.terminate()
+        self._process.join(5)
+
+
+# Recorded stream
+
+@dataclass
+class Recorded:
+    # Seconds after the first recorded message
+    offset: float
+    doc: Dict[str, Any]
+
+
+class Documents:
+    """Sample files served for recorded uploads, picked by extension."""
+
+    def __init__(self, directory: Optional[str], variants: int) -> None:
+        self.files: Dict[str, str] = {}
+        if directory:
+            for name in sorted(os.listdir(directory)):
+                if name.lower().endswith((".pdf", ".docx")):
+                    self.files[f"replay-{len(self.files)}{os.path.splitext(name)[1].lower()}"] = os.path.join(directory, name)
+        if not any(file_id.endswith(".docx") for file_id in self.files):
+            from tools.bench_docx_extraction import generate
+
+            out = tempfile.mkdtemp(prefix="replay-docs-")
+            for i in range(variants):
+                path = os.path.join(out, f"synthetic-{i}.docx")
+                # Different sizes, and different digests: extraction is not always a cache hit
+                generate(path, 20 + 7 * i)
+                self.files[f"replay-synthetic-{i}.docx"] = path
+
+    def pick(self, file_name: str, seed: str) -> Tuple[str, str]:
+        """A sample for a recorded file name: (file_id, file_name with the sample's extension)."""
+        ext = os.path.splitext(file_name or "")[1].lower()
+        candidates = [file_id for file_id in self.files if file_id.endswith(ext)] if ext else []
+        candidates = candidates or [file_id for file_id in self.files if file_id.endswith(".docx")]
+        file_id = candidates[zlib.crc32(seed.encode()) % len(candidates)]
+        stem = os.path.splitext(file_name or "resume")[0]
+        return file_id, stem + os.path.splitext(file_id)[1]
+
+
+async def load_stream(source: Any, since: Optional[datetime], until: Optional[datetime], limit: int) -> List[Recorded]:
+    query: Dict[str, Any] = {"type": {"$in": [str(t) for t in REPLAYED_TYPES]}}
+    if since or until:
+        query["created_at"] = {**({"$gte": since} if since else {}), **({"$lt": until} if until else {})}
+    cursor = source.messages.find(query).sort("created_at", 1).limit(limit)
+    docs = await cursor.to_list(length=limit)
+    if not docs:
+        return []
+    first = docs[0]["created_at"]
+    return [Recorded((doc["created_at"] - first).total_seconds(), doc) for doc in docs]
+
+
+def build_update(update_id: int, doc: Dict[str, Any], shift: int, documents: Documents) -> Any:
+    from aiogram.types import CallbackQuery, Chat, Document, Message, Update, User as TgUser
+
+    user = TgUser(id=doc["user_id"] + shift, is_bot=False, first_name="Replay")
+    chat = Chat(id=doc["chat_id"] + shift, type="private")
+    now = datetime.now()
+
+    if doc["type"] == MessageType.CALLBACK:
+        return Update(update_id=update_id, callback_query=CallbackQuery(
+            id=str(update_id), from_user=user, chat_instance=str(chat.id), data=doc.get("callback_data") or "",
+            message=Message(message_id=doc["message_id"], date=now, chat=chat, text=""),
+        ))
+    if doc["type"] == MessageType.DOCUMENT:
+        file_id, file_name = documents.pick(doc.get("file_name") or "", f"{doc['_id']}:{shift}")
+        return Update(update_id=update_id, message=Message(
+            message_id=doc["message_id"], date=now, chat=chat, from_user=user,
+            document=Document(file_id=file_id, file_unique_id=file_id, file_name=file_name),
+        ))
+    return Update(update_id=update_id, message=Message(
+        message_id=doc["message_id"], date=now, chat=chat, from_user=user, text=doc.get("text") or "",
+    ))
+
+
+async def seed_users(source: Any, stream: List[Recorded], shifts: List[int], grant: bool) -> None:
+    from app.db import db
+
+    user_ids = {r.doc["user_id"] for r in stream}
+    recorded = {doc["tg_user_id"]: doc async for doc in source.users.find({"tg_user_id": {"$in": list(user_ids)}})}
+    for shift in shifts:
+        for user_id in user_ids:
+            doc = dict(recorded.get(user_id) or User(
+                tg_user_id=user_id, tg_chat_id=user_id, name="replay", accepted_rules=True,
+                subscription_until=datetime.now(),
+            ).model_dump())
+            doc.pop("_id", None)
+            doc["tg_user_id"] = user_id + shift
+            doc["tg_chat_id"] = doc.get("tg_chat_id", user_id) + shift
+            if grant:
+                doc["accepted_rules"] = True
+                doc["subscription_until"] = datetime.now() + timedelta(days=365)
+            await db().users.replace_one({"tg_user_id": doc["tg_user_id"]}, doc, upsert=True)
+
+
+# One ramp level
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@dataclass
+class LevelReport:
+    copies: int
+    updates: int = 0
+    errors: int = 0
+    error_rate: float = 0.0
+    updates_per_second: float = 0.0
+    latency_p50_ms: float = 0.0
+    latency_p95_ms: float = 0.0
+    latency_p99_ms: float = 0.0
+    latency_max_ms: float = 0.0
+    loop_lag_p99_ms: float = 0.0
+    loop_lag_max_ms: float = 0.0
+    cpu_seconds: float = 0.0
+    cpu_utilization: float = 0.0
+    max_rss_mib: float = 0.0
+    jobs_done: int = 0
+    jobs_failed: int = 0
+    jobs_pending: int = 0
+    job_p50_s: float = 0.0
+    job_p95_s: float = 0.0
+    wall_seconds: float = 0.0
+    error_types: Dict[str, int] = field(default_factory=dict)
+    stand_in_calls: Dict[str, int] = field(default_factory=dict)
+
+
+class LagProbe:
+    def __init__(self) -> None:
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            self.lags.append(time.monotonic() - started - LAG_PROBE_INTERVAL)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+async def _wait_jobs(since: datetime, timeout: float) -> Dict[str, Any]:
+    from app.db import db
+
+    deadline = time.monotonic() + timeout
+    active = {"created_at": {"$gte": since}, "status": {"$in": [JobStatus.QUEUED, JobStatus.RUNNING]}}
+    while time.monotonic() < deadline and await db().jobs.count_documents(active):
+        await asyncio.sleep(0.5)
+
+    durations: List[float] = []
+    counts: Counter = Counter()
+    async for job in db().jobs.find({"created_at": {"$gte": since}}, {"status": 1, "created_at": 1, "updated_at": 1}):
+        counts[job["status"]] += 1
+        if job["status"] == JobStatus.DONE:
+            durations.append((job["updated_at"] - job["created_at"]).total_seconds())
+    return {
+        "jobs_done": counts[JobStatus.DONE],
+        "jobs_failed": counts[JobStatus.FAILED],
+        "jobs_pending": counts[JobStatus.QUEUED] + counts[JobStatus.RUNNING],
+        "job_p50_s": _percentile(durations, 0.5),
+        "job_p95_s": _percentile(durations, 0.95),
+    }
+
+
+async def run_level(dp: Any, bot: Any, stream: List[Recorded], documents: Documents, stand_ins: StandIns,
+                    level: int, copies: int, args: argparse.Namespace) -> LevelReport:
+    shifts = [(level * MAX_COPIES + k + 1) * ID_SHIFT for k in range(copies)]
+    report = LevelReport(copies=copies)
+    latencies: List[float] = []
+    errors: Counter = Counter()
+    update_ids = iter(range(level * 10 ** 9, (level + 1) * 10 ** 9))
+
+    async def feed(update: Any) -> None:
+        started = time.monotonic()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        latencies.append(time.monotonic() - started)
+
+    async def replay_copy(shift: int) -> None:
+        tasks = []
+        started = time.monotonic()
+        due, previous = 0.0, 0.0
+        for record in stream:
+            if args.speed > 0:
+                # Idle hours of the recording are cut to --max-gap
+                due += min((record.offset - previous) / args.speed, args.max_gap)
+                previous = record.offset
+                delay = started + due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            update = build_update(next(update_ids), record.doc, shift, documents)
+            tasks.append(asyncio.create_task(feed(update)))
+        await asyncio.gather(*tasks)
+
+    from app.db import db
+
+    await seed_users(db().client[args.source_db], stream, shifts, args.grant)
+    calls_before = await stand_ins.stats()
+    since = datetime.now()
+    probe = LagProbe()
+    probe.start()
+    cpu_started, wall_started = time.process_time(), time.monotonic()
+
+    await asyncio.gather(*(replay_copy(shift) for shift in shifts))
+    jobs = await _wait_jobs(since, args.drain_timeout)
+
+    report.wall_seconds = time.monotonic() - wall_started
+    report.cpu_seconds = time.process_time() - cpu_started
+    await probe.stop()
+    calls_after = await stand_ins.stats()
+
+    report.updates = len(latencies)
+    report.errors = sum(errors.values())
+    report.error_rate = report.errors / max(1, report.updates)
+    report.updates_per_second = report.updates / max(report.wall_seconds, 1e-9)
+    report.latency_p50_ms = _percentile(latencies, 0.5) * 1000
+    report.latency_p95_ms = _percentile(latencies, 0.95) * 1000
+    report.latency_p99_ms = _percentile(latencies, 0.99) * 1000
+    report.latency_max_ms = max(latencies, default=0.0) * 1000
+    report.loop_lag_p99_ms = _percentile(probe.lags, 0.99) * 1000
+    report.loop_lag_max_ms = max(probe.lags, default=0.0) * 1000
+    report.cpu_utilization = report.cpu_seconds / max(report.wall_seconds, 1e-9)
+    # ru_maxrss is in KiB on Linux; PDF worker processes are not included
+    report.max_rss_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    report.error_types = dict(errors)
+    report.stand_in_calls = {k: v - calls_before.get(k, 0) for k, v in calls_after.items() if v != calls_before.get(k, 0)}
+    for key, value in jobs.items():
+        setattr(report, key, value)
+    return report
+
+
+def print_reports(reports: List[LevelReport]) -> None:
+    columns = [
+        ("copies", "copies", "{:>6}"), ("updates", "updates", "{:>8}"), ("upd/s", "updates_per_second", "{:>7.1f}"),
+        ("err%", "error_rate", "{:>6.1%}"), ("p50ms", "latency_p50_ms", "{:>7.0f}"), ("p95ms", "latency_p95_ms", "{:>7.0f}"),
+        ("p99ms", "latency_p99_ms", "{:>7.0f}"), ("lag99", "loop_lag_p99_ms", "{:>6.0f}"), ("lagmax", "loop_lag_max_ms", "{:>7.0f}"),
+        ("cpu%", "cpu_utilization", "{:>6.0%}"), ("rssMiB", "max_rss_mib", "{:>7.0f}"), ("jobs", "jobs_done", "{:>5}"),
+        ("jfail", "jobs_failed", "{:>5}"), ("jpend", "jobs_pending", "{:>5}"), ("job95s", "job_p95_s", "{:>7.1f}"),
+    ]
+    widths = [len(fmt.format(0)) for _, _, fmt in columns]
+    print(" ".join(title.rjust(width) for (title, _, _), width in zip(columns, widths)))
+    for report in reports:
+        print(" ".join(fmt.format(getattr(report, attr)) for _, attr, fmt in columns))
+        if report.error_types:
+            print(f"    errors: {report.error_types}")
+
+
+def _replay_settings(settings: Settings, stand_ins: StandIns, args: argparse.Namespace) -> Settings:
+    outbound = settings.outbound
+    if args.no_pacing:
+        outbound = outbound.model_copy(update={
+            "global_rate": 1e6, "global_burst": 10 ** 6, "private_chat_rate": 1e6, "private_chat_burst": 10 ** 6,
+        })
+    return settings.model_copy(update={
+        "db_name": args.target_db,
+        "telegram_token": REPLAY_TOKEN,
+        "telegram_api_url": stand_ins.telegram_url,
+        "llm_settings": LLMSettings(
+            base_url=f"{stand_ins.llm_url}/v1", api_key="replay", general_model="replay-general", small_model="replay-small",
+        ),
+        "data_dir": tempfile.mkdtemp(prefix="replay-uploads-"),
+        "index_creation": IndexCreation.STARTUP,
+        "sentry_dsn": None,
+        "metrics_port": None,
+        "outbound": outbound,
+        "jobs": settings.jobs.model_copy(update={"embedded": True, "concurrency": args.job_concurrency or settings.jobs.concurrency}),
+    })
+
+
+async def async_main(args: argparse.Namespace) -> List[LevelReport]:
+    from app.bootstrap import build_bot, build_dispatcher, ensure_indexes
+    from app.cv_analyzer.llm.client import close_clients
+    from app.db import close_db, db, init_db
+    from app.jobs import JobWorkerPool
+
+    settings = get_settings()
+    args.source_db = settings.db_name
+    if args.target_db == settings.db_name:
+        raise SystemExit("--target-db must differ from the bot database")
+
+    documents = Documents(args.documents, args.variants)
+    stand_ins = StandIns(documents.files, args.api_latency_ms / 1000, args.llm_latency_ms / 1000)
+    await stand_ins.start()
+    settings = _replay_settings(settings, stand_ins, args)
+
+    await init_db(settings.mongo_dsn, settings.db_name)
+    if args.reset:
+        await db().client.drop_database(settings.db_name)
+    await ensure_indexes(settings)
+
+    stream = await load_stream(db().client[args.source_db], args.since, args.until, args.limit)
+    if not stream:
+        raise SystemExit("No recorded messages match")
+    span = stream[-1].offset
+    print(f"{len(stream)} recorded updates over {span / 60:.1f} min, "
+          f"replayed in about {span / args.speed / 60 if args.speed else 0:.1f} min per level", file=sys.stderr)
+
+    bot = build_bot(settings)
+    dp = build_dispatcher(settings)
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot], **dp.workflow_data)
+    pool = JobWorkerPool(bot, settings)
+    pool.start()
+
+    reports: List[LevelReport] = []
+    try:
+        for level, copies in enumerate(args.ramp):
+            print(f"Level {level + 1}/{len(args.ramp)}: {copies} copies", file=sys.stderr)
+            reports.append(await run_level(dp, bot, stream, documents, stand_ins, level, copies, args))
+    finally:
+        await pool.stop(timeout=5)
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot], **dp.workflow_data)
+        await bot.session.close()
+        await close_clients()
+        close_db()
+        stand_ins.stop()
+    return reports
+
+
+def _date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target-db", required=True, help="Database the replay writes to")
+    parser.add_argument("--reset", action="store_true", help="Drop --target-db first")
+    parser.add_argument("--since", type=_date)
+    parser.add_argument("--until", type=_date)
+    parser.add_argument("--limit", type=int, default=5000)
+    parser.add_argument("--speed", type=float, default=60.0, help="Time compression, 0 replays without pauses")
+    parser.add_argument("--max-gap", type=float, default=5.0, help="Longest pause between two updates, after compression")
+    parser.add_argument("--ramp", type=lambda v: [int(x) for x in v.split(",")], default=[1, 2, 4, 8],
+                        help="Parallel copies of the stream per level")
+    parser.add_argument("--grant", action="store_true", help="Give replayed users accepted rules and a subscription")
+    parser.add_argument("--documents", help="Directory with sample PDF/DOCX files served for uploads")
+    parser.add_argument("--variants", type=int, default=20, help="Synthetic DOCX samples without --documents")
+    parser.add_argument("--llm-latency-ms", type=float, default=8000)
+    parser.add_argument("--api-latency-ms", type=float, default=40)
+    parser.add_argument("--no-pacing", action="store_true", help="Turn off outbound rate limits, to load the handlers alone")
+    parser.add_argument("--job-concurrency", type=int)
+    parser.add_argument("--drain-timeout", type=float, default=300, help="Seconds to wait for the jobs of a level")
+    parser.add_argument("--json", help="Write the reports to this file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if max(args.ramp) > MAX_COPIES:
+        parser.error(f"at most {MAX_COPIES} copies per level")
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    load_dotenv()
+    reports = asyncio.run(async_main(args))
+    print_reports(reports)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(report) for report in reports], f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
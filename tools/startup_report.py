@@ -0,0 +1,85 @@
+"""
+Import time of the bot entrypoint, from `python -X importtime`.
+
+    python -m tools.startup_report --top 25
+    python -m tools.startup_report --budget-ms 600 --forbid pdfminer,docx,openai,json_repair
+
+Exits with 1 when the total is over --budget-ms or a forbidden module is imported at startup,
+so a heavy import sneaking back in fails CI.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from dataclasses import dataclass, asdict
+from typing import List
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def measure(entrypoint: str) -> List[ImportTiming]:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {entrypoint}"],
+        capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"Importing {entrypoint} failed:\n{proc.stderr[-2000:]}")
+
+    timings: List[ImportTiming] = []
+    for line in proc.stderr.splitlines():
+        # import time:       self [us] |  cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append(ImportTiming(
+            module=name.strip(),
+            self_us=int(self_us),
+            cumulative_us=int(cumulative_us),
+            depth=(len(name) - len(name.lstrip())) // 2,
+        ))
+    return timings
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    # app.__main__ imports the bot modules inside main(), once the metrics environment is set
+    parser.add_argument("--entrypoint", default="app.__main__, app.bootstrap")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float)
+    parser.add_argument("--forbid", default="", help="Comma separated top-level packages not allowed at startup")
+    parser.add_argument("--json", help="Write all timings to this file, to diff between commits")
+    args = parser.parse_args()
+
+    timings = measure(args.entrypoint)
+    total_ms = sum(t.cumulative_us for t in timings if t.depth == 0) / 1000
+
+    print(f"{args.entrypoint}: {total_ms:.0f} ms of imports, {len(timings)} modules")
+    print(f"\n{'cumulative ms':>14} {'self ms':>8}  module")
+    top_level = sorted((t for t in timings if t.depth <= 1), key=lambda t: t.cumulative_us, reverse=True)
+    for t in top_level[:args.top]:
+        print(f"{t.cumulative_us / 1000:>14.1f} {t.self_us / 1000:>8.1f}  {'  ' * t.depth}{t.module}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([asdict(t) for t in timings], f, indent=1)
+
+    failed = False
+    forbidden = {name.strip() for name in args.forbid.split(",") if name.strip()}
+    imported = {t.module.split(".")[0] for t in timings}
+    for name in sorted(forbidden & imported):
+        print(f"\nFAIL: {name} is imported at startup")
+        failed = True
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"\nFAIL: {total_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())